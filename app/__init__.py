@@ -10,7 +10,14 @@ def create_app():
     app.config.from_object(Config)
     app.secret_key = Config.SECRET_KEY
 
+    from app.history import load_tokenizer, set_tokenizer
+    set_tokenizer(load_tokenizer(Config.TOKENIZER))
+
     from app import routes
     app.register_blueprint(routes.bp)
 
+    if Config.PRELOAD_SDKS:
+        from app.llm_providers import preload_sdks
+        preload_sdks()
+
     return app
@@ -0,0 +1,210 @@
+from flask import request, session
+from app import create_app
+from app.fanout import amultiplex
+from app.race import Racer, arace_stream
+from app.routes import get_llm_provider, get_conversation_id
+from app.sse import sse_event, ChunkCoalescer, SSE_HEADERS, RECONNECT
+from app.stream_sessions import async_stream_sessions, parse_event_id, StreamGone
+from asgiref.wsgi import WsgiToAsgi
+from contextlib import aclosing
+import asyncio
+import io
+import json
+import logging
+import sys
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+def _build_environ(scope):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _is_streaming_chat(scope):
+    if scope['type'] != 'http' or scope['path'] != '/chat' or scope['method'] != 'GET':
+        return False
+    query = parse_qs(scope['query_string'].decode('latin1'))
+    return query.get('use_streaming', [''])[0] == 'true'
+
+
+class AsgiApp:
+    # Serves streaming /chat requests as coroutines on the event loop using
+    # the providers' async SDK clients, so an open SSE stream costs a task
+    # rather than a worker thread. Every other request, including the
+    # non-streaming /chat, /clear_history and static files, goes to the Flask
+    # app unchanged.
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if _is_streaming_chat(scope):
+            return await self._chat_stream(scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _open_streams(self, scope, resume):
+        # Runs inside a Flask request context so the session (and with it the
+        # conversation id) is resolved exactly as in the WSGI route.
+        with self.flask_app.request_context(_build_environ(scope)):
+            owner = get_conversation_id()
+            response = self.flask_app.response_class(content_type='text/event-stream')
+            self.flask_app.session_interface.save_session(self.flask_app, session, response)
+            headers = [(name.lower().encode('latin1'), value.encode('latin1'))
+                       for name, value in response.headers.items()]
+            if resume:
+                return owner, headers, None
+
+            message = request.args.get('message')
+            providers = json.loads(request.args.get('providers'))
+            use_reasoning = request.args.get('use_reasoning') == 'true'
+            reasoning_mode = request.args.get('reasoning_mode')
+            race = request.args.get('race') == 'true'
+            logger.debug(f"Received async chat request: message_length={len(message or '')}, providers={providers}, use_reasoning={use_reasoning}, race={race}")
+
+            llms = {provider: get_llm_provider(provider, model, reasoning_mode) for provider, model in providers.items()}
+
+        def open_stream(provider, model):
+            return lambda: llms[provider].agenerate_stream(message, model, use_reasoning)
+
+        def open_events(timeout):
+            # Race mode announces only the winner, once it is known.
+            if race:
+                racers = [Racer(llms[provider], model, message, use_reasoning) for provider, model in providers.items()]
+                return [], arace_stream(racers, timeout)
+            streams = {provider: open_stream(provider, model) for provider, model in providers.items()}
+            return list(providers), amultiplex(streams, timeout)
+
+        return owner, headers, open_events
+
+    def _frames(self, scope, resume, owner, open_events):
+        # The frames to relay to this connection: a new stream session, or
+        # the rest of the one named by Last-Event-ID.
+        if resume:
+            stream_id, sequence = parse_event_id(resume)
+            stream = async_stream_sessions.get(stream_id, owner) if stream_id else None
+            logger.debug(f"Resuming stream {stream_id} after event {sequence}: {'found' if stream else 'expired'}")
+            if stream is None:
+                return _expired()
+            return _follow(stream, sequence)
+
+        async def produce(should_stop):
+            coalescer = ChunkCoalescer(heartbeat=0)
+            try:
+                started, events = open_events(coalescer.timeout)
+                yield RECONNECT + ''.join(sse_event({'type': 'start', 'provider': provider}) for provider in started)
+                async with aclosing(events):
+                    async for provider, kind, value in events:
+                        if should_stop():
+                            return
+                        if kind == 'start':
+                            yield sse_event({'type': 'start', 'provider': provider})
+                        else:
+                            yield coalescer.tick() if kind == 'idle' else coalescer.push(provider, kind, value)
+            except Exception as e:
+                logger.error(f"Error in async generate: {str(e)}")
+                yield coalescer.flush() + sse_event({'type': 'error', 'provider': None, 'content': f"Error: {str(e)}"})
+            yield sse_event({'type': 'end'})
+
+        return _follow(async_stream_sessions.astart(owner, produce), 0)
+
+    async def _chat_stream(self, scope, receive, send):
+        resume = _header(scope, b'last-event-id')
+        try:
+            # Loading the providers reads their history from the store.
+            owner, headers, open_events = await asyncio.to_thread(self._open_streams, scope, resume)
+        except Exception as e:
+            logger.error(f"Unexpected error in async chat route: {str(e)}")
+            headers = [(b'content-type', b'text/event-stream')]
+            frames = _error(e)
+        else:
+            frames = self._frames(scope, resume, owner, open_events)
+
+        extra = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in SSE_HEADERS.items()]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers + extra})
+
+        async def relay():
+            async with aclosing(frames):
+                async for frame in frames:
+                    await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        # A disconnect only detaches this connection from the stream session;
+        # the provider streams are closed once it has had no listeners for
+        # STREAM_RESUME_GRACE seconds.
+        relayer = asyncio.create_task(relay())
+        watcher = asyncio.create_task(wait_for_disconnect())
+        done, pending = await asyncio.wait({relayer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if relayer in done:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        else:
+            logger.debug("Client disconnected from the stream")
+
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key.lower() == name:
+            return value.decode('latin1')
+    return None
+
+
+async def _follow(stream, sequence):
+    try:
+        async for frame in stream.follow(sequence):
+            yield frame
+    except StreamGone as e:
+        logger.debug(f"Cannot resume stream {stream.id}: {str(e)}")
+        async for frame in _expired():
+            yield frame
+
+
+async def _error(e):
+    yield sse_event({'type': 'error', 'provider': None, 'content': f"Error: {str(e)}"})
+    yield sse_event({'type': 'end'})
+
+
+def _expired():
+    return _error("the stream has expired, send the message again")
+
+
+def create_asgi_app(flask_app=None):
+    return AsgiApp(flask_app or create_app())
@@ -0,0 +1,171 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.llm_providers import get_provider_class
+from app.response_cache import get_response_cache
+from app.history import count_tokens
+import csv
+import io
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ['id', 'provider', 'model', 'status', 'latency', 'prompt_tokens', 'completion_tokens', 'response', 'error']
+FORMATS = ('jsonl', 'csv')
+
+
+def read_prompts(lines):
+    # Each line is {"prompt": ..., "id": optional, "providers": optional
+    # {provider: model} overriding the batch default}; blank lines are skipped.
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {number}: {str(e)}")
+        if not isinstance(item, dict) or not isinstance(item.get('prompt'), str):
+            raise ValueError(f"Line {number} needs a string 'prompt'")
+        item.setdefault('id', number)
+        yield item
+
+
+def plan_jobs(prompts, providers):
+    for item in prompts:
+        for provider, model in (item.get('providers') or providers).items():
+            yield {'id': item['id'], 'prompt': item['prompt'], 'provider': provider, 'model': model}
+
+
+def job_key(job):
+    return (str(job['id']), job['provider'], job['model'])
+
+
+def run_job(job, use_reasoning=False):
+    # Every job is a fresh, stateless conversation; the call still goes
+    # through the response cache, coalescing, resilience and rate limiting.
+    row = {'id': job['id'], 'provider': job['provider'], 'model': job['model'],
+           'prompt_tokens': count_tokens(job['prompt']), 'completion_tokens': None,
+           'response': None, 'error': None}
+    start = time.perf_counter()
+    try:
+        provider_class = get_provider_class(job['provider'])
+        if provider_class is None:
+            raise ValueError(f"Unknown provider: {job['provider']}")
+        if not provider_class.is_configured():
+            raise ValueError(f"No API key configured for provider: {job['provider']}")
+        llm = provider_class(cache=get_response_cache())
+        if use_reasoning:
+            response = llm.generate_response_with_reasoning(job['prompt'], job['model'])
+        else:
+            response = llm.generate_response(job['prompt'], job['model'])
+        row.update(status='ok', response=response, completion_tokens=count_tokens(response))
+    except Exception as e:
+        logger.error(f"Batch job {job['id']} failed for {job['provider']}/{job['model']}: {str(e)}")
+        row.update(status='error', error=str(e))
+    row['latency'] = round(time.perf_counter() - start, 4)
+    return row
+
+
+def run_batch(jobs, concurrency=8, use_reasoning=False, completed=()):
+    """Run ``jobs`` with at most ``concurrency`` calls in flight and yield
+    result rows in completion order. Jobs whose key is in ``completed`` are
+    skipped; jobs are pulled from the iterator lazily, so large prompt files
+    are never held in memory.
+    """
+    completed = set(completed)
+    jobs = (job for job in jobs if job_key(job) not in completed)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch') as executor:
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(run_job, job, use_reasoning))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def format_for_path(path, default='jsonl'):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else default
+
+
+def format_row(row, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, fieldnames=FIELDS).writerow(row)
+        return buffer.getvalue()
+    return json.dumps(row) + '\n'
+
+
+def csv_header():
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, fieldnames=FIELDS).writeheader()
+    return buffer.getvalue()
+
+
+def _complete_rows(text, fmt):
+    # Parses the rows of an output file, dropping a trailing row cut short by
+    # a crash.
+    if fmt == 'csv':
+        rows = []
+        try:
+            for row in csv.DictReader(io.StringIO(text, newline=''), strict=True):
+                if None in row or None in row.values():
+                    break
+                rows.append(row)
+        except csv.Error:
+            pass
+        return rows
+    return [json.loads(line) for line in text.split('\n')[:-1] if line.strip()]
+
+
+def load_checkpoint(path, fmt):
+    """Return the keys of the jobs already answered successfully in the
+    output file at ``path``. The output doubles as the checkpoint: every row
+    is synced to disk as soon as its call finishes. The file is rewritten
+    with its complete rows, so a row cut short by a crash is dropped. Failed
+    jobs run again on resume and their new rows are appended, so the last
+    row for a key wins.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = _complete_rows(f.read(), fmt)
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            f.write(csv_header())
+        for row in rows:
+            f.write(format_row(row, fmt))
+    os.replace(temporary, path)
+    return {(str(row['id']), row['provider'], row['model']) for row in rows if row['status'] == 'ok'}
+
+
+class ResultWriter:
+    # Appends formatted rows to ``path``, flushing and syncing each one so
+    # the file is a reliable checkpoint.
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', encoding='utf-8', newline='')
+        if new and fmt == 'csv':
+            self.file.write(csv_header())
+
+    def write(self, row):
+        self.file.write(format_row(row, self.fmt))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+import socket
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelScope:
+    """Cancellation of work running on another thread.
+
+    A thread reading a provider stream only sees a stop flag at its next
+    chunk, which may be a long time coming when the upstream stalls. Code
+    running inside the scope (see ``entered()``) registers callbacks with
+    ``on_cancel()`` that release whatever it is blocked on, and the thread
+    that gives up on the work calls ``cancel()``, which runs them at once.
+    A scope may also carry a ``deadline`` (on the time.monotonic() clock)
+    that blocking calls pass on to the SDK as their timeout; see
+    request_timeout().
+    """
+
+    def __init__(self, deadline=None):
+        self.cancelled = False
+        self.deadline = deadline
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        # Callbacks run under the lock, so one whose block is exiting
+        # concurrently has either run to completion or will not run at all.
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            for callback in self._callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.debug(f"Cancel callback failed: {str(e)}")
+            self._callbacks = []
+
+    def expired(self):
+        return self.cancelled or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def _register(self, callback):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._callbacks.append(callback)
+            return True
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @contextmanager
+    def entered(self):
+        # Makes this the current thread's scope for the block.
+        previous = current_scope()
+        _local.scope = self
+        try:
+            yield self
+        finally:
+            _local.scope = previous
+
+
+def current_scope():
+    return getattr(_local, 'scope', None)
+
+
+def is_cancelled():
+    # True when the current thread's work has been given up on: its scope
+    # was cancelled or its deadline has passed.
+    scope = current_scope()
+    return scope is not None and scope.expired()
+
+
+def request_timeout():
+    # Seconds left before the current scope's deadline, for blocking SDK
+    # calls that cannot be aborted from another thread; None without one.
+    scope = current_scope()
+    if scope is None or scope.deadline is None:
+        return None
+    return max(0.01, scope.deadline - time.monotonic())
+
+
+@contextmanager
+def on_cancel(callback):
+    # Calls ``callback`` if the current thread's scope is cancelled while the
+    # block runs, or straight away if it already is. Outside a scope this
+    # does nothing. The error the callback causes in the block comes out as
+    # Cancelled, so it is not mistaken for an upstream failure.
+    scope = current_scope()
+    if scope is not None and not scope._register(callback):
+        callback()
+    try:
+        yield
+    except Exception as e:
+        if scope is not None and scope.cancelled:
+            raise Cancelled("cancelled by the caller") from e
+        raise
+    finally:
+        if scope is not None:
+            scope._unregister(callback)
+
+
+def abort_response(response):
+    # Closing an httpx response does not wake a thread blocked reading it;
+    # shutting its socket down does.
+    network_stream = response.extensions.get('network_stream')
+    sock = network_stream.get_extra_info('socket') if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
@@ -0,0 +1,68 @@
+import importlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Process-wide SDK clients keyed by (provider, api_key). The SDK clients are
+# thread-safe and each owns an HTTP connection pool, so sharing them keeps
+# keep-alive connections warm across requests instead of paying for a new
+# TLS handshake on every chat turn.
+_clients = {}
+_sdks = {}
+_gemini_models = {}
+_gemini_configured_key = None
+_lock = threading.Lock()
+_import_lock = threading.Lock()
+
+
+def load_sdk(module_name):
+    # Provider SDKs are imported on first use, so a worker only pays the
+    # import cost for the providers it actually serves. First imports are
+    # serialized: the SDKs share dependencies (pydantic, httpx), and two
+    # threads importing them at once can see partially initialized modules.
+    module = _sdks.get(module_name)
+    if module is None:
+        with _import_lock:
+            module = _sdks.get(module_name)
+            if module is None:
+                module = importlib.import_module(module_name)
+                _sdks[module_name] = module
+    return module
+
+
+def get_client(name, api_key, factory):
+    key = (name, api_key)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                logger.debug(f"Creating shared {name} client")
+                client = factory(api_key=api_key)
+                _clients[key] = client
+    return client
+
+
+def get_gemini_model(genai, model, api_key):
+    global _gemini_configured_key
+    key = (model, api_key)
+    genai_model = _gemini_models.get(key)
+    if genai_model is None:
+        with _lock:
+            if _gemini_configured_key != api_key:
+                genai.configure(api_key=api_key)
+                _gemini_configured_key = api_key
+            genai_model = _gemini_models.get(key)
+            if genai_model is None:
+                genai_model = genai.GenerativeModel(model)
+                _gemini_models[key] = genai_model
+    return genai_model
+
+
+def clear_clients():
+    global _gemini_configured_key
+    with _lock:
+        _clients.clear()
+        _gemini_models.clear()
+        _gemini_configured_key = None
@@ -0,0 +1,271 @@
+from app.cancellation import CancelScope, on_cancel
+from app.metrics import coalesced_requests
+from contextlib import aclosing
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class FlightAbandoned(Exception):
+    pass
+
+
+def flight_key(provider, model, kind, messages):
+    return (provider, model, kind, tuple((message['role'], message['content']) for message in messages))
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.finished = False
+        self.subscribers = 1
+        self.leader_left = False
+        # The upstream stream's own cancel scope, cancelled once nobody
+        # follows the flight.
+        self.scope = CancelScope()
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.finished = True
+            self.cond.notify_all()
+
+    def wait(self):
+        with self.cond:
+            while not self.finished:
+                self.cond.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def follow(self):
+        # Replays the chunks published so far, then the rest as they arrive.
+        index = 0
+        while True:
+            with self.cond:
+                while index == len(self.chunks) and not self.finished:
+                    self.cond.wait()
+                pending = self.chunks[index:]
+                finished = self.finished
+            index += len(pending)
+            yield from pending
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    # Identical in-flight provider calls share one upstream call. The first
+    # caller (the leader) makes the call; callers arriving while it is in
+    # flight wait for its result, or for streams subscribe to its chunks with
+    # a replay of everything received so far. Finished flights are dropped
+    # immediately, so this never serves stale output; that is the response
+    # cache's job.
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                return flight, True
+            flight.subscribers += 1
+            return flight, False
+
+    def _complete(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def _leave(self, key, flight):
+        # Returns True when nobody is left waiting on the flight.
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and self._flights.get(key) is flight:
+                del self._flights[key]
+                return True
+            return False
+
+    def call(self, key, fn):
+        flight, leader = self._join(key)
+        if not leader:
+            coalesced_requests.inc(key[0], key[1], key[2])
+            return flight.wait()
+        try:
+            result = fn()
+        except Exception as e:
+            self._complete(key, flight, error=e)
+            raise
+        self._complete(key, flight, result=result)
+        return result
+
+    def stream(self, key, open_stream):
+        flight, leader = self._join(key)
+        if not leader:
+            coalesced_requests.inc(key[0], key[1], key[2])
+            try:
+                yield from flight.follow()
+            finally:
+                self._leave(key, flight)
+            return
+
+        try:
+            stream = open_stream()
+            # The upstream registers its cancel callbacks with the flight, so
+            # cancelling the leader's caller only aborts it if nobody else
+            # follows.
+            with on_cancel(lambda: self._abandon_upstream(key, flight)):
+                while True:
+                    with flight.scope.entered():
+                        chunk = next(stream, _END)
+                    if chunk is _END:
+                        break
+                    flight.publish(chunk)
+                    yield chunk
+        except GeneratorExit:
+            self._drain(key, flight, stream)
+            raise
+        except Exception as e:
+            self._complete(key, flight, error=e)
+            raise
+        else:
+            self._complete(key, flight)
+
+    def _abandon(self, key, flight):
+        # The leader's own caller went away, through its cancel scope or by
+        # closing the stream, whichever comes first. Returns True when
+        # nobody else follows the flight.
+        with self._lock:
+            left, flight.leader_left = flight.leader_left, True
+        if left:
+            return flight.subscribers == 0
+        return self._leave(key, flight)
+
+    def _abandon_upstream(self, key, flight):
+        if self._abandon(key, flight):
+            flight.scope.cancel()
+
+    def _drain(self, key, flight, stream):
+        # The leader's own consumer went away. Keep feeding the followers
+        # from the upstream stream, or close it if there are none.
+        if self._abandon(key, flight):
+            stream.close()
+            flight.finish(error=FlightAbandoned("upstream call abandoned"))
+            return
+        try:
+            for chunk in stream:
+                flight.publish(chunk)
+                if flight.subscribers == 0:
+                    stream.close()
+                    flight.finish(error=FlightAbandoned("upstream call abandoned"))
+                    return
+        except Exception as e:
+            self._complete(key, flight, error=e)
+        else:
+            self._complete(key, flight)
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.chunks = []
+        self.error = None
+        self.finished = False
+        self.subscribers = 1
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.error = error
+        self.finished = True
+        self._notify()
+
+    async def follow(self):
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class AsyncSingleFlight:
+    # Event-loop counterpart of SingleFlight for the ASGI streaming path. The
+    # upstream stream runs in a task owned by the flight and every caller,
+    # the first one included, only follows it, so cancelling a caller (a
+    # lost race, a cancelled multiplex pump) never finalizes the shared
+    # stream under the others. The task is cancelled once nobody follows.
+    def __init__(self):
+        self._flights = {}
+
+    def _leave(self, key, flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and self._flights.get(key) is flight:
+            del self._flights[key]
+            return True
+        return False
+
+    def _complete(self, key, flight, error=None):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.finish(error)
+
+    async def _pump(self, key, flight, open_stream):
+        try:
+            async with aclosing(open_stream()) as stream:
+                async for chunk in stream:
+                    flight.publish(chunk)
+        except asyncio.CancelledError:
+            self._complete(key, flight, FlightAbandoned("upstream call abandoned"))
+            raise
+        except Exception as e:
+            self._complete(key, flight, e)
+        else:
+            self._complete(key, flight)
+
+    async def stream(self, key, open_stream):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            flight.task = asyncio.get_running_loop().create_task(self._pump(key, flight, open_stream))
+        else:
+            flight.subscribers += 1
+            coalesced_requests.inc(key[0], key[1], key[2])
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+        finally:
+            if self._leave(key, flight) and not flight.finished:
+                flight.task.cancel()
+
+
+single_flight = SingleFlight()
+async_single_flight = AsyncSingleFlight()
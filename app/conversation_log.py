@@ -0,0 +1,167 @@
+from config import Config
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_ORDERS = ('rank', 'recent')
+
+
+def match_query(text):
+    # Quotes every term so user input is never parsed as FTS5 syntax
+    # ("c++", "AND", unbalanced quotes); the terms are ANDed. A trailing *
+    # keeps its prefix-match meaning.
+    terms = []
+    for term in text.split():
+        prefix = term.endswith('*') and len(term) > 1
+        term = term.rstrip('*') if prefix else term
+        terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+class ConversationLog:
+    """Append-only log of every conversation turn, with full-text search.
+
+    Turns are queued by ``record()`` and written by a background thread, which
+    commits whatever has accumulated in one transaction (up to
+    ``batch_size`` rows), so the request path never waits on disk. When the
+    queue is full, turns are dropped and counted rather than blocking. The
+    database is SQLite in WAL mode, so searches never block the writer. An
+    external-content FTS5 table indexes the message text without storing it
+    twice.
+    """
+
+    def __init__(self, path, batch_size=500, max_queue=100000):
+        self.path = path
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    id INTEGER PRIMARY KEY,
+                    conversation_id TEXT,
+                    provider TEXT NOT NULL,
+                    model TEXT,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    latency REAL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, id)")
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts
+                USING fts5(content, content='turns', content_rowid='id')
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+                    INSERT INTO turns_fts (rowid, content) VALUES (new.id, new.content);
+                END
+            """)
+        self._writer = threading.Thread(target=self._run, name='conversation-log', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, conversation_id, provider, model, role, content, latency=None):
+        try:
+            self._queue.put_nowait((conversation_id, provider, model, role, content, latency, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Conversation log queue full, {self.dropped} turns dropped")
+
+    def _run(self):
+        conn = self._connection()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            rows = [row for row in batch if row is not None]
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO turns (conversation_id, provider, model, role, content, latency, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                    )
+                self.written += len(rows)
+            except Exception as e:
+                logger.error(f"Error writing {len(rows)} turns to the conversation log: {str(e)}")
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        # Blocks until every turn recorded so far has been written.
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def search(self, text, provider=None, model=None, conversation_id=None, order='rank', limit=50, offset=0):
+        if order not in SEARCH_ORDERS:
+            raise ValueError(f"Unknown search order: {order}")
+        query = match_query(text)
+        if not query:
+            return []
+        sql = """
+            SELECT t.id, t.conversation_id, t.provider, t.model, t.role, t.latency, t.created_at,
+                   snippet(turns_fts, 0, '[', ']', '...', 16)
+            FROM turns_fts JOIN turns t ON t.id = turns_fts.rowid
+            WHERE turns_fts MATCH ?
+        """
+        params = [query]
+        for column, value in (('provider', provider), ('model', model), ('conversation_id', conversation_id)):
+            if value is not None:
+                sql += f" AND t.{column} = ?"
+                params.append(value)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?" if order == 'rank' else " ORDER BY t.id DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        rows = self._connection().execute(sql, params).fetchall()
+        return [
+            {'id': row[0], 'conversation_id': row[1], 'provider': row[2], 'model': row[3], 'role': row[4],
+             'latency': row[5], 'created_at': row[6], 'snippet': row[7]}
+            for row in rows
+        ]
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'queued': self._queue.qsize()}
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_conversation_log():
+    global _log
+    if not Config.CONVERSATION_LOG:
+        return None
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = ConversationLog(Config.CONVERSATION_LOG_PATH, batch_size=Config.CONVERSATION_LOG_BATCH_SIZE,
+                                       max_queue=Config.CONVERSATION_LOG_MAX_QUEUE)
+                logger.debug(f"Logging conversations to {Config.CONVERSATION_LOG_PATH}")
+    return _log
@@ -0,0 +1,144 @@
+from collections import OrderedDict, deque
+from config import Config
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    def append(self, conversation_id, provider, message):
+        raise NotImplementedError
+
+    def load(self, conversation_id, provider, limit=None):
+        raise NotImplementedError
+
+    def clear(self, conversation_id, provider):
+        raise NotImplementedError
+
+
+class MemoryConversationStore(ConversationStore):
+    # In-process store, LRU-evicted by conversation. Only suitable for a
+    # single worker process; use the SQLite backend when running several.
+    def __init__(self, max_conversations=1000, max_messages=200):
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, conversation_id, provider, message):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                conversation = self._conversations[conversation_id] = {}
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            else:
+                self._conversations.move_to_end(conversation_id)
+            messages = conversation.get(provider)
+            if messages is None:
+                messages = conversation[provider] = deque(maxlen=self.max_messages)
+            messages.append(dict(message))
+
+    def load(self, conversation_id, provider, limit=None):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                return []
+            self._conversations.move_to_end(conversation_id)
+            messages = list(conversation.get(provider, ()))
+        if limit is not None:
+            messages = messages[-limit:] if limit else []
+        return [dict(message) for message in messages]
+
+    def clear(self, conversation_id, provider):
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is not None:
+                conversation.pop(provider, None)
+
+
+class SQLiteConversationStore(ConversationStore):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS messages_conversation
+                ON messages (conversation_id, provider, id)
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, conversation_id, provider, message):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO messages (conversation_id, provider, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, provider, message['role'], message['content'], time.time())
+            )
+
+    def load(self, conversation_id, provider, limit=None):
+        rows = self._connection().execute(
+            """
+            SELECT role, content FROM (
+                SELECT id, role, content FROM messages
+                WHERE conversation_id = ? AND provider = ?
+                ORDER BY id DESC LIMIT ?
+            ) ORDER BY id
+            """,
+            (conversation_id, provider, -1 if limit is None else limit)
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def clear(self, conversation_id, provider):
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND provider = ?",
+                (conversation_id, provider)
+            )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_store(backend, **options):
+    if backend == 'memory':
+        return MemoryConversationStore(**options)
+    elif backend == 'sqlite':
+        return SQLiteConversationStore(**options)
+    else:
+        raise ValueError(f"Unknown conversation store backend: {backend}")
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if Config.CONVERSATION_STORE == 'sqlite':
+                    _store = create_store('sqlite', path=Config.CONVERSATION_DB_PATH)
+                else:
+                    _store = create_store(Config.CONVERSATION_STORE,
+                                          max_conversations=Config.CONVERSATION_CACHE_SIZE)
+                logger.debug(f"Using {Config.CONVERSATION_STORE} conversation store")
+    return _store
@@ -0,0 +1,177 @@
+from concurrent.futures import ThreadPoolExecutor
+from app.cancellation import CancelScope, Cancelled
+import asyncio
+import queue
+import threading
+import time
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Shared across requests so a timed-out call never blocks the response on
+# executor shutdown; it simply finishes (or fails) in the background.
+_executor = ThreadPoolExecutor(max_workers=Config.FANOUT_MAX_WORKERS, thread_name_prefix='fanout')
+# Stream pumps hold their thread for the whole generation, so they get their
+# own pool and never starve the non-streaming calls above.
+_stream_executor = ThreadPoolExecutor(max_workers=Config.STREAM_MAX_WORKERS, thread_name_prefix='stream')
+
+
+class FanOutTimeout(Exception):
+    pass
+
+
+def fan_out(calls, timeout=None):
+    """Run ``calls`` (a mapping of key -> zero-argument callable) concurrently.
+
+    Returns a mapping of key -> (ok, value) where ``value`` is either the
+    call's result or the exception it raised. Calls still running
+    ``timeout`` seconds after they started, or still queued for a worker
+    ``timeout`` seconds after fan_out() was called, are reported as
+    ``FanOutTimeout`` so the caller can return partial results. Each call
+    runs in a CancelScope with that deadline and is cancelled when it times
+    out, so it gives its worker back; a queued one never starts.
+    """
+    if timeout is None:
+        timeout = Config.PROVIDER_TIMEOUT
+
+    submitted = time.monotonic()
+    scopes = {key: CancelScope() for key in calls}
+    started = {}
+    changed = threading.Event()
+
+    def run(key, call):
+        scope = scopes[key]
+        if scope.cancelled:
+            raise Cancelled("not started before the timeout")
+        started[key] = time.monotonic()
+        scope.deadline = started[key] + timeout
+        changed.set()
+        with scope.entered():
+            return call()
+
+    futures = {key: _executor.submit(run, key, call) for key, call in calls.items()}
+    for future in futures.values():
+        future.add_done_callback(lambda _: changed.set())
+
+    timed_out = set()
+    while True:
+        changed.clear()
+        now = time.monotonic()
+        waits = []
+        for key, future in futures.items():
+            if future.done() or key in timed_out:
+                continue
+            remaining = started.get(key, submitted) + timeout - now
+            if remaining <= 0:
+                timed_out.add(key)
+                scopes[key].cancel()
+            else:
+                waits.append(remaining)
+        if all(future.done() or key in timed_out for key, future in futures.items()):
+            break
+        changed.wait(min(waits) if waits else None)
+
+    results = {}
+    for key, future in futures.items():
+        if key in timed_out:
+            if key in started:
+                logger.error(f"Call for {key} timed out after {timeout}s")
+                results[key] = (False, FanOutTimeout(f"timed out after {timeout:g}s"))
+            else:
+                logger.error(f"Call for {key} waited {timeout}s for a worker")
+                results[key] = (False, FanOutTimeout(f"not started within {timeout:g}s, all workers busy"))
+        elif future.exception() is not None:
+            results[key] = (False, future.exception())
+        else:
+            results[key] = (True, future.result())
+    return results
+
+
+def multiplex(streams, timeout=None):
+    """Consume ``streams`` (key -> zero-argument callable returning an
+    iterator) concurrently and yield ``(key, kind, value)`` tuples in arrival
+    order, where ``kind`` is ``'chunk'``, ``'done'`` or ``'error'``.
+
+    ``timeout`` is an optional zero-argument callable returning how long to
+    wait for the next event (or None to wait indefinitely); when that wait
+    runs out, ``(None, 'idle', None)`` is yielded instead. If the consumer
+    stops early, pending streams are cancelled: providers that registered
+    their HTTP response with the cancel scope have it closed at once, the
+    rest are closed at their next chunk.
+    """
+    events = queue.Queue()
+    stop = CancelScope()
+
+    def pump(key, open_stream):
+        # A stream still queued for a worker when the consumer stopped is
+        # never opened.
+        if stop.cancelled:
+            return
+        try:
+            with stop.entered():
+                stream = open_stream()
+                try:
+                    for chunk in stream:
+                        if stop.cancelled:
+                            return
+                        events.put((key, 'chunk', chunk))
+                finally:
+                    close = getattr(stream, 'close', None)
+                    if close is not None:
+                        close()
+            events.put((key, 'done', None))
+        except Exception as e:
+            events.put((key, 'error', e))
+
+    for key, open_stream in streams.items():
+        _stream_executor.submit(pump, key, open_stream)
+
+    try:
+        remaining = len(streams)
+        while remaining:
+            try:
+                key, kind, value = events.get(timeout=timeout() if timeout else None)
+            except queue.Empty:
+                yield None, 'idle', None
+                continue
+            if kind != 'chunk':
+                remaining -= 1
+            yield key, kind, value
+    finally:
+        stop.cancel()
+
+
+async def amultiplex(streams, timeout=None):
+    # asyncio counterpart of multiplex(): ``streams`` maps key -> zero-argument
+    # callable returning an async iterator. Pending streams are cancelled if
+    # the consumer stops early.
+    events = asyncio.Queue()
+
+    async def pump(key, open_stream):
+        try:
+            async for chunk in open_stream():
+                await events.put((key, 'chunk', chunk))
+            await events.put((key, 'done', None))
+        except Exception as e:
+            await events.put((key, 'error', e))
+
+    tasks = [asyncio.create_task(pump(key, open_stream)) for key, open_stream in streams.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            wait_for = timeout() if timeout else None
+            if not events.empty() or wait_for is None:
+                key, kind, value = await events.get()
+            else:
+                try:
+                    key, kind, value = await asyncio.wait_for(events.get(), wait_for)
+                except asyncio.TimeoutError:
+                    yield None, 'idle', None
+                    continue
+            if kind != 'chunk':
+                remaining -= 1
+            yield key, kind, value
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from config import Config
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def chat_turns(messages):
+    # The (role, content) pairs Gemini sees; other roles are not sent.
+    return [(message['role'], message['content']) for message in messages
+            if message['role'] in ('user', 'assistant')]
+
+
+def to_gemini_content(role, content):
+    return {"role": "model" if role == 'assistant' else "user", "parts": [{"text": content}]}
+
+
+def _overlap(turns, history):
+    # How many leading turns to drop so the remaining ones are a prefix of
+    # ``history`` (the token-budgeted window slides forward as it fills), or
+    # None if the session has diverged from the conversation.
+    for start in range(len(turns)):
+        rest = len(turns) - start
+        if rest <= len(history) and turns[start] == history[0] and turns[start:] == history[:rest]:
+            return start
+    return None
+
+
+class GeminiSession:
+    # A chat session and the (role, content) turns its history mirrors.
+    def __init__(self, chat, turns):
+        self.chat = chat
+        self.turns = turns
+
+    def sync(self, history):
+        # Brings the chat history in line with ``history`` by dropping turns
+        # that fell out of the window and converting only the new ones.
+        # Returns False if the session cannot be reused.
+        start = _overlap(self.turns, history) if history else None
+        if start is None:
+            return False
+        chat_history = self.chat.history
+        del chat_history[:start]
+        rest = len(self.turns) - start
+        chat_history.extend(to_gemini_content(role, content) for role, content in history[rest:])
+        self.turns = list(history)
+        return True
+
+
+class GeminiSessionCache:
+    """Chat sessions kept across turns, one per conversation and model.
+
+    A session is checked out for the duration of a call, so concurrent calls
+    never share one, and only checked back in once the reply has arrived in
+    full; a failed or abandoned call simply drops it. Each turn then sends
+    the existing history plus the new message instead of rebuilding the
+    Gemini-format history and the chat from the whole conversation.
+    """
+
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def checkout(self, key, history, start_chat):
+        session = None
+        if key is not None:
+            with self._lock:
+                session = self._sessions.pop(key, None)
+        if session is not None and session.sync(history):
+            return session
+        if session is not None:
+            logger.debug(f"Rebuilding Gemini chat session for {key}")
+        contents = [to_gemini_content(role, content) for role, content in history]
+        return GeminiSession(start_chat(contents), list(history))
+
+    def checkin(self, key, session, message, response):
+        if key is None:
+            return
+        try:
+            # Folds the last request and reply into the chat history; raises
+            # if the reply was cut short.
+            session.chat.history
+        except Exception as e:
+            logger.debug(f"Dropping Gemini chat session for {key}: {str(e)}")
+            return
+        session.turns.extend([('user', message), ('assistant', response)])
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+
+gemini_sessions = GeminiSessionCache(Config.GEMINI_SESSION_CACHE_SIZE)
@@ -0,0 +1,87 @@
+from collections import deque
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-message overhead (role, separators) added by chat formats.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; good enough for
+    # budgeting and needs neither a network call nor a tokenizer download.
+    return (len(text) + 3) // 4
+
+
+_tokenizer = estimate_tokens
+
+
+def set_tokenizer(tokenizer):
+    global _tokenizer
+    _tokenizer = tokenizer or estimate_tokens
+
+
+def count_tokens(text):
+    return _tokenizer(text)
+
+
+def load_tokenizer(name):
+    if name == 'tiktoken':
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning("tiktoken is not installed; falling back to the estimating tokenizer")
+            return estimate_tokens
+        encoding = tiktoken.get_encoding('cl100k_base')
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens
+
+
+def token_budget(provider, model=None):
+    if model is not None and model in Config.HISTORY_MODEL_TOKEN_BUDGETS:
+        return Config.HISTORY_MODEL_TOKEN_BUDGETS[model]
+    return Config.HISTORY_TOKEN_BUDGETS.get(provider, Config.HISTORY_DEFAULT_TOKEN_BUDGET)
+
+
+class HistoryWindow:
+    # Keeps the most recent messages whose combined token count fits in the
+    # budget. Token counts are computed once per message and kept alongside
+    # it with a running total, so appending and trimming are O(1) amortized.
+    def __init__(self, token_budget, messages=()):
+        self.token_budget = token_budget
+        self.total_tokens = 0
+        self._messages = deque()
+        self._tokens = deque()
+        for message in messages:
+            self._push(message)
+        self._trim()
+
+    def _push(self, message):
+        tokens = count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+        self._messages.append(message)
+        self._tokens.append(tokens)
+        self.total_tokens += tokens
+
+    def _trim(self):
+        # Always keep the latest message, even if it alone exceeds the budget.
+        while len(self._messages) > 1 and self.total_tokens > self.token_budget:
+            self._messages.popleft()
+            self.total_tokens -= self._tokens.popleft()
+
+    def append(self, message):
+        self._push(message)
+        self._trim()
+
+    def set_budget(self, token_budget):
+        self.token_budget = token_budget
+        self._trim()
+
+    def messages(self):
+        return list(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
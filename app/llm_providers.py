@@ -1,444 +1,640 @@
-import os
-import google.generativeai as genai
-from groq import Groq
-from anthropic import Anthropic
-from openai import OpenAI
-from cerebras.cloud.sdk import Cerebras
+from app.clients import get_client, get_gemini_model, load_sdk
+from app.cancellation import on_cancel, abort_response, request_timeout
+from app.coalesce import flight_key, single_flight, async_single_flight
+from app.rate_limit import get_limiter, estimate_request_tokens
+from app.resilience import get_policy, fallback_chain, is_unavailable
+from app.response_cache import cache_key, replay_chunks
+from app.metrics import track_request, track_stream, track_astream, track_phase, fallbacks_total, prompt_cache_tokens
+from app.conversation_log import get_conversation_log
+from app.gemini_sessions import gemini_sessions, chat_turns
+from app.history import HistoryWindow, token_budget as get_token_budget
+from app.reasoning import ReasoningPipeline
+from config import Config
+import asyncio
+import functools
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 class LLMProvider:
-    def __init__(self, max_history=10):
-        self.conversation_history = []
-        self.max_history = max_history
+    name = None
+    # SDK module imported on first use and the Config attribute holding the
+    # provider's API key.
+    sdk_module = None
+    api_key_env = None
+
+    def __init__(self, store=None, conversation_id=None, cache=None, token_budget=None, reasoning_mode=None):
+        self.history = HistoryWindow(token_budget or get_token_budget(self.name))
+        self.store = store
+        self.conversation_id = conversation_id
+        self.cache = cache
+        self.reasoning = ReasoningPipeline(self, reasoning_mode)
+        self._turn_model = None
+        self._turn_start = None
+        self._deferred = None
+
+    @property
+    def conversation_history(self):
+        return self.history.messages()
+
+    @conversation_history.setter
+    def conversation_history(self, messages):
+        self.history = HistoryWindow(self.history.token_budget, messages=messages)
+
+    def use_model_budget(self, model):
+        self.history.set_budget(get_token_budget(self.name, model))
+
+    def start_turn(self, model):
+        # Remembers the model and start time for the conversation log.
+        self.use_model_budget(model)
+        self._turn_model = model
+        self._turn_start = time.perf_counter()
 
     def generate_response(self, message, model):
-        raise NotImplementedError
+        self.start_turn(model)
+        with track_request(self.name, model, 'response') as tracker:
+            tracker['response'] = self._cached_response(message, model, False, self._generate_response)
+        return tracker['response']
 
     def generate_response_with_reasoning(self, message, model):
-        raise NotImplementedError
+        self.start_turn(model)
+        with track_request(self.name, model, 'reasoning') as tracker:
+            tracker['response'] = self._cached_response(message, model, True, self._generate_response_with_reasoning)
+        return tracker['response']
 
     def generate_stream(self, message, model, use_reasoning=False):
-        raise NotImplementedError
-
-    def add_to_history(self, role, content):
-        self.conversation_history.append({"role": role, "content": content})
-        if len(self.conversation_history) > self.max_history:
-            self.conversation_history = self.conversation_history[-self.max_history:]
+        self.start_turn(model)
+        mode = 'reasoning_stream' if use_reasoning else 'stream'
+        return track_stream(self.name, model, mode, self._cached_stream(message, model, use_reasoning))
 
-    def get_conversation_history(self):
-        return self.conversation_history
+    def agenerate_stream(self, message, model, use_reasoning=False):
+        self.start_turn(model)
+        mode = 'reasoning_stream' if use_reasoning else 'stream'
+        return track_astream(self.name, model, mode, self._acached_stream(message, model, use_reasoning))
 
-    def to_dict(self):
-        return {
-            "max_history": self.max_history,
-            "conversation_history": self.conversation_history
-        }
+    @classmethod
+    def api_key(cls):
+        return getattr(Config, cls.api_key_env)
 
     @classmethod
-    def from_dict(cls, data):
-        provider = cls(max_history=data.get("max_history", 10))
-        provider.conversation_history = data.get("conversation_history", [])
-        return provider
+    def is_configured(cls):
+        return bool(cls.api_key())
+
+    def _client(self, name, class_name):
+        # Retries are handled by the resilience policy, so the SDK's own
+        # retry loop is turned off rather than multiplied with it.
+        factory = functools.partial(getattr(load_sdk(self.sdk_module), class_name), max_retries=0)
+        return get_client(name, self.api_key(), factory)
+
+    def track_final_phase(self, model):
+        return track_phase(self.name, model)
+
+    # Provider calls go through these wrappers. Identical in-flight calls are
+    # coalesced; each call then goes to this provider or, when it is
+    # unavailable, down its fallback chain. Each attempt runs under the
+    # provider/model's retry, circuit breaker and hedging policy, and the
+    # provider's rate limiter admits every upstream request. Providers
+    # implement the underscored primitives.
+    def complete(self, messages, model):
+        if not Config.COALESCE_REQUESTS:
+            return self._routed_complete(messages, model)
+        key = flight_key(self.name, model, 'complete', messages)
+        return single_flight.call(key, lambda: self._routed_complete(messages, model))
+
+    def stream(self, messages, model):
+        if not Config.COALESCE_REQUESTS:
+            return self._routed_stream(messages, model)
+        key = flight_key(self.name, model, 'stream', messages)
+        return single_flight.stream(key, lambda: self._routed_stream(messages, model))
+
+    def astream(self, messages, model):
+        if not Config.COALESCE_REQUESTS:
+            return self._routed_astream(messages, model)
+        key = flight_key(self.name, model, 'stream', messages)
+        return async_single_flight.stream(key, lambda: self._routed_astream(messages, model))
+
+    def _routes(self, model):
+        yield self, model
+        for name, fallback_model in fallback_chain(self.name, model):
+            provider_class = get_provider_class(name)
+            if provider_class is not None and provider_class.is_configured():
+                yield provider_class(), fallback_model
+
+    def _fallback_failed(self, provider, model, error):
+        # Returns True if the next route should be tried.
+        if not is_unavailable(error):
+            return False
+        logger.warning(f"{provider.name}/{model} unavailable ({str(error)}), trying the next fallback")
+        return True
+
+    def _record_fallback(self, provider, model):
+        if provider is not self:
+            fallbacks_total.inc(self.name, model, provider.name)
+
+    def _routed_complete(self, messages, model):
+        error = None
+        for provider, route_model in self._routes(model):
+            try:
+                response = provider._resilient_complete(messages, route_model)
+            except Exception as e:
+                error = e
+                if not self._fallback_failed(provider, route_model, e):
+                    raise
+                continue
+            self._record_fallback(provider, model)
+            return response
+        raise error
+
+    def _routed_stream(self, messages, model):
+        # Falls back only while nothing has been sent to the client.
+        error = None
+        for provider, route_model in self._routes(model):
+            started = False
+            try:
+                for chunk in provider._resilient_stream(messages, route_model):
+                    if not started:
+                        started = True
+                        self._record_fallback(provider, model)
+                    yield chunk
+                return
+            except Exception as e:
+                error = e
+                if started or not self._fallback_failed(provider, route_model, e):
+                    raise
+        raise error
+
+    async def _routed_astream(self, messages, model):
+        error = None
+        for provider, route_model in self._routes(model):
+            started = False
+            try:
+                async for chunk in provider._resilient_astream(messages, route_model):
+                    if not started:
+                        started = True
+                        self._record_fallback(provider, model)
+                    yield chunk
+                return
+            except Exception as e:
+                error = e
+                if started or not self._fallback_failed(provider, route_model, e):
+                    raise
+        raise error
+
+    def _resilient_complete(self, messages, model):
+        return get_policy(self.name, model).call(lambda: self._limited_complete(messages, model))
+
+    def _resilient_stream(self, messages, model):
+        return get_policy(self.name, model).stream(lambda: self._limited_stream(messages, model))
+
+    def _resilient_astream(self, messages, model):
+        return get_policy(self.name, model).astream(lambda: self._limited_astream(messages, model))
+
+    def _limited_complete(self, messages, model):
+        return get_limiter(self.name).call(lambda: self._complete(messages, model),
+                                           estimate_request_tokens(messages), model)
+
+    def _limited_stream(self, messages, model):
+        return get_limiter(self.name).stream(lambda: self._stream(messages, model),
+                                             estimate_request_tokens(messages), model)
+
+    def _limited_astream(self, messages, model):
+        return get_limiter(self.name).astream(lambda: self._astream(messages, model),
+                                              estimate_request_tokens(messages), model)
+
+    def _complete(self, messages, model):
+        raise NotImplementedError
 
-class GroqProvider(LLMProvider):
-    def __init__(self, max_history=10):
-        super().__init__(max_history)
-        self.client = Groq(api_key=os.environ.get('GROQ_API_KEY'))
+    def _stream(self, messages, model):
+        raise NotImplementedError
 
-    def generate_response(self, message, model):
+    async def _astream(self, messages, model):
+        # Fallback for providers without a native async client: drive the
+        # sync stream from the default executor one chunk at a time.
+        loop = asyncio.get_running_loop()
+        stream = self._stream(messages, model)
+        done = object()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, next, stream, done)
+                if chunk is done:
+                    break
+                yield chunk
+        finally:
+            stream.close()
+
+    def _generate_response(self, message, model):
         try:
             self.add_to_history("user", message)
-            chat_completion = self.client.chat.completions.create(
-                messages=self.get_conversation_history(),
-                model=model,
-            )
-            response = chat_completion.choices[0].message.content
+            response = self.complete(self.get_conversation_history(), model)
             self.add_to_history("assistant", response)
             return response
         except Exception as e:
-            logger.error(f"Error in GroqProvider.generate_response: {str(e)}")
+            logger.error(f"Error in {type(self).__name__}.generate_response: {str(e)}")
             raise
 
-    def generate_response_with_reasoning(self, message, model):
+    def _generate_response_with_reasoning(self, message, model):
         try:
+            history = self.get_conversation_history()
             self.add_to_history("user", message)
-            reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-            reasoning_completion = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": reasoning_prompt}],
-                model=model,
-            )
-            reasoning_response = reasoning_completion.choices[0].message.content
-
-            final_prompt = f"Based on the following reasoning, provide a final response:\n\nReasoning:\n{reasoning_response}\n\nFinal response:"
-            final_completion = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": final_prompt}],
-                model=model,
-            )
-            final_response = final_completion.choices[0].message.content
-
+            response, final_response = self.reasoning.respond(history, message, model)
             self.add_to_history("assistant", final_response)
-            return f"Reasoning:\n{reasoning_response}\n\nFinal Response:\n{final_response}"
+            return response
         except Exception as e:
-            logger.error(f"Error in GroqProvider.generate_response_with_reasoning: {str(e)}")
+            logger.error(f"Error in {type(self).__name__}.generate_response_with_reasoning: {str(e)}")
             raise
 
-    def generate_stream(self, message, model, use_reasoning=False):
+    def _generate_stream(self, message, model, use_reasoning=False):
         try:
+            history = self.get_conversation_history()
+            # The user turn is saved together with the answer, so a stream
+            # that fails or is abandoned leaves no unanswered turn behind.
+            self.defer_history()
             self.add_to_history("user", message)
             if use_reasoning:
-                reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-                reasoning_stream = self.client.chat.completions.create(
-                    messages=[{"role": "user", "content": reasoning_prompt}],
-                    model=model,
-                    stream=True,
-                )
-                yield "Reasoning:\n"
-                for chunk in reasoning_stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-
-                final_prompt = f"Based on the reasoning, provide a final response."
-                final_stream = self.client.chat.completions.create(
-                    messages=[{"role": "user", "content": final_prompt}],
-                    model=model,
-                    stream=True,
+                yield from self.reasoning.stream(
+                    history, message, model,
+                    on_final=lambda final: self.add_to_history("assistant", final)
                 )
-                yield "\n\nFinal Response:\n"
-                for chunk in final_stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
             else:
-                stream = self.client.chat.completions.create(
-                    messages=self.get_conversation_history(),
-                    model=model,
-                    stream=True,
-                )
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-        except Exception as e:
-            logger.error(f"Error in GroqProvider.generate_stream: {str(e)}")
-            raise
-
-class GeminiProvider(LLMProvider):
-    def __init__(self, max_history=10):
-        super().__init__(max_history)
-        genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
-
-    def generate_response(self, message, model):
-        try:
-            self.add_to_history("user", message)
-            
-            gemini_history = []
-            for entry in self.get_conversation_history():
-                if entry['role'] == 'user':
-                    gemini_history.append({"role": "user", "parts": [{"text": entry['content']}]})
-                elif entry['role'] == 'assistant':
-                    gemini_history.append({"role": "model", "parts": [{"text": entry['content']}]})
-
-            genai_model = genai.GenerativeModel(model)
-            chat = genai_model.start_chat(history=gemini_history)
-            response = chat.send_message(message)
-            self.add_to_history("assistant", response.text)
-            return response.text
-        except Exception as e:
-            logger.error(f"Error in GeminiProvider.generate_response: {str(e)}")
-            raise
-
-    def generate_response_with_reasoning(self, message, model):
-        try:
-            self.add_to_history("user", message)
-            
-            reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-            genai_model = genai.GenerativeModel(model)
-            reasoning_response = genai_model.generate_content(reasoning_prompt).text
-
-            final_prompt = f"Based on the following reasoning, provide a final response:\n\nReasoning:\n{reasoning_response}\n\nFinal response:"
-            final_response = genai_model.generate_content(final_prompt).text
-
-            self.add_to_history("assistant", final_response)
-            return f"Reasoning:\n{reasoning_response}\n\nFinal Response:\n{final_response}"
+                yield from self.record_stream(self.stream(self.get_conversation_history(), model))
+            self.commit_history()
         except Exception as e:
-            logger.error(f"Error in GeminiProvider.generate_response_with_reasoning: {str(e)}")
+            logger.error(f"Error in {type(self).__name__}.generate_stream: {str(e)}")
             raise
+        finally:
+            self._deferred = None
 
-    def generate_stream(self, message, model, use_reasoning=False):
+    async def _agenerate_stream(self, message, model, use_reasoning=False):
         try:
+            history = self.get_conversation_history()
+            self.defer_history()
             self.add_to_history("user", message)
-            
-            gemini_history = []
-            for entry in self.get_conversation_history():
-                if entry['role'] == 'user':
-                    gemini_history.append({"role": "user", "parts": [{"text": entry['content']}]})
-                elif entry['role'] == 'assistant':
-                    gemini_history.append({"role": "model", "parts": [{"text": entry['content']}]})
-
-            genai_model = genai.GenerativeModel(model)
-            
             if use_reasoning:
-                reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-                yield "Reasoning:\n"
-                for chunk in genai_model.generate_content(reasoning_prompt, stream=True):
-                    if chunk.text:
-                        yield chunk.text
-                
-                final_prompt = f"Based on the reasoning, provide a final response."
-                yield "\n\nFinal Response:\n"
-                for chunk in genai_model.generate_content(final_prompt, stream=True):
-                    if chunk.text:
-                        yield chunk.text
+                final = []
+                async for chunk in self.reasoning.astream(history, message, model, on_final=final.append):
+                    yield chunk
+                if final:
+                    self.add_to_history("assistant", final[0])
             else:
-                chat = genai_model.start_chat(history=gemini_history)
-                for chunk in chat.send_message(message, stream=True):
-                    if chunk.text:
-                        yield chunk.text
+                async for chunk in self.arecord_stream(self.astream(self.get_conversation_history(), model)):
+                    yield chunk
+            await self.acommit_history()
         except Exception as e:
-            logger.error(f"Error in GeminiProvider.generate_stream: {str(e)}")
+            logger.error(f"Error in {type(self).__name__}.agenerate_stream: {str(e)}")
             raise
-
-class AnthropicProvider(LLMProvider):
-    def __init__(self, max_history=10):
-        super().__init__(max_history)
-        self.client = Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
-
-    def generate_response(self, message, model):
-        try:
+        finally:
+            self._deferred = None
+
+    def _cache_key(self, message, model, use_reasoning):
+        messages = self.conversation_history + [{"role": "user", "content": message}]
+        return cache_key(self.name, model, messages, self.reasoning.mode if use_reasoning else False)
+
+    def _cached_stream(self, message, model, use_reasoning):
+        if self.cache is None:
+            yield from self._generate_stream(message, model, use_reasoning)
+            return
+
+        key = self._cache_key(message, model, use_reasoning)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield from replay_chunks(cached["response"])
             self.add_to_history("user", message)
-            prompt = "\n\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in self.get_conversation_history()])
-            prompt += "\n\nAssistant:"
-            response = self.client.completions.create(
-                model=model,
-                prompt=prompt,
-                max_tokens_to_sample=300
-            )
-            self.add_to_history("assistant", response.completion)
-            return response.completion
-        except Exception as e:
-            logger.error(f"Error in AnthropicProvider.generate_response: {str(e)}")
-            raise
-
-    def generate_response_with_reasoning(self, message, model):
-        try:
+            self.add_to_history("assistant", cached["assistant"])
+            return
+
+        chunks = []
+        for chunk in self._generate_stream(message, model, use_reasoning):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.set(key, {"response": "".join(chunks), "assistant": self.history.messages()[-1]["content"]})
+
+    async def _acached_stream(self, message, model, use_reasoning):
+        if self.cache is None:
+            async for chunk in self._agenerate_stream(message, model, use_reasoning):
+                yield chunk
+            return
+
+        key = self._cache_key(message, model, use_reasoning)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            for chunk in replay_chunks(cached["response"]):
+                yield chunk
+            await self.aadd_to_history("user", message)
+            await self.aadd_to_history("assistant", cached["assistant"])
+            return
+
+        chunks = []
+        async for chunk in self._agenerate_stream(message, model, use_reasoning):
+            chunks.append(chunk)
+            yield chunk
+        await asyncio.to_thread(self.cache.set, key,
+                                {"response": "".join(chunks), "assistant": self.history.messages()[-1]["content"]})
+
+    def _cached_response(self, message, model, use_reasoning, generate):
+        if self.cache is None:
+            return generate(message, model)
+
+        key = self._cache_key(message, model, use_reasoning)
+        cached = self.cache.get(key)
+        if cached is not None:
             self.add_to_history("user", message)
-            reasoning_prompt = f"Reason step-by-step about the following message: {message}\n\nAssistant:"
-            reasoning_response = self.client.completions.create(
-                model=model,
-                prompt=reasoning_prompt,
-                max_tokens_to_sample=300
-            ).completion
-
-            final_prompt = f"Based on the following reasoning, provide a final response:\n\nReasoning:\n{reasoning_response}\n\nFinal response:\n\nAssistant:"
-            final_response = self.client.completions.create(
-                model=model,
-                prompt=final_prompt,
-                max_tokens_to_sample=300
-            ).completion
+            self.add_to_history("assistant", cached["assistant"])
+            return cached["response"]
 
-            self.add_to_history("assistant", final_response)
-            return f"Reasoning:\n{reasoning_response}\n\nFinal Response:\n{final_response}"
-        except Exception as e:
-            logger.error(f"Error in AnthropicProvider.generate_response_with_reasoning: {str(e)}")
-            raise
+        response = generate(message, model)
+        self.cache.set(key, {"response": response, "assistant": self.history.messages()[-1]["content"]})
+        return response
 
-    def generate_stream(self, message, model, use_reasoning=False):
-        try:
-            self.add_to_history("user", message)
-            if use_reasoning:
-                reasoning_prompt = f"Reason step-by-step about the following message: {message}\n\nAssistant:"
-                reasoning_stream = self.client.completions.create(
-                    model=model,
-                    prompt=reasoning_prompt,
-                    max_tokens_to_sample=300,
-                    stream=True
-                )
-                yield "Reasoning:\n"
-                for completion in reasoning_stream:
-                    if completion.completion:
-                        yield completion.completion
-
-                final_prompt = f"Based on the reasoning, provide a final response.\n\nAssistant:"
-                final_stream = self.client.completions.create(
-                    model=model,
-                    prompt=final_prompt,
-                    max_tokens_to_sample=300,
-                    stream=True
-                )
-                yield "\n\nFinal Response:\n"
-                for completion in final_stream:
-                    if completion.completion:
-                        yield completion.completion
-            else:
-                prompt = "\n\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in self.get_conversation_history()])
-                prompt += "\n\nAssistant:"
-                stream = self.client.completions.create(
-                    model=model,
-                    prompt=prompt,
-                    max_tokens_to_sample=300,
-                    stream=True
-                )
-                for completion in stream:
-                    if completion.completion:
-                        yield completion.completion
-        except Exception as e:
-            logger.error(f"Error in AnthropicProvider.generate_stream: {str(e)}")
-            raise
-
-class OpenAIProvider(LLMProvider):
-    def __init__(self, max_history=10):
-        super().__init__(max_history)
-        self.client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-
-    def generate_response(self, message, model):
-        try:
-            self.add_to_history("user", message)
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=self.get_conversation_history()
-            )
-            assistant_response = response.choices[0].message.content
-            self.add_to_history("assistant", assistant_response)
-            return assistant_response
-        except Exception as e:
-            logger.error(f"Error in OpenAIProvider.generate_response: {str(e)}")
-            raise
-
-    def generate_response_with_reasoning(self, message, model):
-        try:
-            self.add_to_history("user", message)
-            reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-            reasoning_response = self.client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": reasoning_prompt}]
-            ).choices[0].message.content
-
-            final_prompt = f"Based on the following reasoning, provide a final response:\n\nReasoning:\n{reasoning_response}\n\nFinal response:"
-            final_response = self.client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": final_prompt}]
-            ).choices[0].message.content
-
-            self.add_to_history("assistant", final_response)
-            return f"Reasoning:\n{reasoning_response}\n\nFinal Response:\n{final_response}"
-        except Exception as e:
-            logger.error(f"Error in OpenAIProvider.generate_response_with_reasoning: {str(e)}")
-            raise
-
-    def generate_stream(self, message, model, use_reasoning=False):
-        try:
-            self.add_to_history("user", message)
-            if use_reasoning:
-                reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-                reasoning_stream = self.client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": reasoning_prompt}],
-                    stream=True
-                )
-                yield "Reasoning:\n"
-                for chunk in reasoning_stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-
-                final_prompt = f"Based on the reasoning, provide a final response."
-                final_stream = self.client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": final_prompt}],
-                    stream=True
-                )
-                yield "\n\nFinal Response:\n"
-                for chunk in final_stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-            else:
-                stream = self.client.chat.completions.create(
-                    model=model,
-                    messages=self.get_conversation_history(),
-                    stream=True
-                )
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-        except Exception as e:
-            logger.error(f"Error in OpenAIProvider.generate_stream: {str(e)}")
-            raise
-
-class CerebrasProvider(LLMProvider):
-    def __init__(self, max_history=10):
-        super().__init__(max_history)
-        self.client = Cerebras(api_key=os.environ.get('CEREBRAS_API_KEY'))
-
-    def generate_response(self, message, model):
-        try:
-            self.add_to_history("user", message)
-            chat_completion = self.client.chat.completions.create(
-                messages=self.get_conversation_history(),
-                model=model,
-            )
-            response = chat_completion.choices[0].message.content
-            self.add_to_history("assistant", response)
-            return response
-        except Exception as e:
-            logger.error(f"Error in CerebrasProvider.generate_response: {str(e)}")
-            raise
+    def add_to_history(self, role, content):
+        turn = self._add_turn(role, content)
+        if turn is not None:
+            self._persist(*turn)
+
+    async def aadd_to_history(self, role, content):
+        # add_to_history() for the event loop: the store and the conversation
+        # log may write to sqlite, so they run on a worker thread.
+        turn = self._add_turn(role, content)
+        if turn is not None:
+            await asyncio.to_thread(self._persist, *turn)
+
+    def _add_turn(self, role, content):
+        # Returns the (message, latency) to persist now, or None if deferred.
+        message = {"role": role, "content": content}
+        self.history.append(message)
+        latency = None
+        if role == 'assistant' and self._turn_start is not None:
+            latency = time.perf_counter() - self._turn_start
+        if self._deferred is not None:
+            self._deferred.append((message, latency))
+            return None
+        return message, latency
+
+    def _persist(self, message, latency):
+        if self.store is not None:
+            self.store.append(self.conversation_id, self.name, message)
+        log = get_conversation_log()
+        if log is not None:
+            log.record(self.conversation_id, self.name, self._turn_model, message["role"], message["content"], latency)
+
+    def defer_history(self):
+        # Holds the turns of the next call back from the store and the
+        # conversation log until commit_history(), so a call whose result
+        # never reaches the client (timed out, failed) leaves no trace.
+        self._deferred = []
+
+    def commit_history(self):
+        deferred, self._deferred = self._deferred or [], None
+        for message, latency in deferred:
+            self._persist(message, latency)
+
+    async def acommit_history(self):
+        deferred, self._deferred = self._deferred or [], None
+        for message, latency in deferred:
+            await asyncio.to_thread(self._persist, message, latency)
+
+    def record_stream(self, chunks):
+        response = []
+        for chunk in chunks:
+            response.append(chunk)
+            yield chunk
+        self.add_to_history("assistant", "".join(response))
+
+    async def arecord_stream(self, chunks):
+        response = []
+        async for chunk in chunks:
+            response.append(chunk)
+            yield chunk
+        await self.aadd_to_history("assistant", "".join(response))
 
-    def generate_response_with_reasoning(self, message, model):
-        try:
-            self.add_to_history("user", message)
-            reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-            reasoning_completion = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": reasoning_prompt}],
-                model=model,
-            )
-            reasoning_response = reasoning_completion.choices[0].message.content
-
-            final_prompt = f"Based on the following reasoning, provide a final response:\n\nReasoning:\n{reasoning_response}\n\nFinal response:"
-            final_completion = self.client.chat.completions.create(
-                messages=[{"role": "user", "content": final_prompt}],
-                model=model,
-            )
-            final_response = final_completion.choices[0].message.content
+    def get_conversation_history(self):
+        return self.conversation_history
 
-            self.add_to_history("assistant", final_response)
-            return f"Reasoning:\n{reasoning_response}\n\nFinal Response:\n{final_response}"
-        except Exception as e:
-            logger.error(f"Error in CerebrasProvider.generate_response_with_reasoning: {str(e)}")
-            raise
+    @classmethod
+    def load(cls, store, conversation_id, cache=None, token_budget=None, reasoning_mode=None):
+        provider = cls(store=store, conversation_id=conversation_id,
+                       cache=cache, token_budget=token_budget, reasoning_mode=reasoning_mode)
+        provider.conversation_history = store.load(conversation_id, cls.name, limit=Config.HISTORY_LOAD_LIMIT)
+        return provider
 
-    def generate_stream(self, message, model, use_reasoning=False):
-        try:
-            self.add_to_history("user", message)
-            if use_reasoning:
-                reasoning_prompt = f"Reason step-by-step about the following message: {message}"
-                reasoning_stream = self.client.chat.completions.create(
-                    messages=[{"role": "user", "content": reasoning_prompt}],
-                    model=model,
-                    stream=True,
-                )
-                yield "Reasoning:\n"
-                for chunk in reasoning_stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-
-                final_prompt = f"Based on the reasoning, provide a final response."
-                final_stream = self.client.chat.completions.create(
-                    messages=[{"role": "user", "content": final_prompt}],
-                    model=model,
-                    stream=True,
-                )
-                yield "\n\nFinal Response:\n"
-                for chunk in final_stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-            else:
-                stream = self.client.chat.completions.create(
-                    messages=self.get_conversation_history(),
-                    model=model,
-                    stream=True,
-                )
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
-        except Exception as e:
-            logger.error(f"Error in CerebrasProvider.generate_stream: {str(e)}")
-            raise
+def timeout_option():
+    # Blocking calls cannot be aborted from another thread, so the caller's
+    # deadline goes to the SDK as the request timeout.
+    timeout = request_timeout()
+    return {} if timeout is None else {'timeout': timeout}
+
+
+PROVIDERS = {}
+
+
+def register_provider(cls):
+    PROVIDERS[cls.name] = cls
+    return cls
+
+
+def get_provider_class(name):
+    return PROVIDERS.get(name)
+
+
+def configured_providers():
+    return [name for name, cls in PROVIDERS.items() if cls.is_configured()]
+
+
+def preload_sdks(providers=None):
+    # Imports the SDKs of the configured providers up front. Call it in the
+    # master process of a pre-fork server (e.g. gunicorn --preload) so the
+    # workers inherit the imported modules instead of each importing them on
+    # their first request.
+    for name in providers or configured_providers():
+        start = time.perf_counter()
+        load_sdk(PROVIDERS[name].sdk_module)
+        logger.debug(f"Preloaded {name} SDK in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    # Groq, OpenAI and Cerebras all speak the OpenAI chat-completions protocol,
+    # including the streaming delta format, so one engine serves all three.
+    # Subclasses only name the SDK module and client classes to build.
+    client_class = None
+    async_client_class = None
+
+    @property
+    def client(self):
+        return self._client(self.name, self.client_class)
+
+    @property
+    def async_client(self):
+        return self._client(f"{self.name}-async", self.async_client_class)
+
+    def _complete(self, messages, model):
+        chat_completion = self.client.chat.completions.create(
+            messages=messages,
+            model=model,
+            **timeout_option()
+        )
+        return chat_completion.choices[0].message.content
+
+    def _stream(self, messages, model):
+        stream = self.client.chat.completions.create(
+            messages=messages,
+            model=model,
+            stream=True,
+        )
+        # Closing the stream releases its pooled connection when the consumer
+        # stops early (a losing hedge, a disconnected client); a cancelled
+        # caller aborts it without waiting for the next chunk.
+        with stream, on_cancel(lambda: abort_response(stream.response)):
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+
+    async def _astream(self, messages, model):
+        stream = await self.async_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            stream=True,
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+
+@register_provider
+class GroqProvider(OpenAICompatibleProvider):
+    name = 'groq'
+    sdk_module = 'groq'
+    client_class = 'Groq'
+    async_client_class = 'AsyncGroq'
+    api_key_env = 'GROQ_API_KEY'
+
+@register_provider
+class OpenAIProvider(OpenAICompatibleProvider):
+    name = 'openai'
+    sdk_module = 'openai'
+    client_class = 'OpenAI'
+    async_client_class = 'AsyncOpenAI'
+    api_key_env = 'OPENAI_API_KEY'
+
+@register_provider
+class CerebrasProvider(OpenAICompatibleProvider):
+    name = 'cerebras'
+    sdk_module = 'cerebras.cloud.sdk'
+    client_class = 'Cerebras'
+    async_client_class = 'AsyncCerebras'
+    api_key_env = 'CEREBRAS_API_KEY'
+
+@register_provider
+class GeminiProvider(LLMProvider):
+    name = 'gemini'
+    sdk_module = 'google.generativeai'
+    api_key_env = 'GEMINI_API_KEY'
+
+    def get_model(self, model):
+        return get_gemini_model(load_sdk(self.sdk_module), model, self.api_key())
+
+    def _session(self, messages, model):
+        # Everything but the last message is the chat history; the last one
+        # is sent as the new turn. Sessions are reused within a conversation.
+        key = None if self.conversation_id is None else (self.conversation_id, model)
+        history = chat_turns(messages[:-1])
+        session = gemini_sessions.checkout(key, history, lambda contents: self.get_model(model).start_chat(history=contents))
+        return key, session
+
+    def _complete(self, messages, model):
+        key, session = self._session(messages, model)
+        response = session.chat.send_message(messages[-1]['content'], request_options=timeout_option() or None).text
+        gemini_sessions.checkin(key, session, messages[-1]['content'], response)
+        return response
+
+    def _stream(self, messages, model):
+        key, session = self._session(messages, model)
+        chunks = []
+        for chunk in session.chat.send_message(messages[-1]['content'], stream=True):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+        gemini_sessions.checkin(key, session, messages[-1]['content'], "".join(chunks))
+
+    async def _astream(self, messages, model):
+        key, session = self._session(messages, model)
+        chunks = []
+        response = await session.chat.send_message_async(messages[-1]['content'], stream=True)
+        async for chunk in response:
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+        gemini_sessions.checkin(key, session, messages[-1]['content'], "".join(chunks))
+
+@register_provider
+class AnthropicProvider(LLMProvider):
+    name = 'anthropic'
+    sdk_module = 'anthropic'
+    api_key_env = 'ANTHROPIC_API_KEY'
+
+    @property
+    def client(self):
+        return self._client('anthropic', 'Anthropic')
+
+    @property
+    def async_client(self):
+        return self._client('anthropic-async', 'AsyncAnthropic')
+
+    def _request(self, messages, model):
+        # The history dicts already have the Messages API shape, so they are
+        # passed through as they are. Only system prompts move to ``system``,
+        # and with prompt caching the last two user turns become cache
+        # breakpoints: the earlier one reads the prefix cached on the
+        # previous turn, the last one caches the prefix for the next turn.
+        system = []
+        turns = []
+        for message in messages:
+            if message['role'] == 'system':
+                system.append(message['content'])
+            elif message['content'] and (turns or message['role'] == 'user'):
+                turns.append(message)
+        if Config.ANTHROPIC_PROMPT_CACHING:
+            marked = 0
+            for index in range(len(turns) - 1, -1, -1):
+                if turns[index]['role'] == 'user':
+                    turns[index] = {"role": "user", "content": [{
+                        "type": "text", "text": turns[index]['content'], "cache_control": {"type": "ephemeral"},
+                    }]}
+                    marked += 1
+                    if marked == 2:
+                        break
+        request = {"model": model, "max_tokens": Config.ANTHROPIC_MAX_TOKENS, "messages": turns}
+        if system:
+            request["system"] = "\n\n".join(system)
+        return request
+
+    def _record_usage(self, model, usage):
+        prompt_cache_tokens.inc(self.name, model, 'read', amount=getattr(usage, 'cache_read_input_tokens', None) or 0)
+        prompt_cache_tokens.inc(self.name, model, 'write', amount=getattr(usage, 'cache_creation_input_tokens', None) or 0)
+
+    def _text_delta(self, event, model):
+        if event.type == 'message_start':
+            self._record_usage(model, event.message.usage)
+        elif event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+            return event.delta.text
+        return None
+
+    def _complete(self, messages, model):
+        response = self.client.messages.create(**self._request(messages, model), **timeout_option())
+        self._record_usage(model, response.usage)
+        return "".join(block.text for block in response.content if block.type == 'text')
+
+    def _stream(self, messages, model):
+        stream = self.client.messages.create(stream=True, **self._request(messages, model))
+        with stream, on_cancel(lambda: abort_response(stream.response)):
+            for event in stream:
+                text = self._text_delta(event, model)
+                if text:
+                    yield text
+
+    async def _astream(self, messages, model):
+        stream = await self.async_client.messages.create(stream=True, **self._request(messages, model))
+        async with stream:
+            async for event in stream:
+                text = self._text_delta(event, model)
+                if text:
+                    yield text
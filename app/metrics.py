@@ -0,0 +1,272 @@
+from contextlib import contextmanager
+from app.history import count_tokens
+from app.reasoning import REASONING_HEADER, FINAL_HEADER
+from config import Config
+import asyncio
+import bisect
+import threading
+import time
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+OTHER_MODEL = 'other'
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def model_label(provider, model):
+    # The model as a label or key of per-model state: a provider's first
+    # METRICS_MAX_MODELS models keep their name, any further ones share
+    # OTHER_MODEL, so made-up model names cannot grow them without bound.
+    models = _models.get(provider)
+    if models is not None and model in models:
+        return model
+    with _models_lock:
+        models = _models.setdefault(provider, set())
+        if model not in models:
+            if len(models) >= Config.METRICS_MAX_MODELS:
+                return OTHER_MODEL
+            models.add(model)
+    return model
+
+
+def _bound_model(labels, label_values):
+    # Maps the model label of a (provider, model, ...) series through
+    # model_label().
+    if labels[:2] != ('provider', 'model') or len(label_values) < 2:
+        return label_values
+    return (label_values[0], model_label(label_values[0], label_values[1])) + label_values[2:]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        label_values = _bound_model(self.labels, label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value:g}")
+        return lines
+
+
+class Histogram:
+    # Fixed-bucket histogram; an observation is one bisect and a few integer
+    # additions under a lock, cheap enough for the per-chunk streaming path.
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        label_values = _bound_model(self.labels, label_values)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for label_values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        # ``collector`` returns extra exposition lines (e.g. gauges computed
+        # from another component's state) at scrape time.
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'llm_request_duration_seconds', 'Provider call latency.',
+    labels=('provider', 'model', 'mode')))
+requests_total = registry.register(Counter(
+    'llm_requests_total', 'Provider calls by outcome.',
+    labels=('provider', 'model', 'mode', 'status')))
+time_to_first_token = registry.register(Histogram(
+    'llm_time_to_first_token_seconds', 'Time until the first streamed chunk.',
+    labels=('provider', 'model', 'mode')))
+inter_chunk_gap = registry.register(Histogram(
+    'llm_inter_chunk_gap_seconds', 'Time between consecutive streamed chunks.',
+    labels=('provider', 'model', 'mode'), buckets=GAP_BUCKETS))
+tokens_per_second = registry.register(Histogram(
+    'llm_tokens_per_second', 'Estimated output tokens per second.',
+    labels=('provider', 'model'), buckets=THROUGHPUT_BUCKETS))
+reasoning_final_phase = registry.register(Histogram(
+    'llm_reasoning_final_phase_seconds', 'Latency of the second (final answer) call in reasoning mode.',
+    labels=('provider', 'model')))
+
+coalesced_requests = registry.register(Counter(
+    'llm_coalesced_requests_total', 'Provider calls served by joining an identical in-flight call.',
+    labels=('provider', 'model', 'kind')))
+retries_total = registry.register(Counter(
+    'llm_retries_total', 'Provider calls retried after a transient error.',
+    labels=('provider', 'model')))
+hedges_total = registry.register(Counter(
+    'llm_hedges_total', 'Hedged duplicate attempts launched, and how many of them won.',
+    labels=('provider', 'model', 'outcome')))
+races_total = registry.register(Counter(
+    'llm_races_total', 'Race mode entries by outcome: won, lost (cancelled), failed or skipped (never started).',
+    labels=('provider', 'model', 'outcome')))
+fallbacks_total = registry.register(Counter(
+    'llm_fallbacks_total', 'Calls answered by a fallback provider.',
+    labels=('provider', 'model', 'fallback')))
+prompt_cache_tokens = registry.register(Counter(
+    'llm_prompt_cache_tokens_total', 'Input tokens read from or written to the provider prompt cache.',
+    labels=('provider', 'model', 'kind')))
+
+
+def _record_throughput(provider, model, text, elapsed):
+    if elapsed > 0 and text:
+        tokens_per_second.observe(count_tokens(text) / elapsed, provider, model)
+
+
+@contextmanager
+def track_request(provider, model, mode):
+    # The body may assign ``tracker['response']`` so throughput can be recorded.
+    tracker = {'response': None}
+    start = time.perf_counter()
+    try:
+        yield tracker
+    except Exception:
+        requests_total.inc(provider, model, mode, 'error')
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        request_duration.observe(elapsed, provider, model, mode)
+    requests_total.inc(provider, model, mode, 'ok')
+    _record_throughput(provider, model, tracker['response'], elapsed)
+
+
+@contextmanager
+def track_phase(provider, model):
+    start = time.perf_counter()
+    yield
+    reasoning_final_phase.observe(time.perf_counter() - start, provider, model)
+
+
+class StreamTracker:
+    def __init__(self, provider, model, mode):
+        self.provider = provider
+        self.model = model
+        self.mode = mode
+        self.start = self.last = time.perf_counter()
+        self.chunks = 0
+        self.parts = []
+
+    def on_chunk(self, chunk):
+        # The reasoning pipeline's section headers are sent without waiting
+        # for the provider, so they are not timed.
+        self.parts.append(chunk)
+        if chunk in (REASONING_HEADER, FINAL_HEADER):
+            return
+        now = time.perf_counter()
+        if self.chunks == 0:
+            time_to_first_token.observe(now - self.start, self.provider, self.model, self.mode)
+        else:
+            inter_chunk_gap.observe(now - self.last, self.provider, self.model, self.mode)
+        self.last = now
+        self.chunks += 1
+
+    def finish(self, status):
+        elapsed = time.perf_counter() - self.start
+        request_duration.observe(elapsed, self.provider, self.model, self.mode)
+        requests_total.inc(self.provider, self.model, self.mode, status)
+        if status == 'ok':
+            _record_throughput(self.provider, self.model, ''.join(self.parts), elapsed)
+
+
+def track_stream(provider, model, mode, chunks):
+    tracker = StreamTracker(provider, model, mode)
+    status = 'ok'
+    try:
+        for chunk in chunks:
+            tracker.on_chunk(chunk)
+            yield chunk
+    except GeneratorExit:
+        status = 'cancelled'
+        raise
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        tracker.finish(status)
+
+
+async def track_astream(provider, model, mode, chunks):
+    tracker = StreamTracker(provider, model, mode)
+    status = 'ok'
+    try:
+        async for chunk in chunks:
+            tracker.on_chunk(chunk)
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        status = 'cancelled'
+        raise
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        tracker.finish(status)
@@ -0,0 +1,335 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from app.cancellation import CancelScope
+from app.fanout import FanOutTimeout
+from app.metrics import track_stream, track_astream, races_total
+from app.reasoning import REASONING_HEADER, FINAL_HEADER
+from app.resilience import get_policy
+from config import Config
+import asyncio
+import queue
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Racers run here rather than in the fan-out executor, whose workers may be
+# the callers waiting on them.
+_race_executor = ThreadPoolExecutor(max_workers=Config.FANOUT_MAX_WORKERS * 2, thread_name_prefix='race')
+
+
+class NoValidAnswer(Exception):
+    pass
+
+
+def has_content(text):
+    # The reasoning pipeline sends its section headers before the provider
+    # has answered anything, so they do not count.
+    return bool(text.strip()) and text not in (REASONING_HEADER, FINAL_HEADER)
+
+
+class Racer:
+    # One provider/model in a race. It answers from the provider's history
+    # without adding to it; only the winner's turn is committed.
+    def __init__(self, llm, model, message, use_reasoning=False):
+        self.llm = llm
+        self.model = model
+        self.message = message
+        self.use_reasoning = use_reasoning
+        self.parts = []
+        self.final = None
+
+    @property
+    def name(self):
+        return self.llm.name
+
+    def estimate(self, q):
+        # Rolling time to first chunk, the same samples hedging uses.
+        return get_policy(self.name, self.model).latencies['stream'].percentile(q, Config.RACE_MIN_SAMPLES)
+
+    def _history(self):
+        self.llm.start_turn(self.model)
+        return self.llm.get_conversation_history()
+
+    def _set_final(self, final):
+        self.final = final
+
+    def stream(self):
+        history = self._history()
+        if self.use_reasoning:
+            chunks = self.llm.reasoning.stream(history, self.message, self.model, on_final=self._set_final)
+        else:
+            chunks = self.llm.stream(history + [{"role": "user", "content": self.message}], self.model)
+        return track_stream(self.name, self.model, 'reasoning_stream' if self.use_reasoning else 'stream', chunks)
+
+    def astream(self):
+        history = self._history()
+        if self.use_reasoning:
+            chunks = self.llm.reasoning.astream(history, self.message, self.model, on_final=self._set_final)
+        else:
+            chunks = self.llm.astream(history + [{"role": "user", "content": self.message}], self.model)
+        return track_astream(self.name, self.model, 'reasoning_stream' if self.use_reasoning else 'stream', chunks)
+
+    def answer(self):
+        return ''.join(self.parts)
+
+    def _turn(self):
+        # The assistant turn for the history: the final answer in reasoning
+        # mode, the whole answer otherwise.
+        return self.final if self.use_reasoning else self.answer()
+
+    def valid(self):
+        return has_content(self._turn())
+
+    def commit(self):
+        self.llm.add_to_history("user", self.message)
+        self.llm.add_to_history("assistant", self._turn())
+
+    async def acommit(self):
+        await self.llm.aadd_to_history("user", self.message)
+        await self.llm.aadd_to_history("assistant", self._turn())
+
+
+def launch_schedule(racers):
+    # (racer, delay) pairs, fastest first by rolling median time to first
+    # chunk. A racer without enough samples counts as fast, so it gets
+    # measured. Each later racer waits until the race has run past the
+    # RACE_HEDGE_PERCENTILE of the ones before it.
+    ranked = sorted(racers, key=lambda racer: racer.estimate(50) or 0.0)
+    schedule = []
+    delay = 0.0
+    for i, racer in enumerate(ranked):
+        if i and Config.RACE_HEDGE_PERCENTILE:
+            delay = max(delay, ranked[i - 1].estimate(Config.RACE_HEDGE_PERCENTILE) or 0.0)
+        schedule.append((racer, delay))
+    return schedule
+
+
+class _Race:
+    """Winner selection shared by the sync and async drivers.
+
+    Racers are started on the launch schedule until one of them starts
+    answering, or straight away once every started racer has failed. A racer
+    that errors or finishes without content is out. When ``stream`` is set
+    the first racer to send content wins and its chunks are passed on as
+    they come; otherwise the first racer to finish with a non-empty answer
+    wins. Either way, the caller commits the winner's turn to its history
+    when its ``done`` event comes out, and cancels everyone else.
+    """
+
+    def __init__(self, racers, stream):
+        self.schedule = launch_schedule(racers)
+        self.stream = stream
+        self.start = time.monotonic()
+        self.launched = []
+        self.answering = set()
+        self.errors = {}
+        self.pending = {}
+        self.winner = None
+        self.error = None
+        self.finished = False
+
+    def due(self, now):
+        if self.winner is not None:
+            return []
+        due = []
+        while len(self.launched) < len(self.schedule):
+            racer, delay = self.schedule[len(self.launched)]
+            if len(self.errors) < len(self.launched) and (self.answering or now - self.start < delay):
+                break
+            self.launched.append(racer)
+            due.append(racer)
+        return due
+
+    def next_launch(self, now):
+        # Seconds until the next scheduled start, or None.
+        if self.winner is not None or self.answering or len(self.launched) == len(self.schedule):
+            return None
+        return max(0.0, self.start + self.schedule[len(self.launched)][1] - now)
+
+    def accept(self, racer, kind, value):
+        # Returns the (provider, kind, value) events to pass on.
+        if self.finished or (self.winner is not None and racer is not self.winner):
+            return []
+        if kind == 'chunk':
+            if racer is self.winner:
+                return [(racer.name, 'chunk', value)]
+            pending = self.pending.setdefault(racer, [])
+            pending.append(value)
+            if not has_content(value):
+                return []
+            self.answering.add(racer)
+            if not self.stream:
+                return []
+            self.winner = racer
+            logger.debug(f"Race won by {racer.name}/{racer.model} after {time.monotonic() - self.start:.2f}s")
+            return [(racer.name, 'start', None), (racer.name, 'chunk', ''.join(pending))]
+        if kind == 'done':
+            if racer is self.winner or (not self.stream and racer.valid()):
+                self.winner = racer
+                self.finished = True
+                return [(racer.name, 'done', None)]
+            value = NoValidAnswer("empty response")
+        if racer is self.winner:
+            self.finished = True
+            self.errors[racer.name] = value
+            return [(racer.name, 'error', value)]
+        logger.warning(f"Race entry {racer.name}/{racer.model} is out: {str(value)}")
+        self.answering.discard(racer)
+        self.errors[racer.name] = value
+        if len(self.errors) == len(self.schedule):
+            self.finished = True
+            self.error = NoValidAnswer("; ".join(f"{name}: {str(error)}" for name, error in self.errors.items()))
+            return [(None, 'error', self.error)]
+        return []
+
+    def expire(self, error):
+        # Ends the race without a winner; racers still running count as
+        # failed.
+        self.finished = True
+        self.error = error
+        for racer in self.launched:
+            self.errors.setdefault(racer.name, error)
+
+    def record_outcomes(self):
+        if not self.finished and self.winner is None:
+            return
+        for racer, _ in self.schedule:
+            if racer.name in self.errors:
+                outcome = 'failed'
+            elif racer is self.winner:
+                outcome = 'won'
+            elif racer in self.launched:
+                outcome = 'lost'
+            else:
+                outcome = 'skipped'
+            races_total.inc(racer.name, racer.model, outcome)
+
+
+def _pump(racer, stop, events):
+    # A cancelled racer's HTTP stream is closed by the cancel scope, or at
+    # its next chunk for providers that do not register it. One cancelled
+    # while still queued for a worker is never started.
+    if stop.cancelled:
+        return
+    try:
+        with stop.entered():
+            stream = racer.stream()
+            try:
+                for chunk in stream:
+                    if stop.cancelled:
+                        return
+                    racer.parts.append(chunk)
+                    events.put((racer, 'chunk', chunk))
+            finally:
+                stream.close()
+        events.put((racer, 'done', None))
+    except Exception as e:
+        events.put((racer, 'error', e))
+
+
+def _run(race, timeout=None):
+    events = queue.Queue()
+    stops = {}
+    cancelled = False
+    try:
+        while not race.finished:
+            for racer in race.due(time.monotonic()):
+                stops[racer] = CancelScope()
+                _race_executor.submit(_pump, racer, stops[racer], events)
+            waits = [wait for wait in (race.next_launch(time.monotonic()), timeout() if timeout else None)
+                     if wait is not None]
+            try:
+                racer, kind, value = events.get(timeout=min(waits) if waits else None)
+            except queue.Empty:
+                if timeout:
+                    yield None, 'idle', None
+                continue
+            for event in race.accept(racer, kind, value):
+                if event[1] == 'done':
+                    racer.commit()
+                yield event
+            if race.winner is not None and not cancelled:
+                cancelled = True
+                for other, stop in stops.items():
+                    if other is not race.winner:
+                        stop.cancel()
+    finally:
+        for stop in stops.values():
+            stop.cancel()
+        race.record_outcomes()
+
+
+def race_stream(racers, timeout=None):
+    """Streams the first racer to send content, as ``(provider, kind,
+    value)`` events: ``start`` once the winner is known, then its chunks and
+    ``done`` or ``error``. ``(None, 'error', NoValidAnswer)`` means every
+    racer failed. ``timeout`` works as in multiplex(), yielding
+    ``(None, 'idle', None)`` when it runs out.
+    """
+    return _run(_Race(racers, stream=True), timeout)
+
+
+def race_answer(racers, timeout=None):
+    # Returns (winner, answer) for the first complete non-empty answer.
+    # Without one after ``timeout`` seconds (PROVIDER_TIMEOUT by default)
+    # the racers are cancelled and FanOutTimeout is raised.
+    if timeout is None:
+        timeout = Config.PROVIDER_TIMEOUT
+    race = _Race(racers, stream=False)
+    deadline = race.start + timeout
+    with closing(_run(race, lambda: max(0.0, deadline - time.monotonic()))) as events:
+        for _, kind, _ in events:
+            if kind == 'idle' and time.monotonic() >= deadline:
+                logger.error(f"Race timed out after {timeout}s")
+                race.expire(FanOutTimeout(f"timed out after {timeout:g}s"))
+                break
+    if race.error is not None:
+        raise race.error
+    return race.winner, race.winner.answer()
+
+
+async def arace_stream(racers, timeout=None):
+    # asyncio counterpart of race_stream(); losers are cancelled at once.
+    race = _Race(racers, stream=True)
+    events = asyncio.Queue()
+    tasks = {}
+    cancelled = False
+
+    async def pump(racer):
+        try:
+            async for chunk in racer.astream():
+                racer.parts.append(chunk)
+                await events.put((racer, 'chunk', chunk))
+            await events.put((racer, 'done', None))
+        except Exception as e:
+            await events.put((racer, 'error', e))
+
+    try:
+        while not race.finished:
+            for racer in race.due(time.monotonic()):
+                tasks[racer] = asyncio.create_task(pump(racer))
+            waits = [wait for wait in (race.next_launch(time.monotonic()), timeout() if timeout else None)
+                     if wait is not None]
+            if not events.empty() or not waits:
+                racer, kind, value = await events.get()
+            else:
+                try:
+                    racer, kind, value = await asyncio.wait_for(events.get(), min(waits))
+                except asyncio.TimeoutError:
+                    if timeout:
+                        yield None, 'idle', None
+                    continue
+            for event in race.accept(racer, kind, value):
+                if event[1] == 'done':
+                    await racer.acommit()
+                yield event
+            if race.winner is not None and not cancelled:
+                cancelled = True
+                for other, task in tasks.items():
+                    if other is not race.winner:
+                        task.cancel()
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        race.record_outcomes()
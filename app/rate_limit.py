@@ -0,0 +1,345 @@
+from collections import deque
+from app.history import count_tokens
+from app.metrics import model_label
+from config import Config
+import asyncio
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two multiplicative decreases, so one burst of 429s (or of
+# slow responses that were all queued behind the same congestion) halves the
+# limit once instead of collapsing it to the minimum.
+DECREASE_COOLDOWN = 1.0
+LATENCY_WINDOW = 200
+# The latency signal is the median of the last RECENT_SAMPLES calls against
+# the median of the last LATENCY_WINDOW, once BASELINE_MIN_SAMPLES are in.
+RECENT_SAMPLES = 10
+BASELINE_MIN_SAMPLES = 20
+# Latency growth smaller than this is treated as noise, however large the
+# ratio to a very fast baseline.
+LATENCY_NOISE_FLOOR = 0.05
+ASYNC_POLL_INTERVAL = 0.02
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def is_rate_limit_error(error):
+    # SDK status errors expose ``status_code``; google.api_core uses ``code``.
+    return getattr(error, 'status_code', None) == 429 or getattr(error, 'code', None) == 429
+
+
+def estimate_request_tokens(messages):
+    prompt = sum(count_tokens(message['content']) for message in messages)
+    return prompt + Config.RATE_LIMIT_COMPLETION_TOKENS
+
+
+class LatencyWindow:
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append(value)
+
+    def percentile(self, q, min_samples):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class TokenBucket:
+    # Reservations may take the bucket below zero; the returned wait is how
+    # long the caller must sleep before its reservation is covered. Callers
+    # are therefore served in arrival order without polling.
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate), amount
+
+    def refund(self, amount):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class AdaptiveConcurrency:
+    # AIMD concurrency limit: every call that completes without a rate-limit
+    # error and without latency growth raises the limit by 1/limit (about +1
+    # per round of calls); a 429, or a recent median latency more than
+    # ``tolerance`` times the baseline median, halves it. Latency is tracked
+    # per kind of call and model, since one slow model must not be read as
+    # the provider being overloaded. With ``initial`` None the calls are only
+    # counted, never limited.
+    def __init__(self, initial, minimum, maximum, tolerance):
+        self.limit = None if initial is None else float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.waiting = 0
+        self.decreases = 0
+        self._latencies = {}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _has_capacity(self):
+        return self.limit is None or self.in_flight < max(1, int(self.limit))
+
+    def try_acquire(self):
+        with self._cond:
+            if self._has_capacity():
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, deadline, max_queue):
+        with self._cond:
+            if self._has_capacity():
+                self.in_flight += 1
+                return
+            if self.waiting >= max_queue:
+                raise RateLimitTimeout(f"queue full ({max_queue} waiting)")
+            self.waiting += 1
+            try:
+                while not self._has_capacity():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RateLimitTimeout("timed out waiting for a concurrency slot")
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+    async def aacquire(self, deadline, max_queue):
+        # Event-loop variant of acquire(); polls instead of blocking the loop
+        # on the condition variable.
+        if self.try_acquire():
+            return
+        with self._cond:
+            if self.waiting >= max_queue:
+                raise RateLimitTimeout(f"queue full ({max_queue} waiting)")
+            self.waiting += 1
+        try:
+            while not self.try_acquire():
+                if time.monotonic() >= deadline:
+                    raise RateLimitTimeout("timed out waiting for a concurrency slot")
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self, latency=None, kind=None, model=None, overloaded=False):
+        with self._cond:
+            self.in_flight -= 1
+            if self.limit is not None:
+                if overloaded:
+                    self._decrease()
+                elif latency is not None:
+                    if self._latency_grew((kind, model), latency):
+                        self._decrease()
+                    else:
+                        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _latency_grew(self, key, latency):
+        windows = self._latencies.get(key)
+        if windows is None:
+            windows = self._latencies[key] = (LatencyWindow(RECENT_SAMPLES), LatencyWindow())
+        recent, baseline = windows
+        recent.add(latency)
+        baseline.add(latency)
+        recent_median = recent.percentile(50, RECENT_SAMPLES)
+        baseline_median = baseline.percentile(50, BASELINE_MIN_SAMPLES)
+        if recent_median is None or baseline_median is None:
+            return False
+        return (recent_median > baseline_median * self.tolerance
+                and recent_median - baseline_median > LATENCY_NOISE_FLOOR)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(float(self.minimum), self.limit / 2)
+        logger.debug(f"Concurrency limit decreased to {self.limit:.1f}")
+
+    def state(self):
+        with self._cond:
+            return {
+                'concurrency_limit': None if self.limit is None else round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'decreases': self.decreases,
+            }
+
+
+class ProviderLimiter:
+    # Per-provider admission control in front of the upstream calls: a
+    # concurrency slot from the AIMD limiter when ADAPTIVE_CONCURRENCY is
+    # on, then a reservation on the
+    # requests/min and tokens/min buckets when those are configured. Callers
+    # queue for at most RATE_LIMIT_MAX_WAIT seconds, and at most
+    # RATE_LIMIT_MAX_QUEUE callers wait for a slot at once.
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(
+            Config.CONCURRENCY_INITIAL if Config.ADAPTIVE_CONCURRENCY else None,
+            Config.CONCURRENCY_MIN, Config.CONCURRENCY_MAX,
+            Config.CONCURRENCY_LATENCY_TOLERANCE
+        )
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _reject(self, error):
+        with self._lock:
+            self.rejected += 1
+        logger.warning(f"Rate limiter for {self.name} rejected a call: {str(error)}")
+        raise error
+
+    def _reserve(self, tokens, deadline):
+        # Returns how long to sleep before the call may start.
+        reservations = []
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket_wait, reserved = bucket.reserve(amount)
+                reservations.append((bucket, reserved))
+                wait = max(wait, bucket_wait)
+        if time.monotonic() + wait > deadline:
+            for bucket, reserved in reservations:
+                bucket.refund(reserved)
+            self.concurrency.release()
+            self._reject(RateLimitTimeout(f"rate limit wait of {wait:.1f}s exceeds the queue timeout"))
+        if wait:
+            with self._lock:
+                self.throttled_seconds += wait
+        return wait
+
+    def acquire(self, tokens):
+        deadline = time.monotonic() + Config.RATE_LIMIT_MAX_WAIT
+        try:
+            self.concurrency.acquire(deadline, Config.RATE_LIMIT_MAX_QUEUE)
+        except RateLimitTimeout as e:
+            self._reject(e)
+        wait = self._reserve(tokens, deadline)
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens):
+        deadline = time.monotonic() + Config.RATE_LIMIT_MAX_WAIT
+        try:
+            await self.concurrency.aacquire(deadline, Config.RATE_LIMIT_MAX_QUEUE)
+        except RateLimitTimeout as e:
+            self._reject(e)
+        wait = self._reserve(tokens, deadline)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.concurrency.release()
+                raise
+
+    def call(self, fn, tokens, model=None):
+        self.acquire(tokens)
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self.concurrency.release(overloaded=is_rate_limit_error(e))
+            raise
+        self.concurrency.release(latency=time.perf_counter() - start, kind='complete', model=model_label(self.name, model))
+        return result
+
+    def stream(self, open_stream, tokens, model=None):
+        # The slot is held for the whole stream; time to first chunk is the
+        # latency signal, since total duration depends on the answer length.
+        self.acquire(tokens)
+        start = time.perf_counter()
+        first_chunk = None
+        overloaded = False
+        try:
+            for chunk in open_stream():
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                yield chunk
+        except Exception as e:
+            overloaded = is_rate_limit_error(e)
+            raise
+        finally:
+            self.concurrency.release(latency=first_chunk, kind='stream', model=model_label(self.name, model), overloaded=overloaded)
+
+    async def astream(self, open_stream, tokens, model=None):
+        await self.aacquire(tokens)
+        start = time.perf_counter()
+        first_chunk = None
+        overloaded = False
+        try:
+            async for chunk in open_stream():
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                yield chunk
+        except Exception as e:
+            overloaded = is_rate_limit_error(e)
+            raise
+        finally:
+            self.concurrency.release(latency=first_chunk, kind='stream', model=model_label(self.name, model), overloaded=overloaded)
+
+    def stats(self):
+        state = self.concurrency.state()
+        with self._lock:
+            state['rejected'] = self.rejected
+            state['throttled_seconds'] = round(self.throttled_seconds, 3)
+        state['requests_available'] = None if self.requests is None else round(self.requests.available(), 1)
+        state['tokens_available'] = None if self.tokens is None else round(self.tokens.available(), 1)
+        return state
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                limits = Config.RATE_LIMITS.get(provider, {})
+                limiter = ProviderLimiter(provider, limits.get('requests'), limits.get('tokens'))
+                _limiters[provider] = limiter
+    return limiter
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in sorted(limiters.items())}
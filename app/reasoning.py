@@ -0,0 +1,131 @@
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Prompt templates shared by every provider.
+REASONING_PROMPT = "Reason step-by-step about the following message: {message}"
+FINAL_PROMPT = (
+    "Message:\n{message}\n\n"
+    "Based on the following reasoning, provide a final response to the message above:\n\n"
+    "Reasoning:\n{reasoning}\n\nFinal response:"
+)
+STRUCTURED_PROMPT = (
+    "Reason step-by-step about the following message, then answer it.\n"
+    "Write your reasoning after a line containing only 'Reasoning:' and your answer after a line "
+    "containing only 'Final Response:'.\n\nMessage:\n{message}"
+)
+
+REASONING_HEADER = "Reasoning:\n"
+FINAL_HEADER = "\n\nFinal Response:\n"
+FINAL_MARKER = "Final Response:"
+
+TWO_PHASE = 'two_phase'
+STRUCTURED = 'structured'
+MODES = (TWO_PHASE, STRUCTURED)
+
+
+def format_response(reasoning, final):
+    return f"{REASONING_HEADER}{reasoning}{FINAL_HEADER}{final}"
+
+
+def split_structured(text):
+    reasoning, marker, final = text.partition(FINAL_MARKER)
+    if not marker:
+        return '', text.strip()
+    reasoning = reasoning.strip()
+    if reasoning.startswith(REASONING_HEADER.strip()):
+        reasoning = reasoning[len(REASONING_HEADER.strip()):].strip()
+    return reasoning, final.strip()
+
+
+class ReasoningPipeline:
+    # Runs reasoning mode on top of a provider's complete/stream/astream
+    # calls. ``history`` is the conversation before the current message.
+    #
+    # two_phase: a reasoning call followed by a final-answer call. While the
+    # reasoning streams to the client it is accumulated in place, and the
+    # history prefix of the final request is built up front, so the second
+    # call is issued as soon as the first one finishes.
+    #
+    # structured: a single call that returns reasoning and answer together,
+    # saving a full round trip.
+    def __init__(self, provider, mode=None):
+        self.provider = provider
+        self.mode = mode or Config.REASONING_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown reasoning mode: {self.mode}")
+
+    def _reasoning_messages(self, history, message):
+        return history + [{"role": "user", "content": REASONING_PROMPT.format(message=message)}]
+
+    def _structured_messages(self, history, message):
+        return history + [{"role": "user", "content": STRUCTURED_PROMPT.format(message=message)}]
+
+    def _final_messages(self, prefix, message, reasoning):
+        return prefix + [{"role": "user", "content": FINAL_PROMPT.format(message=message, reasoning=reasoning)}]
+
+    def respond(self, history, message, model):
+        # Returns (formatted response, final answer).
+        provider = self.provider
+        if self.mode == STRUCTURED:
+            reasoning, final = split_structured(provider.complete(self._structured_messages(history, message), model))
+            return format_response(reasoning, final), final
+
+        prefix = list(history)
+        reasoning = provider.complete(self._reasoning_messages(history, message), model)
+        with provider.track_final_phase(model):
+            final = provider.complete(self._final_messages(prefix, message, reasoning), model)
+        return format_response(reasoning, final), final
+
+    def stream(self, history, message, model, on_final):
+        provider = self.provider
+        if self.mode == STRUCTURED:
+            parts = []
+            for chunk in provider.stream(self._structured_messages(history, message), model):
+                parts.append(chunk)
+                yield chunk
+            on_final(split_structured(''.join(parts))[1])
+            return
+
+        prefix = list(history)
+        reasoning = []
+        yield REASONING_HEADER
+        for chunk in provider.stream(self._reasoning_messages(history, message), model):
+            reasoning.append(chunk)
+            yield chunk
+        final_request = self._final_messages(prefix, message, ''.join(reasoning))
+
+        final = []
+        with provider.track_final_phase(model):
+            yield FINAL_HEADER
+            for chunk in provider.stream(final_request, model):
+                final.append(chunk)
+                yield chunk
+        on_final(''.join(final))
+
+    async def astream(self, history, message, model, on_final):
+        provider = self.provider
+        if self.mode == STRUCTURED:
+            parts = []
+            async for chunk in provider.astream(self._structured_messages(history, message), model):
+                parts.append(chunk)
+                yield chunk
+            on_final(split_structured(''.join(parts))[1])
+            return
+
+        prefix = list(history)
+        reasoning = []
+        yield REASONING_HEADER
+        async for chunk in provider.astream(self._reasoning_messages(history, message), model):
+            reasoning.append(chunk)
+            yield chunk
+        final_request = self._final_messages(prefix, message, ''.join(reasoning))
+
+        final = []
+        with provider.track_final_phase(model):
+            yield FINAL_HEADER
+            async for chunk in provider.astream(final_request, model):
+                final.append(chunk)
+                yield chunk
+        on_final(''.join(final))
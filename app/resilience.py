@@ -0,0 +1,416 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.cancellation import Cancelled, is_cancelled
+from app.metrics import retries_total, hedges_total, model_label
+from app.rate_limit import RateLimitTimeout, LatencyWindow
+from config import Config
+import asyncio
+import queue
+import random
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Hedged attempts run here rather than in the fan-out executor, whose workers
+# are the callers waiting on them.
+_hedge_executor = ThreadPoolExecutor(max_workers=Config.FANOUT_MAX_WORKERS * 2, thread_name_prefix='hedge')
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_transient(error):
+    # Local rejections (the rate limiter's queue, an open circuit) say nothing
+    # about the upstream, so they are neither retried nor counted against
+    # the breaker; is_unavailable() still sends them down the fallback chain.
+    # A call its caller cancelled is not retried or sent anywhere else.
+    if is_local_rejection(error) or was_cancelled(error):
+        return False
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if status in TRANSIENT_STATUS:
+        return True
+    # APIConnectionError / APITimeoutError in the OpenAI-style SDKs, plus the
+    # builtin ConnectionError and TimeoutError families.
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, TimeoutError)) or 'Timeout' in name or 'Connection' in name
+
+
+def is_local_rejection(error):
+    return isinstance(error, (CircuitOpenError, RateLimitTimeout))
+
+
+def was_cancelled(error):
+    # The error may also be the SDK timing out at the caller's deadline.
+    return isinstance(error, Cancelled) or is_cancelled()
+
+
+def breaker_outcome(error):
+    # What a failed call tells the circuit breaker: nothing for local
+    # rejections and cancelled calls, otherwise a failure if it was transient.
+    if is_local_rejection(error) or was_cancelled(error):
+        return None
+    return not is_transient(error)
+
+
+def is_unavailable(error):
+    # Errors that say nothing about the request itself, so another provider
+    # may well answer it.
+    return not was_cancelled(error) and (is_local_rejection(error) or is_transient(error))
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, error=None):
+    # Full jitter: uniform in [0, base * 2^attempt], capped; a Retry-After
+    # header raises the floor.
+    delay = random.uniform(0, min(Config.RETRY_MAX_DELAY, Config.RETRY_BASE_DELAY * 2 ** attempt))
+    hint = retry_after(error)
+    if hint is not None:
+        delay = max(delay, min(hint, Config.RETRY_MAX_DELAY))
+    return delay
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    # Opens after ``threshold`` consecutive transient failures and fails calls
+    # fast for ``reset_timeout`` seconds, then lets a single probe through.
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError("circuit open")
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probe:
+                    raise CircuitOpenError("circuit half-open, probe in flight")
+                self._probe = True
+
+    def record(self, success):
+        # ``success`` is None when the call ended without a verdict (e.g. the
+        # client went away); that only frees the half-open probe.
+        with self._lock:
+            self._probe = False
+            if success is None:
+                return
+            if success:
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class _Race:
+    # Winner selection shared by the sync and async hedged streams: the first
+    # attempt to produce a chunk (or finish) wins; an attempt that fails
+    # before that is ignored while another one is still running.
+    def __init__(self):
+        self.attempts = 1
+        self.failed = 0
+        self.winner = None
+
+    def accept(self, index, kind, value):
+        # Returns True if the event belongs to the winning attempt.
+        if self.winner is None:
+            if kind == 'error':
+                self.failed += 1
+                if self.failed == self.attempts:
+                    raise value
+                return False
+            self.winner = index
+        return index == self.winner
+
+
+class ProviderPolicy:
+    # Resilience for one provider/model: retries with jittered backoff, a
+    # circuit breaker, and optional hedging that starts a duplicate attempt
+    # once the current one has been waiting longer than the rolling p95
+    # (total latency for completions, time to first chunk for streams).
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = model
+        self.breaker = CircuitBreaker(Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT)
+        self.latencies = {'complete': LatencyWindow(), 'stream': LatencyWindow()}
+
+    def hedge_delay(self, kind):
+        if not Config.HEDGE_REQUESTS:
+            return None
+        delay = self.latencies[kind].percentile(Config.HEDGE_PERCENTILE, Config.HEDGE_MIN_SAMPLES)
+        return None if delay is None else max(delay, Config.HEDGE_MIN_DELAY)
+
+    def _should_retry(self, error, attempt):
+        if attempt + 1 >= Config.RETRY_MAX_ATTEMPTS or not is_transient(error):
+            return False
+        retries_total.inc(self.provider, self.model)
+        logger.warning(f"Retrying {self.provider}/{self.model} after error: {str(error)}")
+        return True
+
+    def call(self, fn):
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = self._hedged_call(fn)
+            except Exception as e:
+                self.breaker.record(breaker_outcome(e))
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt, e))
+                attempt += 1
+            else:
+                self.breaker.record(True)
+                return result
+
+    def stream(self, open_stream):
+        # A stream is only retried if it failed before its first chunk.
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = False
+            try:
+                for chunk in self._hedged_stream(open_stream):
+                    started = True
+                    yield chunk
+            except GeneratorExit:
+                self.breaker.record(True if started else None)
+                raise
+            except Exception as e:
+                self.breaker.record(breaker_outcome(e))
+                if started or not self._should_retry(e, attempt):
+                    raise
+                time.sleep(backoff_delay(attempt, e))
+                attempt += 1
+            else:
+                self.breaker.record(True)
+                return
+
+    async def astream(self, open_stream):
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = False
+            try:
+                async for chunk in self._ahedged_stream(open_stream):
+                    started = True
+                    yield chunk
+            except (GeneratorExit, asyncio.CancelledError):
+                self.breaker.record(True if started else None)
+                raise
+            except Exception as e:
+                self.breaker.record(breaker_outcome(e))
+                if started or not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, e))
+                attempt += 1
+            else:
+                self.breaker.record(True)
+                return
+
+    def _hedged_call(self, fn):
+        delay = self.hedge_delay('complete')
+        start = time.perf_counter()
+        if delay is None:
+            result = fn()
+        else:
+            result = self._race_call(fn, delay)
+        self.latencies['complete'].add(time.perf_counter() - start)
+        return result
+
+    def _race_call(self, fn, delay):
+        # The losing attempt cannot be interrupted; it finishes in the
+        # background and its result is dropped.
+        primary = _hedge_executor.submit(fn)
+        pending = {primary}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            hedges_total.inc(self.provider, self.model, 'launched')
+            pending.add(_hedge_executor.submit(fn))
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        hedges_total.inc(self.provider, self.model, 'won')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _hedged_stream(self, open_stream):
+        delay = self.hedge_delay('stream')
+        start = time.perf_counter()
+        if delay is None:
+            first = True
+            for chunk in open_stream():
+                if first:
+                    self.latencies['stream'].add(time.perf_counter() - start)
+                    first = False
+                yield chunk
+            return
+
+        events = queue.Queue()
+        stops = []
+
+        def pump(index, stop):
+            try:
+                stream = open_stream()
+                try:
+                    for chunk in stream:
+                        if stop.is_set():
+                            return
+                        events.put((index, 'chunk', chunk))
+                finally:
+                    stream.close()
+                events.put((index, 'done', None))
+            except Exception as e:
+                events.put((index, 'error', e))
+
+        def launch():
+            stop = threading.Event()
+            stops.append(stop)
+            _hedge_executor.submit(pump, len(stops) - 1, stop)
+
+        race = _Race()
+        first = True
+        launch()
+        try:
+            try:
+                event = events.get(timeout=delay)
+            except queue.Empty:
+                hedges_total.inc(self.provider, self.model, 'launched')
+                race.attempts = 2
+                launch()
+                event = events.get()
+            while True:
+                index, kind, value = event
+                if race.accept(index, kind, value):
+                    if first:
+                        first = False
+                        self.latencies['stream'].add(time.perf_counter() - start)
+                        for other, stop in enumerate(stops):
+                            if other != index:
+                                stop.set()
+                        if index != 0:
+                            hedges_total.inc(self.provider, self.model, 'won')
+                    if kind == 'chunk':
+                        yield value
+                    elif kind == 'done':
+                        return
+                    else:
+                        raise value
+                event = events.get()
+        finally:
+            for stop in stops:
+                stop.set()
+
+    async def _ahedged_stream(self, open_stream):
+        delay = self.hedge_delay('stream')
+        start = time.perf_counter()
+        if delay is None:
+            first = True
+            async for chunk in open_stream():
+                if first:
+                    self.latencies['stream'].add(time.perf_counter() - start)
+                    first = False
+                yield chunk
+            return
+
+        events = asyncio.Queue()
+        tasks = []
+
+        async def pump(index):
+            try:
+                async for chunk in open_stream():
+                    await events.put((index, 'chunk', chunk))
+                await events.put((index, 'done', None))
+            except Exception as e:
+                await events.put((index, 'error', e))
+
+        def launch():
+            tasks.append(asyncio.create_task(pump(len(tasks))))
+
+        race = _Race()
+        first = True
+        launch()
+        try:
+            try:
+                event = await asyncio.wait_for(events.get(), delay)
+            except asyncio.TimeoutError:
+                hedges_total.inc(self.provider, self.model, 'launched')
+                race.attempts = 2
+                launch()
+                event = await events.get()
+            while True:
+                index, kind, value = event
+                if race.accept(index, kind, value):
+                    if first:
+                        first = False
+                        self.latencies['stream'].add(time.perf_counter() - start)
+                        for other, task in enumerate(tasks):
+                            if other != index:
+                                task.cancel()
+                        if index != 0:
+                            hedges_total.inc(self.provider, self.model, 'won')
+                    if kind == 'chunk':
+                        yield value
+                    elif kind == 'done':
+                        return
+                    else:
+                        raise value
+                event = await events.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_policy(provider, model):
+    key = (provider, model_label(provider, model))
+    policy = _policies.get(key)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.get(key)
+            if policy is None:
+                policy = _policies[key] = ProviderPolicy(*key)
+    return policy
+
+
+def circuit_states():
+    with _policies_lock:
+        policies = dict(_policies)
+    return {key: policy.breaker.state for key, policy in sorted(policies.items())}
+
+
+def fallback_chain(provider, model):
+    if not Config.FALLBACK_ENABLED:
+        return []
+    return Config.FALLBACKS.get(provider, {}).get(model, [])
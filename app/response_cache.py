@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from config import Config
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPLAY_CHUNK_SIZE = 32
+
+
+def cache_key(provider, model, messages, use_reasoning):
+    # ``use_reasoning`` is False or the reasoning mode, which changes the output.
+    normalized = [[message['role'], message['content'].strip()] for message in messages]
+    payload = json.dumps([provider, model, normalized, use_reasoning or False], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def replay_chunks(text, size=REPLAY_CHUNK_SIZE):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class DiskCacheBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        item = self.backend.get(key)
+        if item is not None and item[1] < time.time():
+            self.backend.delete(key)
+            item = None
+        with self._lock:
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if item is None else item[0]
+
+    def set(self, key, value):
+        self.backend.set(key, value, time.time() + self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    if Config.RESPONSE_CACHE is None:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if Config.RESPONSE_CACHE == 'disk':
+                    backend = DiskCacheBackend(Config.RESPONSE_CACHE_PATH)
+                elif Config.RESPONSE_CACHE == 'memory':
+                    backend = MemoryCacheBackend(Config.RESPONSE_CACHE_SIZE)
+                else:
+                    raise ValueError(f"Unknown response cache backend: {Config.RESPONSE_CACHE}")
+                _cache = ResponseCache(backend, ttl=Config.RESPONSE_CACHE_TTL)
+                logger.debug(f"Using {Config.RESPONSE_CACHE} response cache")
+    return _cache
@@ -1,20 +1,122 @@
-from flask import Blueprint, render_template, request, jsonify, session, Response, stream_with_context
-from app.llm_providers import GroqProvider, GeminiProvider, AnthropicProvider, OpenAIProvider, CerebrasProvider
+from flask import Blueprint, render_template, request, jsonify, session, Response, stream_with_context, g
+from app.llm_providers import get_provider_class
+from app.fanout import fan_out, multiplex, FanOutTimeout
+from app.race import Racer, race_stream, race_answer
+from app.conversation_store import get_store
+from app.response_cache import get_response_cache
+from app.conversation_log import get_conversation_log
+from app.rate_limit import limiter_stats
+from app.resilience import circuit_states
+from app.batch import read_prompts, plan_jobs, run_batch, format_row, csv_header, load_checkpoint, ResultWriter, FORMATS
+from app.history import token_budget
+from app.sse import sse_event, ChunkCoalescer, SSE_HEADERS, RECONNECT
+from app.stream_sessions import stream_sessions, parse_event_id, StreamGone
+from app.metrics import registry
+from config import Config
+from werkzeug.utils import secure_filename
+from contextlib import closing
 import logging
 import json
+import os
+import time
+import uuid
 
 bp = Blueprint('main', __name__)
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+@registry.register_collector
+def response_cache_metrics():
+    cache = get_response_cache()
+    if cache is None:
+        return []
+    stats = cache.stats()
+    return [
+        "# HELP llm_response_cache_requests_total Response cache lookups by result.",
+        "# TYPE llm_response_cache_requests_total counter",
+        f'llm_response_cache_requests_total{{result="hit"}} {stats["hits"]}',
+        f'llm_response_cache_requests_total{{result="miss"}} {stats["misses"]}',
+    ]
+
+@registry.register_collector
+def conversation_log_metrics():
+    log = get_conversation_log()
+    if log is None:
+        return []
+    stats = log.stats()
+    return [
+        "# HELP llm_conversation_log_turns_total Turns written to or dropped from the conversation log.",
+        "# TYPE llm_conversation_log_turns_total counter",
+        f'llm_conversation_log_turns_total{{result="written"}} {stats["written"]}',
+        f'llm_conversation_log_turns_total{{result="dropped"}} {stats["dropped"]}',
+        "# HELP llm_conversation_log_queue_depth Turns waiting for the conversation log writer.",
+        "# TYPE llm_conversation_log_queue_depth gauge",
+        f'llm_conversation_log_queue_depth {stats["queued"]}',
+    ]
+
+@registry.register_collector
+def rate_limiter_metrics():
+    stats = limiter_stats()
+    lines = []
+    for name, help, key in (
+        ('llm_limiter_concurrency_limit', 'Current adaptive concurrency limit.', 'concurrency_limit'),
+        ('llm_limiter_in_flight', 'Upstream calls in flight.', 'in_flight'),
+        ('llm_limiter_queue_depth', 'Calls waiting for a concurrency slot.', 'queue_depth'),
+        ('llm_limiter_rejected_total', 'Calls rejected after the queue timeout or with a full queue.', 'rejected'),
+        ('llm_limiter_throttled_seconds_total', 'Time calls spent waiting on the rate limit buckets.', 'throttled_seconds'),
+    ):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        for provider, state in stats.items():
+            if state[key] is not None:
+                lines.append(f'{name}{{provider="{provider}"}} {state[key]:g}')
+    return lines
+
+@registry.register_collector
+def stream_session_metrics():
+    stats = stream_sessions.stats()
+    return [
+        "# HELP llm_stream_sessions_producing Streamed responses being produced.",
+        "# TYPE llm_stream_sessions_producing gauge",
+        f'llm_stream_sessions_producing {stats["producing"]}',
+        "# HELP llm_stream_sessions_queued Streamed responses waiting for a producer thread.",
+        "# TYPE llm_stream_sessions_queued gauge",
+        f'llm_stream_sessions_queued {stats["queued"]}',
+    ]
+
+@registry.register_collector
+def circuit_breaker_metrics():
+    lines = [
+        "# HELP llm_circuit_open Whether the circuit breaker is open (1), half-open (0.5) or closed (0).",
+        "# TYPE llm_circuit_open gauge",
+    ]
+    values = {'closed': 0, 'half_open': 0.5, 'open': 1}
+    for (provider, model), state in circuit_states().items():
+        lines.append(f'llm_circuit_open{{provider="{provider}",model="{model}"}} {values[state]:g}')
+    return lines
+
+@bp.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@bp.after_app_request
+def add_timing_header(response):
+    if Config.TIMING_HEADER and 'request_start' in g:
+        elapsed_ms = (time.perf_counter() - g.request_start) * 1000
+        response.headers['Server-Timing'] = f"app;dur={elapsed_ms:.1f}"
+    return response
+
 @bp.route('/')
 def index():
     return render_template('index.html')
 
 @bp.route('/chat', methods=['POST', 'GET'])
 def chat():
+    # Set before parsing, so a malformed streaming request still gets its
+    # error as an event.
+    use_streaming = request.args.get('use_streaming') == 'true'
     try:
         if request.method == 'GET':
             # Handle streaming request
@@ -22,6 +124,8 @@ def chat():
             providers = json.loads(request.args.get('providers'))
             use_reasoning = request.args.get('use_reasoning') == 'true'
             use_streaming = request.args.get('use_streaming') == 'true'
+            reasoning_mode = request.args.get('reasoning_mode')
+            race = request.args.get('race') == 'true'
         else:
             # Handle non-streaming request
             data = request.json
@@ -29,83 +133,238 @@ def chat():
             providers = data.get('providers', {})
             use_reasoning = data.get('use_reasoning', False)
             use_streaming = data.get('use_streaming', False)
+            reasoning_mode = data.get('reasoning_mode')
+            race = data.get('race', False)
 
-        logger.debug(f"Received chat request: message={message}, providers={providers}, use_reasoning={use_reasoning}, use_streaming={use_streaming}")
-
-        if 'llm_provider' not in session:
-            session['llm_provider'] = {}
+        logger.debug(f"Received chat request: message_length={len(message or '')}, providers={providers}, use_reasoning={use_reasoning}, use_streaming={use_streaming}, race={race}")
 
         if use_streaming:
-            def generate():
+            last_event_id = request.headers.get('Last-Event-ID')
+            if last_event_id:
+                return resume_stream(last_event_id)
+
+            llms = {provider: get_llm_provider(provider, model, reasoning_mode) for provider, model in providers.items()}
+
+            def open_stream(provider, model):
+                return lambda: llms[provider].generate_stream(message, model, use_reasoning)
+
+            def open_events(timeout):
+                # Race mode announces only the winner, once it is known.
+                if race:
+                    racers = [Racer(llms[provider], model, message, use_reasoning) for provider, model in providers.items()]
+                    return [], race_stream(racers, timeout)
+                streams = {provider: open_stream(provider, model) for provider, model in providers.items()}
+                return list(providers), multiplex(streams, timeout)
+
+            def timeout(coalescer):
+                # Wakes at least once a second to check should_stop.
+                wait = coalescer.timeout()
+                return 1.0 if wait is None else min(wait, 1.0)
+
+            def produce(should_stop):
+                # Runs on the stream session's thread, so it keeps going
+                # (and stays resumable) if the connection drops.
+                coalescer = ChunkCoalescer(heartbeat=0)
                 try:
-                    for provider, model in providers.items():
-                        yield f"data: {provider}\n\n"
-                        llm = get_llm_provider(provider)
-                        for chunk in llm.generate_stream(message, model, use_reasoning):
-                            yield f"data: {chunk}\n\n"
-                        yield "data: [DONE]\n\n"
+                    started, events = open_events(lambda: timeout(coalescer))
+                    yield RECONNECT + ''.join(sse_event({'type': 'start', 'provider': provider}) for provider in started)
+                    with closing(events):
+                        for provider, kind, value in events:
+                            if should_stop():
+                                return
+                            if kind == 'start':
+                                yield sse_event({'type': 'start', 'provider': provider})
+                            else:
+                                yield coalescer.tick() if kind == 'idle' else coalescer.push(provider, kind, value)
                 except Exception as e:
                     logger.error(f"Error in generate function: {str(e)}")
-                    yield f"data: Error: {str(e)}\n\n"
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+                    yield coalescer.flush() + sse_event({'type': 'error', 'provider': None, 'content': f"Error: {str(e)}"})
+                yield sse_event({'type': 'end'})
+
+            stream = stream_sessions.start(get_conversation_id(), produce)
+            return Response(stream_with_context(stream.follow()), content_type='text/event-stream', headers=SSE_HEADERS)
         else:
-            responses = {}
-            for provider, model in providers.items():
-                llm = get_llm_provider(provider)
+            llms = {provider: get_llm_provider(provider, model, reasoning_mode) for provider, model in providers.items()}
+
+            if race:
+                racers = [Racer(llms[provider], model, message, use_reasoning) for provider, model in providers.items()]
                 try:
-                    if use_reasoning:
-                        responses[provider] = llm.generate_response_with_reasoning(message, model)
-                    else:
-                        responses[provider] = llm.generate_response(message, model)
-                    session['llm_provider'][provider] = llm.to_dict()
-                except Exception as e:
-                    logger.error(f"Error generating response for provider {provider}: {str(e)}")
-                    responses[provider] = f"Error: {str(e)}"
-            
+                    winner, response = race_answer(racers)
+                except FanOutTimeout as e:
+                    return jsonify({'error': str(e)}), 504
+                return jsonify({'responses': {winner.name: response}, 'winner': winner.name})
+
+            for llm in llms.values():
+                llm.defer_history()
+
+            def call(provider, model):
+                llm = llms[provider]
+                if use_reasoning:
+                    return lambda: llm.generate_response_with_reasoning(message, model)
+                return lambda: llm.generate_response(message, model)
+
+            results = fan_out({provider: call(provider, model) for provider, model in providers.items()})
+
+            responses = {}
+            for provider, (ok, value) in results.items():
+                if ok:
+                    # Only turns the client sees are saved; a call that
+                    # finishes after timing out is never committed.
+                    llms[provider].commit_history()
+                    responses[provider] = value
+                else:
+                    logger.error(f"Error generating response for provider {provider}: {str(value)}")
+                    responses[provider] = f"Error: {str(value)}"
+
             return jsonify({'responses': responses})
     except Exception as e:
         logger.error(f"Unexpected error in chat route: {str(e)}")
+        # ``e`` is unbound once the except block ends, before the generator
+        # below runs.
+        error = str(e)
         if use_streaming:
             def generate():
-                yield f"data: Error: {str(e)}\n\n"
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+                yield sse_event({'type': 'error', 'provider': None, 'content': f"Error: {error}"})
+                yield sse_event({'type': 'end'})
+            return Response(stream_with_context(generate()), content_type='text/event-stream', headers=SSE_HEADERS)
         else:
-            return jsonify({'error': str(e)}), 500
+            return jsonify({'error': error}), 500
+
+def resume_stream(last_event_id):
+    # An EventSource reconnect: replay what the client missed from the
+    # stream it was following rather than starting a new generation.
+    stream_id, sequence = parse_event_id(last_event_id)
+    stream = stream_sessions.get(stream_id, get_conversation_id()) if stream_id else None
+
+    def expired():
+        yield sse_event({'type': 'error', 'provider': None, 'content': "Error: the stream has expired, send the message again"})
+        yield sse_event({'type': 'end'})
+
+    def generate():
+        try:
+            yield from stream.follow(sequence)
+        except StreamGone as e:
+            logger.debug(f"Cannot resume stream {stream_id}: {str(e)}")
+            yield from expired()
+
+    logger.debug(f"Resuming stream {stream_id} after event {sequence}: {'found' if stream else 'expired'}")
+    return Response(stream_with_context(generate() if stream else expired()), content_type='text/event-stream', headers=SSE_HEADERS)
+
+@bp.route('/batch', methods=['POST'])
+def batch():
+    # JSONL prompts in the body (or an uploaded 'file'); options in the query
+    # string. Result rows stream back as they finish. A named batch is also
+    # written to BATCH_DIR and resumes from there when posted again.
+    try:
+        upload = request.files.get('file')
+        lines = (upload.stream.read() if upload else request.get_data()).splitlines()
+        prompts = list(read_prompts(lines))
+        providers = json.loads(request.args.get('providers', '{}'))
+        fmt = request.args.get('format', 'jsonl')
+        concurrency = min(int(request.args.get('concurrency', Config.BATCH_CONCURRENCY)), Config.BATCH_CONCURRENCY)
+        use_reasoning = request.args.get('use_reasoning') == 'true'
+        name = secure_filename(request.args.get('name', ''))
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        for prompt in prompts:
+            if not (prompt.get('providers') or providers):
+                raise ValueError(f"No providers selected for prompt {prompt['id']}")
+        for provider in providers:
+            get_provider_class_or_error(provider)
+    except Exception as e:
+        logger.error(f"Invalid batch request: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    completed = set()
+    writer = None
+    if name:
+        os.makedirs(Config.BATCH_DIR, exist_ok=True)
+        path = os.path.join(Config.BATCH_DIR, f"{name}.{fmt}")
+        completed = load_checkpoint(path, fmt)
+        writer = ResultWriter(path, fmt)
+    logger.info(f"Starting batch of {len(prompts)} prompts, {len(completed)} calls already done")
+
+    def generate():
+        try:
+            if fmt == 'csv':
+                yield csv_header()
+            for row in run_batch(plan_jobs(prompts, providers), concurrency, use_reasoning, completed):
+                if writer is not None:
+                    writer.write(row)
+                yield format_row(row, fmt)
+        finally:
+            if writer is not None:
+                writer.close()
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), content_type=content_type,
+                    headers={'X-Batch-Resumed': str(len(completed))})
 
 @bp.route('/clear_history', methods=['POST'])
 def clear_history():
     data = request.json
     provider = data.get('provider')
 
-    if 'llm_provider' in session and provider in session['llm_provider']:
-        session['llm_provider'][provider] = get_llm_provider(provider, new_instance=True).to_dict()
+    if get_provider_class(provider) is not None:
+        get_store().clear(get_conversation_id(), provider)
         return jsonify({'message': 'Conversation history cleared'}), 200
     else:
-        return jsonify({'error': 'Invalid provider or no conversation history'}), 400
-
-def get_llm_provider(provider, new_instance=False):
-    if new_instance or provider not in session.get('llm_provider', {}):
-        if provider == 'groq':
-            return GroqProvider()
-        elif provider == 'gemini':
-            return GeminiProvider()
-        elif provider == 'anthropic':
-            return AnthropicProvider()
-        elif provider == 'openai':
-            return OpenAIProvider()
-        elif provider == 'cerebras':
-            return CerebrasProvider()
-        else:
-            raise ValueError(f"Unknown provider: {provider}")
-    else:
-        llm_dict = session['llm_provider'][provider]
-        if provider == 'groq':
-            return GroqProvider.from_dict(llm_dict)
-        elif provider == 'gemini':
-            return GeminiProvider.from_dict(llm_dict)
-        elif provider == 'anthropic':
-            return AnthropicProvider.from_dict(llm_dict)
-        elif provider == 'openai':
-            return OpenAIProvider.from_dict(llm_dict)
-        elif provider == 'cerebras':
-            return CerebrasProvider.from_dict(llm_dict)
+        return jsonify({'error': 'Invalid provider'}), 400
+
+@bp.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@bp.route('/cache_stats')
+def cache_stats():
+    cache = get_response_cache()
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **cache.stats()})
+
+@bp.route('/limits')
+def limits():
+    circuits = {}
+    for (provider, model), state in circuit_states().items():
+        circuits.setdefault(provider, {})[model] = state
+    return jsonify({'limiters': limiter_stats(), 'circuits': circuits})
+
+@bp.route('/history/search')
+def history_search():
+    # Searches every conversation, so it is only served when explicitly
+    # enabled on top of the log itself.
+    log = get_conversation_log()
+    if log is None or not Config.HISTORY_SEARCH:
+        return jsonify({'error': 'History search is disabled'}), 404
+    try:
+        results = log.search(
+            request.args.get('q', ''),
+            provider=request.args.get('provider'),
+            model=request.args.get('model'),
+            conversation_id=request.args.get('conversation_id'),
+            order=request.args.get('order', 'rank'),
+            limit=max(0, min(int(request.args.get('limit', 50)), 500)),
+            offset=max(0, int(request.args.get('offset', 0))),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': results})
+
+def get_conversation_id():
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
+    return session['conversation_id']
+
+def get_provider_class_or_error(provider):
+    provider_class = get_provider_class(provider)
+    if provider_class is None:
+        raise ValueError(f"Unknown provider: {provider}")
+    if not provider_class.is_configured():
+        raise ValueError(f"No API key configured for provider: {provider}")
+    return provider_class
+
+def get_llm_provider(provider, model=None, reasoning_mode=None):
+    provider_class = get_provider_class_or_error(provider)
+    return provider_class.load(get_store(), get_conversation_id(), cache=get_response_cache(),
+                               token_budget=token_budget(provider, model), reasoning_mode=reasoning_mode)
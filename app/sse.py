@@ -0,0 +1,110 @@
+from config import Config
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = ": keepalive\n\n"
+# Sent at the start of a stream: how long the browser waits before
+# reconnecting a dropped stream, in milliseconds.
+RECONNECT = "retry: 1000\n\n"
+# Also stops nginx from buffering the stream.
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def format_event(data, event=None):
+    # One ``data:`` field per line, so payloads containing newlines (any of
+    # \n, \r\n, \r) survive SSE framing; the client joins them back with \n.
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.replace('\r\n', '\n').replace('\r', '\n').split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def sse_event(payload):
+    return format_event(json.dumps(payload))
+
+
+def stream_event(provider, kind, value):
+    if kind == 'chunk':
+        return sse_event({'type': 'chunk', 'provider': provider, 'content': value})
+    elif kind == 'done':
+        return sse_event({'type': 'done', 'provider': provider})
+    logger.error(f"Error streaming response for provider {provider}: {str(value)}")
+    return sse_event({'type': 'error', 'provider': provider, 'content': f"Error: {str(value)}"})
+
+
+class ChunkCoalescer:
+    """Turns multiplexed ``(provider, kind, value)`` stream events into SSE
+    output with fewer, larger writes.
+
+    A provider's first chunk goes out immediately, so time to first token is
+    unchanged. Later chunks are buffered per provider and flushed once the
+    oldest buffered chunk is ``interval`` seconds old or the buffer reaches
+    ``max_bytes``. A ``done`` or ``error`` event flushes its provider's buffer
+    first, so each column stays in order. When nothing has been written for
+    ``heartbeat`` seconds, a comment line is sent so idle proxies keep the
+    connection open. Everything due at once is returned as a single string.
+    """
+
+    def __init__(self, interval=None, max_bytes=None, heartbeat=None):
+        self.interval = Config.SSE_FLUSH_INTERVAL if interval is None else interval
+        self.max_bytes = Config.SSE_FLUSH_BYTES if max_bytes is None else max_bytes
+        self.heartbeat = Config.SSE_HEARTBEAT_INTERVAL if heartbeat is None else heartbeat
+        self._pending = {}
+        self._started = set()
+        self._last_write = time.monotonic()
+
+    def _write(self, parts, now):
+        if parts:
+            self._last_write = now
+        return ''.join(parts)
+
+    def _flush(self, provider):
+        chunks, _, _ = self._pending.pop(provider)
+        return stream_event(provider, 'chunk', ''.join(chunks))
+
+    def push(self, provider, kind, value, now=None):
+        now = time.monotonic() if now is None else now
+        parts = []
+        if kind == 'chunk':
+            if provider not in self._started or self.interval <= 0:
+                self._started.add(provider)
+                parts.append(stream_event(provider, kind, value))
+            else:
+                chunks, size, since = self._pending.get(provider, ([], 0, now))
+                chunks.append(value)
+                self._pending[provider] = (chunks, size + len(value), since)
+                if size + len(value) >= self.max_bytes:
+                    parts.append(self._flush(provider))
+        else:
+            if provider in self._pending:
+                parts.append(self._flush(provider))
+            parts.append(stream_event(provider, kind, value))
+        parts.extend(self._due(now))
+        return self._write(parts, now)
+
+    def _due(self, now):
+        return [self._flush(provider) for provider, (_, _, since) in list(self._pending.items())
+                if now - since >= self.interval]
+
+    def tick(self, now=None):
+        # Called when the consumer wakes up without a new event.
+        now = time.monotonic() if now is None else now
+        parts = self._due(now)
+        if not parts and self.heartbeat and now - self._last_write >= self.heartbeat:
+            parts.append(HEARTBEAT)
+        return self._write(parts, now)
+
+    def flush(self):
+        return self._write([self._flush(provider) for provider in list(self._pending)], time.monotonic())
+
+    def timeout(self, now=None):
+        # Seconds until the next buffered flush or heartbeat is due.
+        now = time.monotonic() if now is None else now
+        deadlines = [since + self.interval for _, _, since in self._pending.values()]
+        if self.heartbeat:
+            deadlines.append(self._last_write + self.heartbeat)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
@@ -0,0 +1,293 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from app.sse import HEARTBEAT
+from config import Config
+import asyncio
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long a new stream waits for its first connection, whatever the grace.
+FIRST_ATTACH_TIMEOUT = 5.0
+
+# Producers of the thread-based sessions; beyond STREAM_SESSION_MAX_WORKERS
+# open streams, new ones wait for a producer to finish.
+_producer_executor = ThreadPoolExecutor(max_workers=Config.STREAM_SESSION_MAX_WORKERS,
+                                        thread_name_prefix='stream-session')
+
+
+class StreamGone(Exception):
+    pass
+
+
+def parse_event_id(value):
+    # "<stream id>-<sequence>" -> (stream id, sequence); (None, None) if malformed.
+    stream_id, _, sequence = (value or '').rpartition('-')
+    try:
+        return (stream_id or None), int(sequence)
+    except ValueError:
+        return None, None
+
+
+def with_event_id(frame, event_id):
+    # Tags the last event of a frame; the browser sends the id of the last
+    # event it received as Last-Event-ID when it reconnects.
+    return f"{frame[:-1]}id: {event_id}\n\n"
+
+
+class _StreamSession:
+    """One streamed response, decoupled from the connection that started it.
+
+    The producer publishes SSE frames into a bounded replay buffer, each
+    tagged with an event id. Connections follow the buffer from a given id,
+    so a reconnect with Last-Event-ID picks up where it left off instead of
+    starting a new generation. The producer polls ``should_stop()`` between
+    events; it turns true once nobody has been following the stream for
+    ``grace`` seconds, which closes the provider streams.
+    """
+
+    def __init__(self, owner, max_frames, grace):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.grace = grace
+        self.frames = deque(maxlen=max_frames)
+        self.sequence = 0
+        self.finished = False
+        self.finished_at = None
+        self.cancelled = False
+        self.subscribers = 0
+        self.attached = False
+        self.detached_at = time.monotonic()
+
+    def _append(self, frame):
+        self.sequence += 1
+        self.frames.append((self.sequence, with_event_id(frame, f"{self.id}-{self.sequence}")))
+
+    def _frames_after(self, sequence):
+        if sequence > self.sequence:
+            raise StreamGone("unknown event id")
+        if not self.frames or sequence == self.sequence:
+            return []
+        first = self.frames[0][0]
+        if sequence + 1 < first:
+            raise StreamGone("the stream has moved past the last event received")
+        return [frame for _, frame in islice(self.frames, sequence + 1 - first, None)]
+
+    def _attach(self):
+        self.subscribers += 1
+        self.attached = True
+
+    def _detach(self):
+        self.subscribers -= 1
+        if self.subscribers == 0:
+            self.detached_at = time.monotonic()
+
+    def should_stop(self):
+        if self.cancelled:
+            return True
+        grace = self.grace if self.attached else max(self.grace, FIRST_ATTACH_TIMEOUT)
+        if self.subscribers == 0 and time.monotonic() - self.detached_at >= grace:
+            logger.debug(f"Stream {self.id} has no listeners, closing the provider streams")
+            self.cancelled = True
+        return self.cancelled
+
+
+class StreamSession(_StreamSession):
+    # Thread-based session for the WSGI app; the producer runs on a pool
+    # thread so it outlives the request that started it.
+    def __init__(self, owner, max_frames, grace):
+        super().__init__(owner, max_frames, grace)
+        self._cond = threading.Condition()
+
+    def publish(self, frame):
+        with self._cond:
+            self._append(frame)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def run(self, produce):
+        # ``produce(should_stop)`` yields SSE frames. A session whose client
+        # left while it was queued for a producer thread never starts.
+        try:
+            if self.should_stop():
+                return
+            for frame in produce(self.should_stop):
+                if frame:
+                    self.publish(frame)
+        except Exception as e:
+            logger.error(f"Error producing stream {self.id}: {str(e)}")
+        finally:
+            self.finish()
+
+    def follow(self, sequence=0, heartbeat=None):
+        heartbeat = Config.SSE_HEARTBEAT_INTERVAL if heartbeat is None else heartbeat
+        with self._cond:
+            self._attach()
+        try:
+            while True:
+                with self._cond:
+                    frames = self._frames_after(sequence)
+                    if not frames and not self.finished:
+                        self._cond.wait(heartbeat or None)
+                        frames = self._frames_after(sequence)
+                    sequence = self.sequence
+                    finished = self.finished
+                if frames:
+                    yield ''.join(frames)
+                elif finished:
+                    return
+                else:
+                    yield HEARTBEAT
+        finally:
+            with self._cond:
+                self._detach()
+
+
+class AsyncStreamSession(_StreamSession):
+    # Event-loop counterpart for the ASGI app; the producer is a task.
+    def __init__(self, owner, max_frames, grace):
+        super().__init__(owner, max_frames, grace)
+        self._changed = asyncio.Event()
+        self.task = None
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, frame):
+        self._append(frame)
+        self._notify()
+
+    def _detach(self):
+        super()._detach()
+        if self.subscribers == 0:
+            self.expire_after(self.grace)
+
+    def expire_after(self, delay):
+        # Unlike the thread-based session, an abandoned producer is
+        # cancelled as soon as the grace period ends rather than at its
+        # next event.
+        if self.task is not None and not self.finished:
+            asyncio.get_running_loop().call_later(delay, self._expire)
+
+    def _expire(self):
+        if not self.finished and self.should_stop():
+            self.task.cancel()
+
+    def finish(self):
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def run(self, produce):
+        try:
+            async for frame in produce(self.should_stop):
+                if frame:
+                    self.publish(frame)
+        except Exception as e:
+            logger.error(f"Error producing stream {self.id}: {str(e)}")
+        finally:
+            self.finish()
+
+    async def follow(self, sequence=0, heartbeat=None):
+        heartbeat = Config.SSE_HEARTBEAT_INTERVAL if heartbeat is None else heartbeat
+        self._attach()
+        try:
+            while True:
+                frames = self._frames_after(sequence)
+                if not frames and not self.finished:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), heartbeat or None)
+                    except asyncio.TimeoutError:
+                        pass
+                    frames = self._frames_after(sequence)
+                sequence = self.sequence
+                if frames:
+                    yield ''.join(frames)
+                elif self.finished:
+                    return
+                else:
+                    yield HEARTBEAT
+        finally:
+            self._detach()
+
+
+class StreamSessionManager:
+    # Registry of live and recently finished stream sessions. A finished
+    # session is kept for its grace period so a client that lost the tail
+    # of the stream can still fetch it; expired sessions are swept lazily.
+    def __init__(self, session_class):
+        self.session_class = session_class
+        self._sessions = {}
+        self._producers = 0
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        for stream_id, session in list(self._sessions.items()):
+            if session.finished and now - session.finished_at >= session.grace:
+                del self._sessions[stream_id]
+
+    def create(self, owner):
+        session = self.session_class(owner, Config.STREAM_REPLAY_EVENTS, Config.STREAM_RESUME_GRACE)
+        with self._lock:
+            self._sweep(time.monotonic())
+            self._sessions[session.id] = session
+        return session
+
+    def start(self, owner, produce):
+        session = self.create(owner)
+        with self._lock:
+            self._producers += 1
+            queued = self._producers - Config.STREAM_SESSION_MAX_WORKERS
+        if queued > 0:
+            logger.warning(f"All {Config.STREAM_SESSION_MAX_WORKERS} stream producers are busy, "
+                           f"stream {session.id} is queued behind {queued - 1} others")
+        _producer_executor.submit(self._produce, session, produce)
+        return session
+
+    def _produce(self, session, produce):
+        try:
+            session.run(produce)
+        finally:
+            with self._lock:
+                self._producers -= 1
+
+    def astart(self, owner, produce):
+        session = self.create(owner)
+        session.task = asyncio.get_running_loop().create_task(session.run(produce))
+        session.expire_after(max(session.grace, FIRST_ATTACH_TIMEOUT))
+        return session
+
+    def get(self, stream_id, owner):
+        # Streams can only be resumed from the conversation that started them.
+        with self._lock:
+            self._sweep(time.monotonic())
+            session = self._sessions.get(stream_id)
+        if session is None or session.owner != owner or session.cancelled:
+            return None
+        return session
+
+    def stats(self):
+        # Thread-based sessions only: streams being produced, and those
+        # waiting for a producer thread.
+        with self._lock:
+            producers = self._producers
+        limit = Config.STREAM_SESSION_MAX_WORKERS
+        return {'producing': min(producers, limit), 'queued': max(0, producers - limit)}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+stream_sessions = StreamSessionManager(StreamSession)
+async_stream_sessions = StreamSessionManager(AsyncStreamSession)
@@ -0,0 +1,83 @@
+"""Run a JSONL file of prompts against several providers.
+
+Each line of the prompts file is ``{"prompt": ..., "id": ..., "providers":
+{...}}``; ``id`` defaults to the line number and ``providers`` to
+``--providers``. Rows are appended to the output (JSONL or CSV, from its
+extension) as soon as each call finishes, and the output doubles as the
+checkpoint: running the same command again skips the calls that already
+succeeded. ``--mock`` runs against the local mock server instead of the real
+APIs.
+
+    python batch.py prompts.jsonl --providers groq=llama-3.1-8b-instant,openai=gpt-4o-mini --output results.csv
+"""
+import argparse
+import logging
+import sys
+import time
+
+
+def parse_providers(value):
+    providers = {}
+    for item in value.split(','):
+        provider, _, model = item.strip().partition('=')
+        if not provider or not model:
+            raise argparse.ArgumentTypeError(f"Expected provider=model, got '{item}'")
+        providers[provider] = model
+    return providers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('prompts', help='JSONL file of prompts')
+    parser.add_argument('--providers', type=parse_providers, default={},
+                        help='Comma-separated provider=model pairs')
+    parser.add_argument('--output', default='results.jsonl', help='Output file (.jsonl or .csv)')
+    parser.add_argument('--concurrency', type=int, help='Calls in flight (default: BATCH_CONCURRENCY)')
+    parser.add_argument('--reasoning', action='store_true', help='Use the reasoning pipeline')
+    parser.add_argument('--no-resume', action='store_true', help='Overwrite the output instead of resuming')
+    parser.add_argument('--mock', action='store_true', help='Call the local mock LLM server instead of the real APIs')
+    args = parser.parse_args()
+
+    if args.mock:
+        # Must happen before the app (and the provider SDKs) are configured.
+        from bench.mock_llm_server import start_mock_server
+        from bench.load_test import configure_environment
+        mock = start_mock_server()
+        configure_environment(mock.url)
+
+    from app.batch import read_prompts, plan_jobs, run_batch, load_checkpoint, format_for_path, ResultWriter
+    from app.history import set_tokenizer, load_tokenizer
+    from config import Config
+
+    logging.basicConfig(level=Config.LOG_LEVEL)
+    set_tokenizer(load_tokenizer(Config.TOKENIZER))
+
+    with open(args.prompts, encoding='utf-8') as f:
+        prompts = list(read_prompts(f))
+    fmt = format_for_path(args.output)
+    if args.no_resume:
+        open(args.output, 'w').close()
+    completed = load_checkpoint(args.output, fmt)
+    if completed:
+        print(f"Resuming: {len(completed)} calls already done", file=sys.stderr)
+
+    writer = ResultWriter(args.output, fmt)
+    start = time.perf_counter()
+    done = failed = 0
+    try:
+        jobs = plan_jobs(prompts, args.providers)
+        for row in run_batch(jobs, args.concurrency or Config.BATCH_CONCURRENCY, args.reasoning, completed):
+            writer.write(row)
+            done += 1
+            if row['status'] != 'ok':
+                failed += 1
+            print(f"[{done}] {row['provider']}/{row['model']} id={row['id']} {row['status']} "
+                  f"{row['latency']:.2f}s", file=sys.stderr)
+    finally:
+        writer.close()
+    print(f"{done} calls ({failed} failed) in {time.perf_counter() - start:.1f}s -> {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
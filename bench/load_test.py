@@ -0,0 +1,222 @@
+"""Offline load driver for the /chat endpoint.
+
+Starts the mock LLM server and the Flask app in-process, points the provider
+SDKs at the mock through their ``*_BASE_URL`` environment variables, then
+drives ``/chat`` with M concurrent clients against N providers and reports
+latency percentiles, time-to-first-token and throughput. No network access
+or API keys are needed.
+
+    python -m bench.load_test --providers groq,openai,cerebras,anthropic --clients 8 --requests 20
+"""
+from bench.mock_llm_server import start_mock_server, add_settings_arguments, settings_from_args
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+DEFAULT_MODELS = {
+    'groq': 'llama-3.1-8b-instant',
+    'openai': 'gpt-4o-mini',
+    'cerebras': 'llama3.1-8b',
+    'anthropic': 'claude-2.1',
+}
+
+
+def configure_environment(mock_url):
+    os.environ.update({
+        'GROQ_BASE_URL': mock_url,
+        'OPENAI_BASE_URL': f"{mock_url}/v1",
+        'CEREBRAS_BASE_URL': mock_url,
+        'ANTHROPIC_BASE_URL': mock_url,
+    })
+    for name in ('GROQ', 'OPENAI', 'CEREBRAS', 'ANTHROPIC'):
+        os.environ.setdefault(f"{name}_API_KEY", 'mock-key')
+
+
+def start_app_server():
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name='app-server', daemon=True).start()
+    return server
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Client:
+    def __init__(self, port, providers, stateless=False):
+        self.port = port
+        self.providers = providers
+        # A stateless client starts a new conversation on every request.
+        self.stateless = stateless
+        self.cookie = None
+
+    def _headers(self, extra=None):
+        headers = dict(extra or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        return headers
+
+    def _remember_cookie(self, response):
+        cookie = response.getheader('Set-Cookie')
+        if cookie and not self.stateless:
+            self.cookie = cookie.split(';', 1)[0]
+
+    def chat(self, message, use_reasoning=False):
+        conn = HTTPConnection('127.0.0.1', self.port, timeout=120)
+        start = time.perf_counter()
+        conn.request('POST', '/chat', body=json.dumps({
+            'message': message, 'providers': self.providers,
+            'use_reasoning': use_reasoning, 'use_streaming': False,
+        }), headers=self._headers({'Content-Type': 'application/json'}))
+        response = conn.getresponse()
+        self._remember_cookie(response)
+        data = json.loads(response.read())
+        elapsed = time.perf_counter() - start
+        conn.close()
+        errors = [p for p, r in data.get('responses', {}).items() if r.startswith('Error:')]
+        ok = response.status == 200 and not errors
+        return {'ok': ok, 'latency': elapsed, 'ttft': None}
+
+    def chat_stream(self, message, use_reasoning=False):
+        conn = HTTPConnection('127.0.0.1', self.port, timeout=120)
+        query = urlencode({
+            'message': message, 'providers': json.dumps(self.providers),
+            'use_reasoning': 'true' if use_reasoning else 'false', 'use_streaming': 'true',
+        })
+        start = time.perf_counter()
+        conn.request('GET', f"/chat?{query}", headers=self._headers())
+        response = conn.getresponse()
+        self._remember_cookie(response)
+        ttft = None
+        ok = response.status == 200
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if not line.startswith(b'data: '):
+                continue
+            payload = json.loads(line[6:])
+            if payload.get('type') == 'chunk' and ttft is None:
+                ttft = time.perf_counter() - start
+            elif payload.get('type') == 'error':
+                ok = False
+            elif payload.get('type') == 'end':
+                break
+        elapsed = time.perf_counter() - start
+        conn.close()
+        return {'ok': ok, 'latency': elapsed, 'ttft': ttft}
+
+
+def run_load(port, providers, mode, clients, requests, use_reasoning=False, same_message=False):
+    results = []
+    lock = threading.Lock()
+
+    def worker(index):
+        client = Client(port, providers, stateless=same_message)
+        for i in range(requests):
+            if same_message:
+                message = f"Benchmark message {i}"
+            else:
+                message = f"Benchmark message {i} from client {index}"
+            try:
+                if mode == 'stream':
+                    result = client.chat_stream(message, use_reasoning)
+                else:
+                    result = client.chat(message, use_reasoning)
+            except Exception as e:
+                result = {'ok': False, 'latency': None, 'ttft': None, 'error': str(e)}
+            with lock:
+                results.append(result)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return summarize(mode, results, wall)
+
+
+def summarize(mode, results, wall):
+    latencies = [r['latency'] for r in results if r['ok'] and r['latency'] is not None]
+    ttfts = [r['ttft'] for r in results if r['ok'] and r['ttft'] is not None]
+    summary = {
+        'mode': mode,
+        'requests': len(results),
+        'errors': sum(1 for r in results if not r['ok']),
+        'requests_per_second': len(results) / wall if wall else 0.0,
+    }
+    for q in (50, 95, 99):
+        summary[f'latency_p{q}'] = percentile(latencies, q)
+        summary[f'ttft_p{q}'] = percentile(ttfts, q) if ttfts else None
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{summary['mode']}: {summary['requests']} requests, {summary['errors']} errors, "
+          f"{summary['requests_per_second']:.1f} req/s, {summary['upstream_calls']} upstream calls")
+    print("  latency  p50 {latency_p50:.3f}s  p95 {latency_p95:.3f}s  p99 {latency_p99:.3f}s".format(**summary))
+    if summary['ttft_p50'] is not None:
+        print("  ttft     p50 {ttft_p50:.3f}s  p95 {ttft_p95:.3f}s  p99 {ttft_p99:.3f}s".format(**summary))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--providers', default='groq,openai,cerebras,anthropic',
+                        help=f"Comma-separated providers ({', '.join(DEFAULT_MODELS)})")
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=10, help='Requests per client')
+    parser.add_argument('--mode', choices=('stream', 'json', 'both'), default='both')
+    parser.add_argument('--reasoning', action='store_true', help='Use reasoning mode')
+    parser.add_argument('--same-message', action='store_true',
+                        help='Every client sends the same prompts in fresh conversations (bursty identical traffic)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    providers = {}
+    for name in args.providers.split(','):
+        name = name.strip()
+        if name not in DEFAULT_MODELS:
+            parser.error(f"The mock server does not support provider '{name}'")
+        providers[name] = DEFAULT_MODELS[name]
+
+    logging.disable(logging.CRITICAL)
+    mock = start_mock_server(settings_from_args(args))
+    configure_environment(mock.url)
+    app_server = start_app_server()
+
+    modes = ('json', 'stream') if args.mode == 'both' else (args.mode,)
+    summaries = []
+    for mode in modes:
+        upstream_before = mock.requests
+        summary = run_load(app_server.server_port, providers, mode, args.clients, args.requests,
+                           args.reasoning, args.same_message)
+        summary['upstream_calls'] = mock.requests - upstream_before
+        summaries.append(summary)
+
+    app_server.shutdown()
+    mock.shutdown()
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        for summary in summaries:
+            print_summary(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""Local mock LLM server for offline benchmarks.
+
+Speaks the OpenAI-style chat-completions shape used by the OpenAI, Groq and
+Cerebras SDKs (any path ending in ``/chat/completions``), the Anthropic
+Messages API (``/v1/messages``, including prompt caching) and the legacy
+Anthropic text completions shape (``/v1/complete``), streaming and
+non-streaming, with configurable latency, tail latency, token rate, prefill
+rate and failure injection.
+
+    python -m bench.mock_llm_server --port 8910 --latency 0.2 --token-rate 200
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+         "tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+class MockSettings:
+    def __init__(self, latency=0.1, token_rate=100.0, tokens=50, failure_rate=0.0, failure_status=500,
+                 tail_rate=0.0, tail_latency=2.0, prefill_rate=0.0):
+        self.latency = latency
+        # Uncached input tokens processed per second before the first token
+        # (0 = free), so prompt caching shows up in the latency.
+        self.prefill_rate = prefill_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+
+
+def _tokens(count):
+    return [WORDS[i % len(WORDS)] + ' ' for i in range(count)]
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockPromptCache:
+    # Emulates Anthropic prompt caching: every block marked with
+    # ``cache_control`` caches the prompt prefix up to and including it, and
+    # a later request reads the longest cached prefix it shares. Unlike the
+    # real API there is no minimum cacheable length and entries never expire.
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def usage(self, body):
+        blocks = []
+        system = body.get('system') or []
+        if isinstance(system, str):
+            system = [{'type': 'text', 'text': system}]
+        blocks.extend(('system', block) for block in system)
+        for message in body.get('messages', []):
+            content = message['content']
+            if isinstance(content, str):
+                content = [{'type': 'text', 'text': content}]
+            blocks.extend((message['role'], block) for block in content)
+
+        digest = hashlib.sha256()
+        total = 0
+        breakpoints = []
+        for role, block in blocks:
+            text = block.get('text', '')
+            digest.update(f"{role}\0{text}\0".encode('utf-8'))
+            total += _count_tokens(text)
+            if block.get('cache_control'):
+                breakpoints.append((digest.hexdigest(), total))
+
+        with self._lock:
+            read = max((tokens for key, tokens in breakpoints if key in self._prefixes), default=0)
+            written = max((tokens for key, tokens in breakpoints), default=0)
+            for key, tokens in breakpoints:
+                self._prefixes[key] = tokens
+            while len(self._prefixes) > self.max_entries:
+                self._prefixes.pop(next(iter(self._prefixes)))
+        creation = max(0, written - read)
+        return {
+            'input_tokens': total - read - creation,
+            'cache_read_input_tokens': read,
+            'cache_creation_input_tokens': creation,
+        }
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        path = self.path.split('?')[0]
+        self.server.count_request()
+
+        if self.settings.failure_rate and random.random() < self.settings.failure_rate:
+            return self._send_json(self.settings.failure_status, {
+                'error': {'type': 'mock_failure', 'message': 'Injected failure'}
+            })
+
+        if path.endswith('/chat/completions'):
+            handler = self._chat_completions
+        elif path.endswith('/v1/messages'):
+            handler = self._anthropic_messages
+        elif path.endswith('/v1/complete'):
+            handler = self._anthropic_complete
+        else:
+            return self._send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+        if self.settings.tail_rate and random.random() < self.settings.tail_rate:
+            time.sleep(self.settings.tail_latency)
+        else:
+            time.sleep(self.settings.latency)
+        try:
+            handler(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-stream, e.g. a cancelled generation.
+            pass
+
+    def _sleep_per_token(self):
+        if self.settings.token_rate:
+            time.sleep(1.0 / self.settings.token_rate)
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def _write_event(self, data, event=None):
+        frame = f"event: {event}\n" if event else ''
+        frame += f"data: {data}\n\n"
+        self.wfile.write(frame.encode('utf-8'))
+        self.wfile.flush()
+
+    def _chat_completions(self, body):
+        model = body.get('model', 'mock')
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        tokens = _tokens(self.settings.tokens)
+
+        if not body.get('stream'):
+            time.sleep(len(tokens) / self.settings.token_rate if self.settings.token_rate else 0)
+            return self._send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'system_fingerprint': 'fp_mock',
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': sum(len(m.get('content', '')) // 4 for m in body.get('messages', [])),
+                    'completion_tokens': len(tokens),
+                    'total_tokens': len(tokens),
+                },
+                'time_info': {'queue_time': 0.0, 'prompt_time': 0.0,
+                              'completion_time': 0.0, 'total_time': 0.0},
+            })
+
+        self._start_stream()
+        for i, token in enumerate(tokens + [None]):
+            if token is not None:
+                self._sleep_per_token()
+            self._write_event(json.dumps({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'system_fingerprint': 'fp_mock',
+                'choices': [{
+                    'index': 0,
+                    'delta': {'role': 'assistant', 'content': token} if i == 0 else ({'content': token} if token else {}),
+                    'finish_reason': None if token is not None else 'stop',
+                }],
+            }))
+        self._write_event('[DONE]')
+
+    def _prefill(self, input_tokens):
+        if self.settings.prefill_rate:
+            time.sleep(input_tokens / self.settings.prefill_rate)
+
+    def _anthropic_messages(self, body):
+        model = body.get('model', 'mock')
+        message_id = f"msg_{uuid.uuid4().hex}"
+        tokens = _tokens(min(self.settings.tokens, body.get('max_tokens', self.settings.tokens)))
+        usage = self.server.prompt_cache.usage(body)
+        self._prefill(usage['input_tokens'] + usage['cache_creation_input_tokens'])
+        message = {
+            'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model,
+            'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': dict(usage, output_tokens=1),
+        }
+
+        if not body.get('stream'):
+            time.sleep(len(tokens) / self.settings.token_rate if self.settings.token_rate else 0)
+            message.update(content=[{'type': 'text', 'text': ''.join(tokens)}], stop_reason='end_turn',
+                           usage=dict(usage, output_tokens=len(tokens)))
+            return self._send_json(200, message)
+
+        self._start_stream()
+        self._write_event(json.dumps({'type': 'message_start', 'message': message}), event='message_start')
+        self._write_event(json.dumps({
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''},
+        }), event='content_block_start')
+        self._write_event(json.dumps({'type': 'ping'}), event='ping')
+        for token in tokens:
+            self._sleep_per_token()
+            self._write_event(json.dumps({
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': token},
+            }), event='content_block_delta')
+        self._write_event(json.dumps({'type': 'content_block_stop', 'index': 0}), event='content_block_stop')
+        self._write_event(json.dumps({
+            'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': len(tokens)},
+        }), event='message_delta')
+        self._write_event(json.dumps({'type': 'message_stop'}), event='message_stop')
+
+    def _anthropic_complete(self, body):
+        model = body.get('model', 'mock')
+        completion_id = f"compl_{uuid.uuid4().hex}"
+        tokens = _tokens(min(self.settings.tokens, body.get('max_tokens_to_sample', self.settings.tokens)))
+
+        if not body.get('stream'):
+            time.sleep(len(tokens) / self.settings.token_rate if self.settings.token_rate else 0)
+            return self._send_json(200, {
+                'type': 'completion',
+                'id': completion_id,
+                'completion': ''.join(tokens),
+                'stop_reason': 'stop_sequence',
+                'model': model,
+            })
+
+        self._start_stream()
+        for token in tokens:
+            self._sleep_per_token()
+            self._write_event(json.dumps({
+                'type': 'completion', 'id': completion_id, 'completion': token,
+                'stop_reason': None, 'model': model,
+            }), event='completion')
+        self._write_event(json.dumps({
+            'type': 'completion', 'id': completion_id, 'completion': '',
+            'stop_reason': 'stop_sequence', 'model': model,
+        }), event='completion')
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under bursts of new
+    # connections, which shows up as multi-second connect stalls.
+    request_queue_size = 128
+
+    def __init__(self, address, settings):
+        super().__init__(address, MockLLMHandler)
+        self.settings = settings
+        self.prompt_cache = MockPromptCache()
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+
+    def count_request(self):
+        with self._requests_lock:
+            self.requests += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(settings=None, host='127.0.0.1', port=0):
+    server = MockLLMServer((host, port), settings or MockSettings())
+    thread = threading.Thread(target=server.serve_forever, name='mock-llm-server', daemon=True)
+    thread.start()
+    return server
+
+
+def add_settings_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds before the first token')
+    parser.add_argument('--token-rate', type=float, default=100.0, help='Tokens per second after the first')
+    parser.add_argument('--tokens', type=int, default=50, help='Tokens per response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--failure-status', type=int, default=500, help='HTTP status for injected failures')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='Fraction of requests with tail latency')
+    parser.add_argument('--tail-latency', type=float, default=2.0, help='Seconds before the first token on tail requests')
+    parser.add_argument('--prefill-rate', type=float, default=0.0,
+                        help='Uncached input tokens processed per second before the first token (0 = free)')
+
+
+def settings_from_args(args):
+    return MockSettings(latency=args.latency, token_rate=args.token_rate, tokens=args.tokens,
+                        failure_rate=args.failure_rate, failure_status=args.failure_status,
+                        tail_rate=args.tail_rate, tail_latency=args.tail_latency, prefill_rate=args.prefill_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8910)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockLLMServer((args.host, args.port), settings_from_args(args))
+    print(f"Mock LLM server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
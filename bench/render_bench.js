@@ -0,0 +1,241 @@
+// Feeds synthetic chunk streams through static/js/stream_render.js with a
+// stub DOM and reports the per-chunk cost as the responses grow, next to
+// the old approach of reassigning the whole textContent on every chunk.
+//
+//     node bench/render_bench.js --providers 5 --chunks 4000
+//
+// "chars/chunk" counts the characters handed to the DOM (text nodes,
+// textContent, innerHTML): in a browser that is what gets re-laid out, so a
+// flat column means flat rendering cost. "us/chunk" is the JS time,
+// including the stub DOM. Both are reported per tenth of the stream. The
+// run also checks that incremental output matches rendering the final text
+// in one go.
+'use strict';
+
+const path = require('path');
+const { StreamRenderer } = require(path.join(__dirname, '..', 'static', 'js', 'stream_render.js'));
+
+function parseArgs(argv) {
+    const args = { providers: 5, chunks: 4000, seed: 1 };
+    for (let i = 0; i < argv.length; i += 2) {
+        const name = argv[i].replace(/^--/, '');
+        if (!(name in args)) {
+            throw new Error(`Unknown option ${argv[i]}`);
+        }
+        args[name] = Number(argv[i + 1]);
+    }
+    return args;
+}
+
+// Stub DOM: just enough of Node/Element/Text for the renderer, counting the
+// characters written.
+const stats = { chars: 0 };
+
+class StubNode {
+    constructor() {
+        this.childNodes = [];
+        this.parentNode = null;
+    }
+
+    appendChild(node) {
+        node.parentNode = this;
+        this.childNodes.push(node);
+        return node;
+    }
+
+    insertBefore(node, reference) {
+        node.parentNode = this;
+        this.childNodes.splice(this.childNodes.lastIndexOf(reference), 0, node);
+        return node;
+    }
+}
+
+class StubText extends StubNode {
+    constructor(data) {
+        super();
+        this.data = data;
+        stats.chars += data.length;
+    }
+
+    serialize() {
+        return this.data.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+    }
+}
+
+class StubElement extends StubNode {
+    constructor(tag) {
+        super();
+        this.tag = tag;
+        this.html = null;
+    }
+
+    set textContent(value) {
+        this.childNodes = [];
+        this.html = null;
+        if (value) {
+            this.appendChild(new StubText(value));
+        }
+    }
+
+    set innerHTML(value) {
+        this.childNodes = [];
+        this.html = value;
+        stats.chars += value.length;
+    }
+
+    serialize() {
+        const inner = this.html !== null ? this.html : this.childNodes.map(node => node.serialize()).join('');
+        return this.tag === 'div' ? inner : `<${this.tag}>${inner}</${this.tag}>`;
+    }
+}
+
+const stubDocument = {
+    createElement: tag => new StubElement(tag),
+    createTextNode: data => new StubText(data),
+};
+
+// Synthetic markdown-ish responses: paragraphs, headings, lists and code
+// blocks, streamed a few words at a time.
+function random(seed) {
+    let state = seed;
+    return () => {
+        state = (state * 1103515245 + 12345) % 2147483648;
+        return state / 2147483648;
+    };
+}
+
+const WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    + 'et dolore magna aliqua **bold** *stressed* `code` [link](https://example.com) <tag> &').split(' ');
+
+function response(rand, chunks) {
+    let text = '';
+    const sentence = count => Array.from({ length: count }, () => WORDS[Math.floor(rand() * WORDS.length)]).join(' ');
+    while (text.length < chunks * 8) {
+        const kind = rand();
+        if (kind < 0.1) {
+            text += `## ${sentence(4)}\n\n`;
+        } else if (kind < 0.3) {
+            text += Array.from({ length: 4 }, () => `- ${sentence(6)}`).join('\n') + '\n\n';
+        } else if (kind < 0.4) {
+            text += '```python\n' + Array.from({ length: 12 }, () => `    ${sentence(5)}`).join('\n') + '\n```\n\n';
+        } else {
+            text += sentence(40) + '.\n' + sentence(20) + '.\n\n';
+        }
+    }
+    const parts = [];
+    let pos = 0;
+    while (parts.length < chunks - 1 && pos < text.length) {
+        const size = 2 + Math.floor(rand() * 12);
+        parts.push(text.slice(pos, pos + size));
+        pos += size;
+    }
+    parts.push(text.slice(pos));
+    return parts;
+}
+
+function runNaive(streams, framesEvery, record) {
+    // The old onmessage: concatenate, then reassign the whole text.
+    const columns = streams.map(() => ({ text: '', element: new StubElement('p') }));
+    walk(streams, framesEvery, record, (i, chunk) => {
+        columns[i].text += chunk;
+        columns[i].element.textContent = columns[i].text;
+    }, () => {});
+    return columns.map(column => column.element);
+}
+
+function runRenderer(streams, framesEvery, record, markdown) {
+    const frames = [];
+    const renderer = new StreamRenderer({ markdown, document: stubDocument, schedule: callback => frames.push(callback) });
+    const elements = streams.map((_, i) => {
+        const element = new StubElement('div');
+        renderer.addColumn(i, element);
+        return element;
+    });
+    walk(streams, framesEvery, record, (i, chunk) => renderer.append(i, chunk), () => {
+        frames.splice(0).forEach(callback => callback());
+    });
+    renderer.flush();
+    return elements;
+}
+
+function walk(streams, framesEvery, record, onChunk, onFrame) {
+    // Round-robin over the providers; a frame runs every ``framesEvery``
+    // chunks. Cost is charged to the tenth of the stream it falls in.
+    const total = streams.reduce((sum, chunks) => sum + chunks.length, 0);
+    const longest = Math.max(...streams.map(chunks => chunks.length));
+    let seen = 0;
+    for (let n = 0; n < longest; n++) {
+        for (let i = 0; i < streams.length; i++) {
+            if (n >= streams[i].length) {
+                continue;
+            }
+            const bucket = Math.min(9, Math.floor(seen / total * 10));
+            const chars = stats.chars;
+            const start = process.hrtime.bigint();
+            onChunk(i, streams[i][n]);
+            seen += 1;
+            if (seen % framesEvery === 0) {
+                onFrame();
+            }
+            record(bucket, Number(process.hrtime.bigint() - start) / 1000, stats.chars - chars);
+        }
+    }
+    onFrame();
+}
+
+function measure(name, run) {
+    const buckets = Array.from({ length: 10 }, () => ({ chunks: 0, micros: 0, chars: 0 }));
+    const elements = run((bucket, micros, chars) => {
+        buckets[bucket].chunks += 1;
+        buckets[bucket].micros += micros;
+        buckets[bucket].chars += chars;
+    });
+    return {
+        name,
+        elements,
+        micros: buckets.map(bucket => bucket.micros / bucket.chunks),
+        chars: buckets.map(bucket => bucket.chars / bucket.chunks),
+    };
+}
+
+function main() {
+    const args = parseArgs(process.argv.slice(2));
+    const rand = random(args.seed);
+    const streams = Array.from({ length: args.providers }, () => response(rand, args.chunks));
+    // About two chunks per provider per frame.
+    const framesEvery = args.providers * 2;
+
+    const results = [
+        measure('textContent', record => runNaive(streams, framesEvery, record)),
+        measure('plain', record => runRenderer(streams, framesEvery, record, false)),
+        measure('markdown', record => runRenderer(streams, framesEvery, record, true)),
+    ];
+
+    // Chunk boundaries must not change the output.
+    const plain = results[1].elements.map(element => element.childNodes.map(node => node.data).join(''));
+    const markdown = results[2].elements.map(element => element.serialize());
+    const whole = runRenderer(streams.map(chunks => [chunks.join('')]), 1, () => {}, true).map(element => element.serialize());
+    streams.forEach((chunks, i) => {
+        if (plain[i] !== chunks.join('')) {
+            throw new Error(`plain output of stream ${i} differs from its text`);
+        }
+        if (markdown[i] !== whole[i]) {
+            throw new Error(`incremental markdown of stream ${i} differs from rendering it in one go`);
+        }
+    });
+
+    const total = streams.reduce((sum, chunks) => sum + chunks.join('').length, 0);
+    console.log(`${args.providers} streams x ${args.chunks} chunks (${total} characters), a frame every ${framesEvery} chunks`);
+    console.log('');
+    const header = ['progress'].concat(results.flatMap(result => [`${result.name} us/chunk`, 'chars/chunk']));
+    const rows = Array.from({ length: 10 }, (_, bucket) => [`${bucket * 10}-${bucket * 10 + 10}%`].concat(
+        results.flatMap(result => [result.micros[bucket].toFixed(2), result.chars[bucket].toFixed(0)])
+    ));
+    const widths = header.map((title, column) => Math.max(title.length, ...rows.map(row => row[column].length)));
+    for (const row of [header].concat(rows)) {
+        console.log(row.map((cell, column) => cell.padStart(widths[column])).join('  '));
+    }
+}
+
+main();
@@ -0,0 +1,133 @@
+"""Worker cold-start benchmark.
+
+Boots the app in fresh interpreters and reports how long ``create_app()``
+takes, including imports, with lazy SDK loading, with ``PRELOAD_SDKS`` and
+with every provider SDK imported eagerly (the old behaviour). It also reports
+the import time of each provider SDK on its own. Runs are repeated and the
+median is reported.
+
+    python -m bench.startup --providers groq,openai --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SDK_MODULES = {
+    'groq': 'groq',
+    'openai': 'openai',
+    'cerebras': 'cerebras.cloud.sdk',
+    'anthropic': 'anthropic',
+    'gemini': 'google.generativeai',
+}
+
+API_KEYS = {
+    'groq': 'GROQ_API_KEY',
+    'openai': 'OPENAI_API_KEY',
+    'cerebras': 'CEREBRAS_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+    'gemini': 'GEMINI_API_KEY',
+}
+
+BOOT_SCRIPT = """
+import time
+start = time.perf_counter()
+for module in {eager!r}:
+    __import__(module)
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+import json, sys
+loaded = [name for name, module in {sdks!r}.items() if module in sys.modules]
+print(json.dumps([elapsed, loaded]))
+"""
+
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+__import__({module!r})
+print(json.dumps([time.perf_counter() - start, []]))
+"""
+
+
+def run(script, env):
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(name, script, env, repeat):
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        elapsed, loaded = run(script, env)
+        timings.append(elapsed)
+    return {
+        'scenario': name,
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+        'sdks_loaded': loaded,
+    }
+
+
+def build_env(providers, preload=False):
+    env = {key: value for key, value in os.environ.items()
+           if key not in API_KEYS.values() and key != 'PRELOAD_SDKS'}
+    for provider in providers:
+        env[API_KEYS[provider]] = 'benchmark-key'
+    if preload:
+        env['PRELOAD_SDKS'] = '1'
+    env['LOG_LEVEL'] = 'WARNING'
+    return env
+
+
+def run_benchmark(providers, repeat):
+    results = [
+        measure('create_app (lazy)', BOOT_SCRIPT.format(eager=[], sdks=SDK_MODULES),
+                build_env(providers), repeat),
+        measure('create_app (PRELOAD_SDKS)', BOOT_SCRIPT.format(eager=[], sdks=SDK_MODULES),
+                build_env(providers, preload=True), repeat),
+        measure('create_app (all SDKs eager)', BOOT_SCRIPT.format(eager=list(SDK_MODULES.values()), sdks=SDK_MODULES),
+                build_env(providers), repeat),
+    ]
+    for module in SDK_MODULES.values():
+        results.append(measure(f"import {module}", IMPORT_SCRIPT.format(module=module),
+                               build_env(providers), repeat))
+    return results
+
+
+def print_results(results):
+    width = max(len(result['scenario']) for result in results)
+    for result in results:
+        loaded = f"  sdks: {', '.join(result['sdks_loaded'])}" if result['sdks_loaded'] else ''
+        print(f"{result['scenario']:<{width}}  median {result['median_ms']:7.1f}ms  "
+              f"min {result['min_ms']:7.1f}ms  max {result['max_ms']:7.1f}ms{loaded}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--providers', default='groq,openai',
+                        help=f"Comma-separated providers with API keys configured ({', '.join(SDK_MODULES)})")
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per scenario')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    providers = [name.strip() for name in args.providers.split(',') if name.strip()]
+    for name in providers:
+        if name not in SDK_MODULES:
+            parser.error(f"Unknown provider '{name}'")
+
+    results = run_benchmark(providers, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
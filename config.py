@@ -1,3 +1,4 @@
+import json
 import os
 
 class Config:
@@ -8,6 +9,152 @@ class Config:
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     CEREBRAS_API_KEY = os.environ.get('CEREBRAS_API_KEY')
 
+    # Import the SDKs of all configured providers at startup instead of on
+    # first use (useful with pre-fork servers such as gunicorn --preload)
+    PRELOAD_SDKS = os.environ.get('PRELOAD_SDKS', '').lower() in ('1', 'true', 'yes')
+
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    # Adds a Server-Timing header with the time spent in the app per request
+    TIMING_HEADER = os.environ.get('TIMING_HEADER', '').lower() in ('1', 'true', 'yes')
+    # Model names come from the client: each provider gets its own metric
+    # series, circuit breaker and latency baseline for its first
+    # METRICS_MAX_MODELS models only, later ones share the "other" model
+    METRICS_MAX_MODELS = int(os.environ.get('METRICS_MAX_MODELS', 32))
+
+    # Concurrent fan-out of provider calls
+    PROVIDER_TIMEOUT = float(os.environ.get('PROVIDER_TIMEOUT', 60))
+    FANOUT_MAX_WORKERS = int(os.environ.get('FANOUT_MAX_WORKERS', 16))
+    # Threads for streamed provider calls, one per provider per open stream
+    STREAM_MAX_WORKERS = int(os.environ.get('STREAM_MAX_WORKERS', 256))
+    # Threads producing the streamed responses under WSGI, one per open stream
+    STREAM_SESSION_MAX_WORKERS = int(os.environ.get('STREAM_SESSION_MAX_WORKERS', 64))
+
+    # Streaming output: after a provider's first chunk, deltas are coalesced
+    # until the oldest is SSE_FLUSH_INTERVAL seconds old or SSE_FLUSH_BYTES
+    # characters are buffered (interval 0 disables coalescing); idle streams
+    # get a heartbeat comment every SSE_HEARTBEAT_INTERVAL seconds (0 disables)
+    SSE_FLUSH_INTERVAL = float(os.environ.get('SSE_FLUSH_INTERVAL', 0.03))
+    SSE_FLUSH_BYTES = int(os.environ.get('SSE_FLUSH_BYTES', 1024))
+    SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))
+    # Streams outlive their connection for STREAM_RESUME_GRACE seconds, so an
+    # EventSource reconnect with Last-Event-ID resumes from a replay buffer of
+    # the last STREAM_REPLAY_EVENTS writes; after that the provider streams
+    # are closed (0 closes them as soon as the client goes away)
+    STREAM_RESUME_GRACE = float(os.environ.get('STREAM_RESUME_GRACE', 5))
+    STREAM_REPLAY_EVENTS = int(os.environ.get('STREAM_REPLAY_EVENTS', 1000))
+
+    # Identical in-flight provider calls (same provider, model and messages)
+    # share one upstream call
+    COALESCE_REQUESTS = os.environ.get('COALESCE_REQUESTS', 'true').lower() in ('1', 'true', 'yes')
+
+    # Client-side rate limits per provider as JSON, e.g.
+    # {"groq": {"requests": 30, "tokens": 6000}}; values are per minute and a
+    # provider without an entry is not rate limited
+    RATE_LIMITS = json.loads(os.environ.get('RATE_LIMITS') or '{}')
+    # Tokens assumed for the completion when charging the tokens/min bucket
+    RATE_LIMIT_COMPLETION_TOKENS = int(os.environ.get('RATE_LIMIT_COMPLETION_TOKENS', 256))
+    # Calls queue for at most RATE_LIMIT_MAX_WAIT seconds instead of failing;
+    # beyond RATE_LIMIT_MAX_QUEUE waiting calls new ones are rejected at once
+    RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 30))
+    RATE_LIMIT_MAX_QUEUE = int(os.environ.get('RATE_LIMIT_MAX_QUEUE', 100))
+    # Adaptive (AIMD) concurrency limit per provider; off by default, when
+    # only the requests/min and tokens/min limits above apply
+    ADAPTIVE_CONCURRENCY = os.environ.get('ADAPTIVE_CONCURRENCY', '').lower() in ('1', 'true', 'yes')
+    CONCURRENCY_INITIAL = int(os.environ.get('CONCURRENCY_INITIAL', 8))
+    CONCURRENCY_MIN = int(os.environ.get('CONCURRENCY_MIN', 1))
+    CONCURRENCY_MAX = int(os.environ.get('CONCURRENCY_MAX', 64))
+    # A recent median latency more than this multiple of the model's baseline
+    # median counts as overload
+    CONCURRENCY_LATENCY_TOLERANCE = float(os.environ.get('CONCURRENCY_LATENCY_TOLERANCE', 2.0))
+
+    # Retries of transient provider errors (429, 5xx, timeouts) with
+    # full-jitter exponential backoff; 1 disables retries
+    RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+    RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 0.25))
+    RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 4))
+    # Circuit breaker per provider/model
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+    # Hedged requests: send a duplicate when a call is still unanswered after
+    # the rolling HEDGE_PERCENTILE latency (time to first chunk for streams)
+    HEDGE_REQUESTS = os.environ.get('HEDGE_REQUESTS', '').lower() in ('1', 'true', 'yes')
+    HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 95))
+    HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))
+    HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 0.05))
+    # Race mode (race=true on /chat): the first non-empty answer wins and the
+    # other providers are cancelled. Racers start fastest first by rolling
+    # median time to first chunk; each later one starts once the race has run
+    # past the RACE_HEDGE_PERCENTILE of the one before it (0 starts them all
+    # at once). Providers with fewer than RACE_MIN_SAMPLES samples start at once
+    RACE_HEDGE_PERCENTILE = float(os.environ.get('RACE_HEDGE_PERCENTILE', 90))
+    RACE_MIN_SAMPLES = int(os.environ.get('RACE_MIN_SAMPLES', 5))
+    # Fallback chain per provider and model, tried in order when a provider is
+    # unavailable (circuit open, retries exhausted, rate limit queue timeout)
+    FALLBACK_ENABLED = os.environ.get('FALLBACK_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    FALLBACKS = {
+        'groq': {
+            'llama-3.1-8b-instant': [('cerebras', 'llama3.1-8b')],
+            'llama-3.1-70b-versatile': [('cerebras', 'llama3.1-70b')],
+        },
+        'cerebras': {
+            'llama3.1-8b': [('groq', 'llama-3.1-8b-instant')],
+            'llama3.1-70b': [('groq', 'llama-3.1-70b-versatile')],
+        },
+    }
+
+    # Reasoning mode: 'two_phase' (reasoning call, then answer call) or
+    # 'structured' (reasoning and answer in a single call)
+    REASONING_MODE = os.environ.get('REASONING_MODE', 'two_phase')
+
+    # Anthropic Messages API: answer length cap, and prompt caching of the
+    # conversation prefix (cache breakpoints on the last two user turns)
+    ANTHROPIC_MAX_TOKENS = int(os.environ.get('ANTHROPIC_MAX_TOKENS', 4096))
+    ANTHROPIC_PROMPT_CACHING = os.environ.get('ANTHROPIC_PROMPT_CACHING', 'true').lower() in ('1', 'true', 'yes')
+
+    # Batch evaluation (/batch and batch.py): calls in flight per batch, and
+    # where named /batch runs keep their output (which is also the checkpoint)
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+    BATCH_DIR = os.environ.get('BATCH_DIR', 'batches')
+
+    # Server-side conversation history ('memory' or 'sqlite')
+    CONVERSATION_STORE = os.environ.get('CONVERSATION_STORE', 'memory')
+    CONVERSATION_DB_PATH = os.environ.get('CONVERSATION_DB_PATH', 'conversations.db')
+    CONVERSATION_CACHE_SIZE = int(os.environ.get('CONVERSATION_CACHE_SIZE', 1000))
+    # Gemini chat sessions kept across turns (one per conversation and model)
+    GEMINI_SESSION_CACHE_SIZE = int(os.environ.get('GEMINI_SESSION_CACHE_SIZE', 1000))
+
+    # Opt-in append-only log of every turn, searchable through /history/search
+    CONVERSATION_LOG = os.environ.get('CONVERSATION_LOG', '').lower() in ('1', 'true', 'yes')
+    CONVERSATION_LOG_PATH = os.environ.get('CONVERSATION_LOG_PATH', 'conversation_log.db')
+    CONVERSATION_LOG_BATCH_SIZE = int(os.environ.get('CONVERSATION_LOG_BATCH_SIZE', 500))
+    CONVERSATION_LOG_MAX_QUEUE = int(os.environ.get('CONVERSATION_LOG_MAX_QUEUE', 100000))
+    # /history/search is unauthenticated and covers every conversation, so it
+    # is off unless enabled as well
+    HISTORY_SEARCH = os.environ.get('HISTORY_SEARCH', '').lower() in ('1', 'true', 'yes')
+
+    # Token-budgeted history window ('estimate' or 'tiktoken')
+    TOKENIZER = os.environ.get('TOKENIZER', 'estimate')
+    HISTORY_LOAD_LIMIT = int(os.environ.get('HISTORY_LOAD_LIMIT', 200))
+    HISTORY_DEFAULT_TOKEN_BUDGET = int(os.environ.get('HISTORY_DEFAULT_TOKEN_BUDGET', 4000))
+    HISTORY_TOKEN_BUDGETS = {
+        'groq': 6000,
+        'cerebras': 6000,
+        'openai': 16000,
+        'anthropic': 16000,
+        'gemini': 32000,
+    }
+    HISTORY_MODEL_TOKEN_BUDGETS = {
+        'gemma-7b-it': 6000,
+        'gemma2-9b-it': 6000,
+        'llama3.1-8b': 6000,
+    }
+
+    # Opt-in response cache ('memory' or 'disk'); disabled when unset
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE') or None
+    RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', 'response_cache.db')
+
     @classmethod
     def get_cerebras_api_key(cls):
         if cls.CEREBRAS_API_KEY is None:
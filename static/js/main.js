@@ -10,6 +10,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const comparisonContainer = document.getElementById('comparison-container');
     const reasoningCheckbox = document.getElementById('reasoning-checkbox');
     const streamingCheckbox = document.getElementById('streaming-checkbox');
+    const raceCheckbox = document.getElementById('race-checkbox');
+    const markdownCheckbox = document.getElementById('markdown-checkbox');
 
     function addMessage(content, isUser = false, isError = false) {
         const messageDiv = document.createElement('div');
@@ -55,6 +57,8 @@ document.addEventListener('DOMContentLoaded', () => {
         const selectedProviders = getSelectedProviders();
         const useReasoning = reasoningCheckbox && reasoningCheckbox.checked;
         const useStreaming = streamingCheckbox && streamingCheckbox.checked;
+        const race = raceCheckbox && raceCheckbox.checked;
+        const useMarkdown = markdownCheckbox && markdownCheckbox.checked;
 
         if (message && Object.keys(selectedProviders).length > 0) {
             addMessage(message, true);
@@ -64,37 +68,60 @@ document.addEventListener('DOMContentLoaded', () => {
                 comparisonContainer.innerHTML = '';
                 comparisonContainer.classList.remove('hidden');
                 
-                const eventSource = new EventSource(`/chat?message=${encodeURIComponent(message)}&providers=${encodeURIComponent(JSON.stringify(selectedProviders))}&use_reasoning=${useReasoning}&use_streaming=true`);
+                const eventSource = new EventSource(`/chat?message=${encodeURIComponent(message)}&providers=${encodeURIComponent(JSON.stringify(selectedProviders))}&use_reasoning=${useReasoning}&use_streaming=true&race=${race}`);
                 
-                let currentProvider = '';
-                let providerResponses = {};
+                const renderer = new StreamRender.StreamRenderer({ markdown: useMarkdown });
+                // Consecutive connection errors; the browser reconnects on its
+                // own (resuming from the last event it received), so only
+                // give up once it has stopped trying or keeps failing.
+                let failures = 0;
+
+                function ensureProviderColumn(provider) {
+                    if (!renderer.hasColumn(provider)) {
+                        const providerDiv = document.createElement('div');
+                        providerDiv.classList.add('mb-4');
+                        const heading = document.createElement('h3');
+                        heading.className = 'font-bold text-lg mb-2';
+                        heading.textContent = provider.charAt(0).toUpperCase() + provider.slice(1);
+                        const body = document.createElement(useMarkdown ? 'div' : 'p');
+                        body.className = useMarkdown ? 'bg-white rounded p-2 markdown' : 'bg-white rounded p-2 whitespace-pre-wrap';
+                        providerDiv.append(heading, body);
+                        comparisonContainer.appendChild(providerDiv);
+                        renderer.addColumn(provider, body);
+                    }
+                    return renderer.columns.get(provider).element;
+                }
 
                 eventSource.onmessage = function(event) {
-                    if (event.data === '[DONE]') {
-                        currentProvider = '';
-                    } else if (currentProvider === '') {
-                        currentProvider = event.data;
-                        if (!providerResponses[currentProvider]) {
-                            providerResponses[currentProvider] = '';
-                            const providerDiv = document.createElement('div');
-                            providerDiv.id = `streaming-${currentProvider}`;
-                            providerDiv.innerHTML = `
-                                <h3 class="font-bold text-lg mb-2">${currentProvider.charAt(0).toUpperCase() + currentProvider.slice(1)}</h3>
-                                <p class="bg-white rounded p-2"></p>
-                            `;
-                            comparisonContainer.appendChild(providerDiv);
-                        }
-                    } else {
-                        providerResponses[currentProvider] += event.data;
-                        const providerDiv = document.getElementById(`streaming-${currentProvider}`);
-                        if (providerDiv) {
-                            const responseP = providerDiv.querySelector('p');
-                            responseP.textContent = providerResponses[currentProvider];
+                    failures = 0;
+                    const payload = JSON.parse(event.data);
+                    if (payload.type === 'end') {
+                        eventSource.close();
+                        renderer.flush();
+                        return;
+                    }
+                    if (!payload.provider) {
+                        if (payload.type === 'error') {
+                            addMessage(payload.content, false, true);
                         }
+                        return;
+                    }
+
+                    const responseBody = ensureProviderColumn(payload.provider);
+                    if (payload.type === 'chunk') {
+                        renderer.append(payload.provider, payload.content);
+                    } else if (payload.type === 'error') {
+                        renderer.append(payload.provider, payload.content);
+                        responseBody.classList.add('text-red-500');
                     }
                 };
 
                 eventSource.onerror = function(event) {
+                    failures += 1;
+                    if (eventSource.readyState !== EventSource.CLOSED && failures < 3) {
+                        console.warn('EventSource connection lost, reconnecting:', event);
+                        return;
+                    }
                     console.error('EventSource failed:', event);
                     eventSource.close();
                     addMessage('Error: Unable to get a streaming response from the server.', false, true);
@@ -110,7 +137,8 @@ document.addEventListener('DOMContentLoaded', () => {
                             message, 
                             providers: selectedProviders, 
                             use_reasoning: useReasoning, 
-                            use_streaming: useStreaming 
+                            use_streaming: useStreaming,
+                            race
                         }),
                     });
 
@@ -0,0 +1,224 @@
+// Incremental rendering of streamed responses.
+//
+// Chunks are buffered per column and written once per animation frame, so
+// a burst of tokens costs one DOM update rather than one per token. Plain
+// text is appended as new text nodes, never by rewriting what is already on
+// screen. In markdown mode, finished blocks are rendered once and only the
+// trailing (still growing) block is re-rendered each frame; an open code
+// block is appended to in place. Either way the work per chunk depends on
+// the chunk (and at most the current block), not on the response length.
+//
+// Works as a plain <script> (window.StreamRender) and under node, which the
+// benchmark in bench/render_bench.js uses with a stub DOM.
+(function (root, factory) {
+    const api = factory();
+    if (typeof module === 'object' && module.exports) {
+        module.exports = api;
+    } else {
+        root.StreamRender = api;
+    }
+})(typeof self !== 'undefined' ? self : this, function () {
+    'use strict';
+
+    const FENCE = /^\s*```/;
+    const HEADING = /^(#{1,6})\s+(.*)$/;
+    const LIST_ITEM = /^\s*([-*+]|\d+[.)])\s+(.*)$/;
+    const QUOTE = /^\s*>\s?(.*)$/;
+
+    function escapeHtml(text) {
+        return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+    }
+
+    function renderInline(text) {
+        // Code spans first, so nothing inside them is formatted.
+        return text.split(/(`[^`\n]+`)/).map((part, i) => {
+            if (i % 2) {
+                return `<code>${escapeHtml(part.slice(1, -1))}</code>`;
+            }
+            return escapeHtml(part)
+                .replace(/\*\*(.+?)\*\*/g, '<strong>$1</strong>')
+                .replace(/(^|[^*\w])\*([^*\s][^*]*?)\*/g, '$1<em>$2</em>')
+                .replace(/\[([^\]]+)\]\((https?:\/\/[^\s)]+)\)/g, '<a href="$2" target="_blank" rel="noopener noreferrer">$1</a>');
+        }).join('');
+    }
+
+    function renderList(lines) {
+        // Lines that don't start an item continue the previous one.
+        const items = [];
+        for (const line of lines) {
+            const match = LIST_ITEM.exec(line);
+            if (match || !items.length) {
+                items.push(match ? match[2] : line.trim());
+            } else {
+                items[items.length - 1] += ' ' + line.trim();
+            }
+        }
+        const tag = /^\s*\d/.test(lines[0]) ? 'ol' : 'ul';
+        return `<${tag}>${items.map(item => `<li>${renderInline(item)}</li>`).join('')}</${tag}>`;
+    }
+
+    function renderBlock(text) {
+        // One block (no blank lines outside code) to HTML. Everything from
+        // the response is escaped; only the markup built here is HTML.
+        const lines = text.replace(/\n+$/, '').split('\n');
+        if (FENCE.test(lines[0])) {
+            const body = lines.slice(1);
+            if (body.length && FENCE.test(body[body.length - 1])) {
+                body.pop();
+            }
+            return `<pre><code>${escapeHtml(body.join('\n'))}</code></pre>`;
+        }
+        const heading = HEADING.exec(lines[0]);
+        if (heading && lines.length === 1) {
+            const level = heading[1].length;
+            return `<h${level}>${renderInline(heading[2])}</h${level}>`;
+        }
+        if (LIST_ITEM.test(lines[0])) {
+            return renderList(lines);
+        }
+        if (lines.every(line => QUOTE.test(line))) {
+            return `<blockquote>${lines.map(line => renderInline(QUOTE.exec(line)[1])).join('<br>')}</blockquote>`;
+        }
+        return `<p>${lines.map(renderInline).join('<br>')}</p>`;
+    }
+
+    class BlockSplitter {
+        // Splits streamed markdown into blocks as they complete: at a blank
+        // line, before and after a heading, and around fenced code. ``text``
+        // is the open block; scanning resumes where the last push stopped.
+        constructor() {
+            this.text = '';
+            this.pos = 0;
+            this.fence = false;
+        }
+
+        _cut(end, next) {
+            const block = this.text.slice(0, end);
+            this.text = this.text.slice(next);
+            this.pos = 0;
+            return block;
+        }
+
+        push(chunk) {
+            this.text += chunk;
+            const done = [];
+            let newline;
+            while ((newline = this.text.indexOf('\n', this.pos)) !== -1) {
+                const line = this.text.slice(this.pos, newline);
+                if (this.fence) {
+                    if (this.pos > 0 && FENCE.test(line)) {
+                        done.push(this._cut(newline, newline + 1));
+                        this.fence = false;
+                        continue;
+                    }
+                } else if (!line.trim()) {
+                    if (this.pos > 0) {
+                        done.push(this._cut(this.pos - 1, newline + 1));
+                    } else {
+                        this._cut(0, newline + 1);
+                    }
+                    continue;
+                } else if (FENCE.test(line) || HEADING.test(line)) {
+                    if (this.pos > 0) {
+                        done.push(this._cut(this.pos - 1, this.pos));
+                        continue;
+                    }
+                    if (!FENCE.test(line)) {
+                        done.push(this._cut(newline, newline + 1));
+                        continue;
+                    }
+                    this.fence = true;
+                }
+                this.pos = newline + 1;
+            }
+            return done;
+        }
+    }
+
+    class StreamRenderer {
+        // ``options.markdown`` turns on markdown rendering; ``schedule`` and
+        // ``document`` default to requestAnimationFrame and the page's
+        // document, and are replaced in the benchmark.
+        constructor(options = {}) {
+            this.markdown = Boolean(options.markdown);
+            this.doc = options.document || document;
+            this.schedule = options.schedule || (callback => requestAnimationFrame(callback));
+            this.columns = new Map();
+            this.dirty = new Set();
+            this.scheduled = false;
+        }
+
+        addColumn(key, element) {
+            const column = { element, pending: [] };
+            if (this.markdown) {
+                column.splitter = new BlockSplitter();
+                column.tail = this.doc.createElement('div');
+                column.code = null;
+                column.rendered = 0;
+                element.appendChild(column.tail);
+            }
+            this.columns.set(key, column);
+            return column;
+        }
+
+        hasColumn(key) {
+            return this.columns.has(key);
+        }
+
+        append(key, text) {
+            const column = this.columns.get(key);
+            column.pending.push(text);
+            this.dirty.add(column);
+            if (!this.scheduled) {
+                this.scheduled = true;
+                this.schedule(() => this.flush());
+            }
+        }
+
+        flush() {
+            // Writes everything buffered since the last frame.
+            this.scheduled = false;
+            for (const column of this.dirty) {
+                const text = column.pending.join('');
+                column.pending = [];
+                if (this.markdown) {
+                    this._renderMarkdown(column, text);
+                } else {
+                    column.element.appendChild(this.doc.createTextNode(text));
+                }
+            }
+            this.dirty.clear();
+        }
+
+        _renderMarkdown(column, text) {
+            const splitter = column.splitter;
+            for (const block of splitter.push(text)) {
+                const element = this.doc.createElement('div');
+                element.innerHTML = renderBlock(block);
+                column.element.insertBefore(element, column.tail);
+                column.code = null;
+            }
+            const open = splitter.text;
+            const firstLine = open.indexOf('\n');
+            if (splitter.fence && firstLine !== -1) {
+                // Open code block: only the new text is appended.
+                if (column.code === null) {
+                    const pre = this.doc.createElement('pre');
+                    column.code = this.doc.createElement('code');
+                    pre.appendChild(column.code);
+                    column.tail.textContent = '';
+                    column.tail.appendChild(pre);
+                    column.rendered = firstLine + 1;
+                }
+                column.code.appendChild(this.doc.createTextNode(open.slice(column.rendered)));
+                column.rendered = open.length;
+            } else {
+                column.code = null;
+                column.tail.innerHTML = open ? renderBlock(open) : '';
+            }
+        }
+    }
+
+    return { StreamRenderer, BlockSplitter, renderBlock, renderInline, escapeHtml };
+});
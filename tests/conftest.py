@@ -0,0 +1,59 @@
+import time
+import pytest
+from app import create_app
+from bench.mock_llm_server import start_mock_server, MockSettings
+from config import Config
+from app.conversation_store import get_store
+from app.llm_providers import LLMProvider, register_provider
+
+
+@register_provider
+class FakeProvider(LLMProvider):
+    # Answers in-process: "slow" takes FakeProvider.delay seconds, "fail"
+    # raises, anything else is echoed back.
+    name = 'fake'
+    delay = 0.5
+
+    @classmethod
+    def is_configured(cls):
+        return True
+
+    def _complete(self, messages, model):
+        message = messages[-1]['content']
+        if message == 'slow':
+            time.sleep(self.delay)
+        if message == 'fail':
+            raise ValueError("bad request")
+        return f"echo: {message}"
+
+    def _stream(self, messages, model):
+        yield self._complete(messages, model)
+
+
+@pytest.fixture
+def client():
+    return create_app().test_client()
+
+
+@pytest.fixture
+def stored_history(client):
+    def load(provider='fake'):
+        with client.session_transaction() as session:
+            conversation_id = session.get('conversation_id')
+        return get_store().load(conversation_id, provider)
+    return load
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    # The mock LLM server from bench/, with the OpenAI and Anthropic SDKs
+    # pointed at it. The per-server API key gets the tests their own clients.
+    server = start_mock_server(MockSettings(latency=0, token_rate=0, tokens=5))
+    key = f"mock-{server.server_address[1]}"
+    monkeypatch.setenv('OPENAI_BASE_URL', f"{server.url}/v1")
+    monkeypatch.setenv('ANTHROPIC_BASE_URL', server.url)
+    monkeypatch.setattr(Config, 'OPENAI_API_KEY', key)
+    monkeypatch.setattr(Config, 'ANTHROPIC_API_KEY', key)
+    yield server
+    server.shutdown()
+    server.server_close()
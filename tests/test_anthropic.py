@@ -0,0 +1,65 @@
+from app.conversation_store import MemoryConversationStore
+from app.llm_providers import get_provider_class
+from app.metrics import prompt_cache_tokens
+from config import Config
+import asyncio
+
+ANSWER = ['lorem ', 'ipsum ', 'dolor ', 'sit ', 'amet ']
+CONVERSATION = [
+    {'role': 'system', 'content': 'Be brief.'},
+    {'role': 'user', 'content': 'one'},
+    {'role': 'assistant', 'content': 'first'},
+    {'role': 'user', 'content': 'two'},
+    {'role': 'assistant', 'content': 'second'},
+    {'role': 'user', 'content': 'three'},
+]
+
+
+def provider():
+    return get_provider_class('anthropic').load(MemoryConversationStore(), 'conversation')
+
+
+def cached(turn):
+    return isinstance(turn['content'], list) and turn['content'][0].get('cache_control') == {'type': 'ephemeral'}
+
+
+def test_stream_yields_text_deltas(mock_llm):
+    assert list(provider().stream([{'role': 'user', 'content': 'hello'}], 'claude-stream')) == ANSWER
+
+
+def test_astream_yields_text_deltas(mock_llm):
+    async def collect():
+        return [chunk async for chunk in provider().astream([{'role': 'user', 'content': 'hello'}], 'claude-astream')]
+
+    assert asyncio.run(collect()) == ANSWER
+
+
+def test_prompt_caching_marks_the_last_two_user_turns(monkeypatch):
+    monkeypatch.setattr(Config, 'ANTHROPIC_PROMPT_CACHING', True)
+    request = provider()._request(CONVERSATION, 'claude')
+    assert request['system'] == 'Be brief.'
+    assert [cached(turn) for turn in request['messages']] == [False, False, True, False, True]
+    assert request['messages'][-1]['content'][0]['text'] == 'three'
+
+
+def test_prompt_caching_off_sends_plain_turns(monkeypatch):
+    monkeypatch.setattr(Config, 'ANTHROPIC_PROMPT_CACHING', False)
+    request = provider()._request(CONVERSATION, 'claude')
+    assert request['messages'] == CONVERSATION[1:]
+
+
+def test_cached_prefix_is_read_on_the_next_turn(mock_llm, monkeypatch):
+    monkeypatch.setattr(Config, 'ANTHROPIC_PROMPT_CACHING', True)
+    llm = provider()
+    llm.generate_response('one', 'claude-cache')
+    llm.generate_response('two', 'claude-cache')
+    reads = [line for line in prompt_cache_tokens.render() if 'claude-cache' in line and 'kind="read"' in line]
+    assert reads and not reads[0].endswith(' 0')
+
+
+def test_max_tokens_is_passed_through(mock_llm, monkeypatch):
+    monkeypatch.setattr(Config, 'ANTHROPIC_MAX_TOKENS', 3)
+    llm = provider()
+    assert llm._request([{'role': 'user', 'content': 'hello'}], 'claude')['max_tokens'] == 3
+    # The mock stops after max_tokens tokens, like the real API.
+    assert list(llm.stream([{'role': 'user', 'content': 'hello'}], 'claude-max-tokens')) == ANSWER[:3]
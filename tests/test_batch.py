@@ -0,0 +1,60 @@
+from app.batch import read_prompts, load_checkpoint, run_batch, plan_jobs, format_row, csv_header
+from config import Config
+import json
+import pytest
+
+
+def test_read_prompts_skips_blank_lines_and_numbers_ids():
+    prompts = list(read_prompts(['{"prompt": "a"}', '', b'{"prompt": "b", "id": "x"}']))
+    assert [(p['id'], p['prompt']) for p in prompts] == [(1, 'a'), ('x', 'b')]
+
+
+@pytest.mark.parametrize('line, error', [
+    ('{"prompt": ', 'Invalid JSON on line 2'),
+    ('{"id": 1}', "Line 2 needs a string 'prompt'"),
+    ('["a"]', "Line 2 needs a string 'prompt'"),
+])
+def test_read_prompts_rejects_bad_lines(line, error):
+    with pytest.raises(ValueError, match=error):
+        list(read_prompts(['{"prompt": "a"}', line]))
+
+
+def row(id, status):
+    return {'id': id, 'provider': 'fake', 'model': 'fake-1', 'status': status, 'latency': 0.1,
+            'prompt_tokens': 1, 'completion_tokens': 1, 'response': 'r', 'error': None}
+
+
+@pytest.mark.parametrize('fmt', ['jsonl', 'csv'])
+def test_checkpoint_drops_a_truncated_last_row(tmp_path, fmt):
+    path = tmp_path / f"out.{fmt}"
+    complete = (csv_header() if fmt == 'csv' else '') + format_row(row(1, 'ok'), fmt)
+    path.write_text(complete + format_row(row(2, 'ok'), fmt)[:-10], encoding='utf-8')
+    assert load_checkpoint(str(path), fmt) == {('1', 'fake', 'fake-1')}
+    assert path.read_bytes().decode('utf-8') == complete
+
+
+def test_resume_reruns_only_failed_calls(tmp_path):
+    path = tmp_path / 'out.jsonl'
+    path.write_text(format_row(row(1, 'ok'), 'jsonl') + format_row(row(2, 'error'), 'jsonl'), encoding='utf-8')
+    completed = load_checkpoint(str(path), 'jsonl')
+    prompts = [{'id': 1, 'prompt': 'one'}, {'id': 2, 'prompt': 'two'}, {'id': 3, 'prompt': 'three'}]
+    rows = run_batch(plan_jobs(prompts, {'fake': 'fake-1'}), concurrency=2, completed=completed)
+    assert sorted(r['id'] for r in rows) == [2, 3]
+
+
+def test_batch_route_runs_against_the_mock(client, mock_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'BATCH_DIR', str(tmp_path))
+    body = '\n'.join(json.dumps({'prompt': prompt}) for prompt in ('one', 'two'))
+    query = {'providers': json.dumps({'openai': 'gpt-batch'}), 'name': 'run'}
+    response = client.post('/batch', data=body, query_string=query)
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.headers['X-Batch-Resumed'] == '0'
+    assert sorted(r['id'] for r in rows) == [1, 2]
+    assert all(r['status'] == 'ok' and r['response'] for r in rows)
+    requests = mock_llm.requests
+
+    response = client.post('/batch', data=body, query_string=query)
+    assert response.headers['X-Batch-Resumed'] == '2'
+    assert response.get_data(as_text=True) == ''
+    assert mock_llm.requests == requests
+    assert len((tmp_path / 'run.jsonl').read_text().splitlines()) == 2
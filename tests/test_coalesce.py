@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from app.coalesce import AsyncSingleFlight, FlightAbandoned
+
+KEY = ('groq', 'llama-3.1-8b-instant', 'stream', (('user', 'hi'),))
+
+
+def upstream(chunks, closed, delay=0.01):
+    async def stream():
+        try:
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield chunk
+        finally:
+            closed.append(True)
+    return stream
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_followers_get_the_whole_stream_when_the_leader_is_cancelled():
+    async def main():
+        flights = AsyncSingleFlight()
+        closed = []
+        chunks = [f"c{i}" for i in range(10)]
+        leader = asyncio.create_task(collect(flights.stream(KEY, upstream(chunks, closed))))
+        await asyncio.sleep(0.025)
+        follower = asyncio.create_task(collect(flights.stream(KEY, upstream(chunks, closed))))
+        await asyncio.sleep(0.025)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, closed
+
+    received, closed = asyncio.run(main())
+    assert received == [f"c{i}" for i in range(10)]
+    assert closed == [True]
+
+
+def test_upstream_is_cancelled_when_every_subscriber_leaves():
+    async def main():
+        flights = AsyncSingleFlight()
+        closed = []
+        chunks = [f"c{i}" for i in range(100)]
+        first = asyncio.create_task(collect(flights.stream(KEY, upstream(chunks, closed))))
+        second = asyncio.create_task(collect(flights.stream(KEY, upstream(chunks, closed))))
+        await asyncio.sleep(0.03)
+        first.cancel()
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flights, closed
+
+    flights, closed = asyncio.run(main())
+    assert closed == [True]
+    assert flights._flights == {}
+
+
+def test_late_subscriber_after_abandon_sees_no_truncated_success():
+    async def main():
+        flights = AsyncSingleFlight()
+        closed = []
+        stream = flights.stream(KEY, upstream([f"c{i}" for i in range(100)], closed))
+        task = asyncio.create_task(collect(stream))
+        await asyncio.sleep(0.03)
+        flight = flights._flights[KEY]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flight
+
+    flight = asyncio.run(main())
+    assert flight.finished
+    assert isinstance(flight.error, FlightAbandoned)
+
+
+def test_upstream_errors_reach_every_subscriber():
+    async def failing():
+        yield 'partial'
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def main():
+        flights = AsyncSingleFlight()
+        results = await asyncio.gather(collect(flights.stream(KEY, failing)), collect(flights.stream(KEY, failing)),
+                                       return_exceptions=True)
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
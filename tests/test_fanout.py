@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from app import fanout
+from app.cancellation import is_cancelled
+from app.fanout import fan_out, multiplex, FanOutTimeout
+from app.conversation_store import MemoryConversationStore
+from app.llm_providers import get_provider_class
+from config import Config
+
+
+def test_queue_time_does_not_count_against_the_timeout():
+    calls = {i: (lambda: time.sleep(0.15) or 'ok') for i in range(Config.FANOUT_MAX_WORKERS + 4)}
+    results = fan_out(calls, timeout=0.25)
+    assert all(ok for ok, _ in results.values())
+
+
+def test_running_calls_time_out():
+    release = threading.Event()
+    results = fan_out({'slow': lambda: release.wait(5), 'fast': lambda: 'ok'}, timeout=0.1)
+    release.set()
+    assert results['fast'] == (True, 'ok')
+    assert not results['slow'][0] and isinstance(results['slow'][1], FanOutTimeout)
+
+
+def test_calls_queued_behind_stuck_workers_time_out():
+    release = threading.Event()
+    stuck = {i: (lambda: release.wait(5)) for i in range(Config.FANOUT_MAX_WORKERS)}
+    try:
+        fan_out(stuck, timeout=0.1)
+        start = time.monotonic()
+        results = fan_out({'fast': lambda: 'ok'}, timeout=0.1)
+        assert time.monotonic() - start < 0.5
+        assert isinstance(results['fast'][1], FanOutTimeout)
+        assert 'not started' in str(results['fast'][1])
+    finally:
+        release.set()
+
+
+def test_timed_out_calls_are_cancelled():
+    seen = {}
+
+    def call():
+        time.sleep(0.2)
+        seen['cancelled'] = is_cancelled()
+
+    fan_out({'slow': call}, timeout=0.05)
+    time.sleep(0.3)
+    assert seen == {'cancelled': True}
+
+
+def test_timed_out_provider_call_gives_its_worker_back(mock_llm):
+    mock_llm.settings.latency = 5
+    llm = get_provider_class('openai').load(MemoryConversationStore(), 'conversation')
+    finished = threading.Event()
+
+    def call():
+        try:
+            return llm.complete([{'role': 'user', 'content': 'hello'}], 'slow-complete-model')
+        finally:
+            finished.set()
+
+    results = fan_out({'openai': call}, timeout=0.2)
+    assert isinstance(results['openai'][1], FanOutTimeout)
+    assert finished.wait(1)
+    assert mock_llm.requests == 1
+
+
+def test_open_streams_do_not_starve_fan_out():
+    release = threading.Event()
+
+    def blocked():
+        release.wait(5)
+        yield 'chunk'
+
+    streams = multiplex({i: blocked for i in range(Config.FANOUT_MAX_WORKERS + 4)})
+    consumer = threading.Thread(target=lambda: list(streams))
+    consumer.start()
+    try:
+        time.sleep(0.05)
+        start = time.monotonic()
+        results = fan_out({'call': lambda: 'ok'}, timeout=1)
+        assert results['call'] == (True, 'ok')
+        assert time.monotonic() - start < 0.5
+    finally:
+        release.set()
+        consumer.join()
+
+
+def test_streams_still_queued_when_the_consumer_stops_are_not_opened(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(fanout, '_stream_executor', executor)
+    release = threading.Event()
+    opened = []
+
+    def open_stream(key):
+        def open():
+            opened.append(key)
+            release.wait(5)
+            return iter(['chunk'])
+        return open
+
+    events = multiplex({'a': open_stream('a'), 'b': open_stream('b')}, timeout=lambda: 0.01)
+    assert next(events) == (None, 'idle', None)
+    events.close()
+    release.set()
+    executor.shutdown(wait=True)
+    assert opened == ['a']
+
+
+def test_abandoned_stream_releases_a_stalled_upstream(mock_llm):
+    # Ten seconds to each token: without the cancel scope the pump would sit
+    # in the read until then.
+    mock_llm.settings.token_rate = 0.1
+    llm = get_provider_class('openai').load(MemoryConversationStore(), 'conversation')
+    closed = threading.Event()
+
+    def open_stream():
+        try:
+            yield from llm.stream([{'role': 'user', 'content': 'hello'}], 'stalled-model')
+        finally:
+            closed.set()
+
+    events = multiplex({'openai': open_stream}, timeout=lambda: 0.3)
+    assert next(events) == (None, 'idle', None)
+    events.close()
+    assert closed.wait(2)
+
+
+def test_cancelling_the_leader_keeps_a_coalesced_stream_for_followers(mock_llm):
+    mock_llm.settings.token_rate = 10
+    llm = get_provider_class('openai').load(MemoryConversationStore(), 'conversation')
+    messages = [{'role': 'user', 'content': 'hello'}]
+
+    def open_stream():
+        return llm.stream(messages, 'coalesced-model')
+
+    leader = multiplex({'openai': open_stream})
+    assert next(leader)[1] == 'chunk'
+    follower = multiplex({'openai': open_stream})
+    events = [next(follower)]
+    leader.close()
+    events += list(follower)
+    assert events[-1] == ('openai', 'done', None)
+    assert ''.join(value for _, kind, value in events if kind == 'chunk').split() == ['lorem', 'ipsum', 'dolor', 'sit', 'amet']
+    assert mock_llm.requests == 1
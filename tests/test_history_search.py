@@ -0,0 +1,32 @@
+from app import conversation_log
+from config import Config
+import pytest
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'CONVERSATION_LOG', True)
+    monkeypatch.setattr(Config, 'CONVERSATION_LOG_PATH', str(tmp_path / 'log.db'))
+    monkeypatch.setattr(conversation_log, '_log', None)
+    log = conversation_log.get_conversation_log()
+    for i in range(3):
+        log.record('conversation', 'fake', 'fake-1', 'user', f"quokka {i}")
+    log.flush()
+    yield log
+    log.close()
+
+
+def test_search_is_off_unless_enabled(client, log):
+    assert client.get('/history/search?q=quokka').status_code == 404
+
+
+def test_search_clamps_limit_and_offset(client, log, monkeypatch):
+    monkeypatch.setattr(Config, 'HISTORY_SEARCH', True)
+    assert len(client.get('/history/search?q=quokka').json['results']) == 3
+    assert client.get('/history/search?q=quokka&limit=-1').json['results'] == []
+    assert len(client.get('/history/search?q=quokka&offset=-5').json['results']) == 3
+
+
+def test_conversation_transcripts_are_not_served(client, log, monkeypatch):
+    monkeypatch.setattr(Config, 'HISTORY_SEARCH', True)
+    assert client.get('/history/conversation').status_code == 404
@@ -0,0 +1,49 @@
+from app.conversation_store import MemoryConversationStore
+from app.llm_providers import get_provider_class
+import asyncio
+import pytest
+import threading
+
+
+class ThreadRecordingStore(MemoryConversationStore):
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def append(self, conversation_id, provider, message):
+        self.threads.append(threading.current_thread())
+        super().append(conversation_id, provider, message)
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_async_stream_persists_off_the_event_loop():
+    store = ThreadRecordingStore()
+    llm = get_provider_class('fake').load(store, 'conversation')
+    chunks = asyncio.run(collect(llm.agenerate_stream('hello', 'fake-1')))
+    assert chunks == ['echo: hello']
+    assert [m['content'] for m in store.load('conversation', 'fake')] == ['hello', 'echo: hello']
+    assert len(store.threads) == 2
+    assert threading.main_thread() not in store.threads
+
+
+def test_failed_stream_saves_no_turns():
+    store = MemoryConversationStore()
+    llm = get_provider_class('fake').load(store, 'conversation')
+    with pytest.raises(Exception):
+        list(llm.generate_stream('fail', 'fake-1'))
+    with pytest.raises(Exception):
+        asyncio.run(collect(llm.agenerate_stream('fail', 'fake-1')))
+    assert store.load('conversation', 'fake') == []
+
+
+def test_abandoned_stream_saves_no_turns():
+    store = MemoryConversationStore()
+    llm = get_provider_class('fake').load(store, 'conversation')
+    chunks = llm.generate_stream('gone', 'fake-1')
+    assert next(chunks) == 'echo: gone'
+    chunks.close()
+    assert list(llm.generate_stream('hello', 'fake-1')) == ['echo: hello']
+    assert [m['content'] for m in store.load('conversation', 'fake')] == ['hello', 'echo: hello']
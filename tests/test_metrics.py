@@ -0,0 +1,37 @@
+from app.metrics import track_stream, time_to_first_token, inter_chunk_gap, requests_total, OTHER_MODEL
+from app.resilience import get_policy
+from config import Config
+from app.reasoning import REASONING_HEADER, FINAL_HEADER
+import time
+
+
+def series(metric, *labels):
+    return [line for line in metric.render() if f'model="{labels[0]}"' in line and f'mode="{labels[1]}"' in line]
+
+
+def test_reasoning_headers_are_not_timed():
+    def chunks():
+        yield REASONING_HEADER
+        time.sleep(0.1)
+        yield 'thinking'
+        yield FINAL_HEADER
+        yield 'answer'
+
+    assert ''.join(track_stream('fake', 'ttft-model', 'reasoning_stream', chunks())) == (
+        REASONING_HEADER + 'thinking' + FINAL_HEADER + 'answer')
+    lines = series(time_to_first_token, 'ttft-model', 'reasoning_stream')
+    assert any(line.startswith('llm_time_to_first_token_seconds_count') and line.endswith(' 1') for line in lines)
+    assert any('le="0.05"' in line and line.endswith(' 0') for line in lines)
+    gaps = series(inter_chunk_gap, 'ttft-model', 'reasoning_stream')
+    assert any(line.startswith('llm_inter_chunk_gap_seconds_count') and line.endswith(' 1') for line in gaps)
+
+
+def test_model_labels_are_bounded_per_provider(monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_MAX_MODELS', 2)
+    for model in ('one', 'two', 'three', 'four'):
+        requests_total.inc('bounded', model, 'response', 'ok')
+    lines = [line for line in requests_total.render() if 'provider="bounded"' in line]
+    assert [line.split('model="')[1].split('"')[0] for line in lines] == ['one', OTHER_MODEL, 'two']
+    assert lines[1].endswith(' 2')
+    assert get_policy('bounded', 'five') is get_policy('bounded', 'six')
+    assert get_policy('bounded', 'one') is not get_policy('bounded', 'six')
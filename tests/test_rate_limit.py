@@ -0,0 +1,51 @@
+from app.rate_limit import AdaptiveConcurrency, ProviderLimiter, RECENT_SAMPLES, BASELINE_MIN_SAMPLES
+from config import Config
+import time
+
+
+def call(limiter, latency, model='m'):
+    limiter.try_acquire()
+    limiter.release(latency=latency, kind='stream', model=model)
+
+
+def test_single_slow_sample_does_not_decrease():
+    limiter = AdaptiveConcurrency(8, 1, 64, 2.0)
+    for _ in range(BASELINE_MIN_SAMPLES):
+        call(limiter, 0.2)
+    limit = limiter.limit
+    call(limiter, 5.0)
+    assert limiter.decreases == 0
+    assert limiter.limit > limit
+
+
+def test_sustained_latency_growth_decreases():
+    limiter = AdaptiveConcurrency(8, 1, 64, 2.0)
+    for _ in range(BASELINE_MIN_SAMPLES * 3):
+        call(limiter, 0.2)
+    for _ in range(RECENT_SAMPLES):
+        call(limiter, 1.0)
+    assert limiter.decreases == 1
+
+
+def test_baseline_is_per_model():
+    limiter = AdaptiveConcurrency(8, 1, 64, 2.0)
+    for _ in range(BASELINE_MIN_SAMPLES):
+        call(limiter, 0.2, model='fast')
+    for _ in range(RECENT_SAMPLES):
+        call(limiter, 3.0, model='slow')
+    assert limiter.decreases == 0
+
+
+def test_concurrency_limit_is_opt_in(monkeypatch):
+    monkeypatch.setattr(Config, 'ADAPTIVE_CONCURRENCY', False)
+    limiter = ProviderLimiter('test')
+    deadline = time.monotonic() + 1
+    for _ in range(Config.CONCURRENCY_MAX * 2):
+        limiter.concurrency.acquire(deadline, 0)
+    limiter.concurrency.release(overloaded=True)
+    assert limiter.stats()['concurrency_limit'] is None
+    assert limiter.stats()['in_flight'] == Config.CONCURRENCY_MAX * 2 - 1
+
+    monkeypatch.setattr(Config, 'ADAPTIVE_CONCURRENCY', True)
+    limiter = ProviderLimiter('test')
+    assert limiter.stats()['concurrency_limit'] == Config.CONCURRENCY_INITIAL
@@ -0,0 +1,55 @@
+import time
+from config import Config
+
+
+def chat(client, message, **options):
+    return client.post('/chat', json={'message': message, 'providers': {'fake': 'fake-1'}, **options})
+
+
+def test_successful_turns_are_saved(client, stored_history):
+    response = chat(client, 'hello')
+    assert response.json['responses']['fake'] == 'echo: hello'
+    assert [m['role'] for m in stored_history()] == ['user', 'assistant']
+
+
+def test_failed_calls_leave_no_turns(client, stored_history):
+    chat(client, 'hello')
+    response = chat(client, 'fail')
+    assert response.json['responses']['fake'].startswith('Error:')
+    assert [m['content'] for m in stored_history()] == ['hello', 'echo: hello']
+
+
+def test_timed_out_calls_are_not_saved_when_they_finish_late(client, stored_history, monkeypatch):
+    monkeypatch.setattr(Config, 'PROVIDER_TIMEOUT', 0.1)
+    chat(client, 'hello')
+    response = chat(client, 'slow')
+    assert 'timed out' in response.json['responses']['fake']
+    time.sleep(0.6)
+    assert [m['content'] for m in stored_history()] == ['hello', 'echo: hello']
+
+
+def test_race_returns_the_winner(client, stored_history):
+    response = chat(client, 'hello', race=True)
+    assert response.json == {'responses': {'fake': 'echo: hello'}, 'winner': 'fake'}
+    assert [m['content'] for m in stored_history()] == ['hello', 'echo: hello']
+
+
+def test_race_times_out(client, stored_history, monkeypatch):
+    monkeypatch.setattr(Config, 'PROVIDER_TIMEOUT', 0.1)
+    start = time.monotonic()
+    response = chat(client, 'slow', race=True)
+    assert response.status_code == 504
+    assert 'timed out' in response.json['error']
+    assert time.monotonic() - start < 0.4
+    time.sleep(0.6)
+    assert stored_history() == []
+
+
+def test_streaming_setup_errors_are_sent_as_events(client):
+    response = client.get('/chat', query_string={
+        'message': 'hello', 'providers': '{"missing": "model"}', 'use_streaming': 'true',
+    })
+    body = response.get_data(as_text=True)
+    assert response.content_type.startswith('text/event-stream')
+    assert '"type": "error"' in body and 'Unknown provider: missing' in body
+    assert body.rstrip().endswith('"type": "end"}')
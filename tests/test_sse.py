@@ -0,0 +1,52 @@
+from app.sse import format_event, ChunkCoalescer, HEARTBEAT
+import json
+import pytest
+import time
+
+
+def chunks(output):
+    # The chunk contents in SSE output, in order.
+    events = [json.loads(frame[len('data: '):]) for frame in output.split('\n\n') if frame.startswith('data: ')]
+    return [event['content'] for event in events if event['type'] == 'chunk']
+
+
+def test_format_event_splits_every_kind_of_line_break():
+    assert format_event('a\nb\r\nc\rd', event='message') == 'event: message\ndata: a\ndata: b\ndata: c\ndata: d\n\n'
+    assert format_event('') == 'data: \n\n'
+
+
+def test_first_chunk_is_sent_at_once_and_later_ones_wait_for_the_interval():
+    start = time.monotonic()
+    coalescer = ChunkCoalescer(interval=0.1, max_bytes=100, heartbeat=0)
+    assert chunks(coalescer.push('p', 'chunk', 'a', now=start)) == ['a']
+    assert coalescer.push('p', 'chunk', 'b', now=start) == ''
+    assert coalescer.push('p', 'chunk', 'c', now=start + 0.05) == ''
+    assert coalescer.timeout(now=start + 0.05) == pytest.approx(0.05)
+    assert chunks(coalescer.tick(now=start + 0.1)) == ['bc']
+
+
+def test_buffer_is_flushed_when_it_reaches_max_bytes():
+    start = time.monotonic()
+    coalescer = ChunkCoalescer(interval=10, max_bytes=4, heartbeat=0)
+    coalescer.push('p', 'chunk', 'first', now=start)
+    assert coalescer.push('p', 'chunk', 'ab', now=start) == ''
+    assert chunks(coalescer.push('p', 'chunk', 'cd', now=start)) == ['abcd']
+
+
+def test_done_flushes_its_provider_first():
+    start = time.monotonic()
+    coalescer = ChunkCoalescer(interval=10, max_bytes=100, heartbeat=0)
+    coalescer.push('p', 'chunk', 'first', now=start)
+    coalescer.push('p', 'chunk', 'rest', now=start)
+    output = coalescer.push('p', 'done', None, now=start)
+    assert chunks(output) == ['rest']
+    assert output.index('"chunk"') < output.index('"done"')
+
+
+def test_heartbeat_is_sent_only_after_a_quiet_period():
+    start = time.monotonic()
+    coalescer = ChunkCoalescer(interval=10, max_bytes=100, heartbeat=1)
+    coalescer.push('p', 'chunk', 'a', now=start)
+    assert coalescer.tick(now=start + 0.5) == ''
+    assert coalescer.tick(now=start + 1) == HEARTBEAT
+    assert coalescer.tick(now=start + 1.5) == ''
@@ -0,0 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from app import stream_sessions
+from app.stream_sessions import StreamSession, StreamSessionManager
+from config import Config
+import threading
+
+
+def test_streams_beyond_the_producer_limit_are_counted_as_queued(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(stream_sessions, '_producer_executor', executor)
+    monkeypatch.setattr(Config, 'STREAM_SESSION_MAX_WORKERS', 1)
+    manager = StreamSessionManager(StreamSession)
+    release = threading.Event()
+
+    def produce(should_stop):
+        release.wait(5)
+        yield 'data: done\n\n'
+
+    first = manager.start('owner', produce)
+    second = manager.start('owner', produce)
+    assert manager.stats() == {'producing': 1, 'queued': 1}
+    release.set()
+    executor.shutdown(wait=True)
+    assert manager.stats() == {'producing': 0, 'queued': 0}
+    assert first.finished and second.finished